@@ -0,0 +1,164 @@
+from argparse import ArgumentParser
+import asyncio
+from collections.abc import Sequence
+from pathlib import Path
+import re
+import shlex
+from subprocess import CalledProcessError, Popen
+from asyncio import sleep
+from threading import Thread
+from time import time
+import sys
+
+from psutil import NoSuchProcess, Process
+
+sys.path.append(str(Path(__file__).parent.parent))
+from scripts.config import BALLOON_CFG, DEFAULT_DISK, ModeAction
+from scripts.cpuset import layout
+from scripts.qemu import Disk, qemu_vm
+from scripts.utils import SSHExec, parse_meminfo, rm_ansi_escape, setup, update_meta
+
+MILESTONES = {
+    "kernel": re.compile(r"Linux version"),
+    "userspace": re.compile(r"Run \S+ as init process"),
+}
+"""Serial console lines of the boot phases"""
+
+
+class BootLog:
+    """Timestamps the serial output of qemu and records the host rss at every milestone."""
+
+    def __init__(self, qemu: Popen[str], start: float) -> None:
+        self.qemu = qemu
+        self.start = start
+        self.lines: list[tuple[float, str]] = []
+        self.times: dict[str, float] = {}
+        self.rss: dict[str, int] = {}
+        self._thread = Thread(target=self._read, daemon=True)
+        self._thread.start()
+
+    def _read(self):
+        assert self.qemu.stdout
+        for line in self.qemu.stdout:
+            now = time() - self.start
+            self.lines.append((now, line))
+            for name, pattern in MILESTONES.items():
+                if name not in self.times and pattern.search(line):
+                    self.times[name] = now
+                    self.rss[name] = self.sample_rss()
+
+    def sample_rss(self) -> int:
+        try:
+            return Process(self.qemu.pid).memory_info().rss
+        except NoSuchProcess:
+            return 0
+
+    def save(self, file: Path):
+        with file.open("w+") as f:
+            for t, line in self.lines:
+                f.write(f"[{t:9.3f}] {rm_ansi_escape(line)}")
+
+
+async def wait_ready(qemu: Popen[str], ssh: SSHExec, timeout: float) -> None:
+    """Wait until the guest accepts ssh connections"""
+    async with asyncio.timeout(timeout):
+        while True:
+            assert qemu.poll() is None, "Qemu exited unexpectedly"
+            try:
+                await ssh.run("true", timeout=5)
+                return
+            except (CalledProcessError, asyncio.TimeoutError):
+                await sleep(0.1)
+
+
+async def main(argv: Sequence[str] | None = None):
+    parser = ArgumentParser(
+        description="Boot the vm with different memory sizes and core counts, measuring the boot phases and host memory"
+    )
+    parser.add_argument("--qemu")
+    parser.add_argument("--kernel")
+    parser.add_argument("--user", default="debian")
+    parser.add_argument("--img", default=str(DEFAULT_DISK))
+    parser.add_argument("--port", type=int, default=5222)
+    parser.add_argument("--qmp", type=int, default=5023)
+    parser.add_argument("-m", "--mem", type=int, nargs="+", default=[8, 16, 32, 64])
+    parser.add_argument("-c", "--cores", type=int, nargs="+", default=[8])
+    parser.add_argument("--core-start", type=int, default=0, help="First core the vm is pinned to")
+    parser.add_argument("-i", "--iter", type=int, default=3)
+    parser.add_argument("--iter-start", type=int, default=0,
+                        help="Index of the first iteration, continues the results of a previous run")
+    parser.add_argument("--settle", type=int, default=10,
+                        help="Seconds after the boot until the rss is measured again")
+    parser.add_argument("--timeout", type=int, default=600, help="Maximum boot time in seconds")
+    parser.add_argument(
+        "--mode", choices=list(BALLOON_CFG.keys()), required=True, action=ModeAction
+    )
+    Disk.args(parser)
+    args, root = setup(parser, argv)
+
+    # Continued runs append their iterations
+    append = args.iter_start > 0 and (root / "out.csv").exists()
+    outfile = (root / "out.csv").open("a+" if append else "w+")
+    if not append:
+        outfile.write("mem,cores,iter,kernel,userspace,ready,rss_kernel,rss_userspace,rss_ready,rss_settled,guest_total\n")
+
+    for mem in args.mem:
+        for cores in args.cores:
+            for i in range(args.iter_start, args.iter_start + args.iter):
+                name = f"{mem}_{cores}_{i}"
+                print(f"Boot m={mem} c={cores} i={i}")
+                qemu = None
+                log = None
+                try:
+                    min_mem = max(1, round(mem / 8))
+                    # fully plugged/deflated, the whole memory is available to the guest
+                    extra_args = BALLOON_CFG[args.mode](cores, mem, min_mem, mem)
+                    start = time()
+                    qemu = qemu_vm(
+                        args.qemu,
+                        args.port,
+                        args.kernel,
+                        cores,
+                        hda=args.img,
+                        disk=Disk.from_args(args),
+                        qmp_port=args.qmp,
+                        extra_args=extra_args,
+                        core_start=args.core_start,
+                    )
+                    log = BootLog(qemu, start)
+                    if i == args.iter_start:
+                        (root / f"cmd_{mem}_{cores}.sh").write_text(shlex.join(qemu.args))
+                    if mem == args.mem[0] and cores == args.cores[0] and i == args.iter_start:
+                        update_meta(root, "cpuset", layout())
+
+                    ssh = SSHExec(args.user, port=args.port)
+                    await wait_ready(qemu, ssh, args.timeout)
+                    ready = time() - start
+                    rss_ready = log.sample_rss()
+                    guest_total = parse_meminfo(await ssh.output("cat /proc/meminfo"))["MemTotal"]
+
+                    await sleep(args.settle)
+                    rss_settled = log.sample_rss()
+
+                    times = [log.times.get("kernel"), log.times.get("userspace"), ready]
+                    rss = [log.rss.get("kernel"), log.rss.get("userspace"), rss_ready, rss_settled]
+                    values = [mem, cores, i, *times, *rss, guest_total]
+                    outfile.write(",".join("" if v is None else f"{v}" for v in values) + "\n")
+                    outfile.flush()
+                    print(f"kernel={times[0]}s userspace={times[1]}s ready={ready:.2f}s rss={rss_ready / 1024**3:.2f}GiB")
+                except Exception as e:
+                    (root / f"exception_{name}.txt").write_text(str(e))
+                    raise e
+                finally:
+                    if qemu:
+                        qemu.terminate()
+                        qemu.wait(30)
+                    if log:
+                        log.save(root / f"boot_{name}.txt")
+                    await sleep(3)
+
+    outfile.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
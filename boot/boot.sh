@@ -0,0 +1,26 @@
+#!/bin/bash
+# Usage: boot.sh [modes...], by default all modes
+set -e
+ROOT="$(dirname "$0")"
+source $ROOT/../venv/bin/activate
+cd $ROOT
+
+MODES=("$@")
+if [ ${#MODES[@]} -eq 0 ]; then
+    MODES=(base-manual base-auto huge-manual virtio-mem llfree-manual llfree-auto)
+fi
+
+ARGS="-m 8 16 32 64 -c 8 -i3"
+for mode in "${MODES[@]}"; do
+    python3 bench.py --mode $mode $ARGS
+done
+
+# Core scaling, only for the manual balloons
+ARGS="-m 16 -c 1 2 4 8 16 -i3"
+for mode in "${MODES[@]}"; do
+    case $mode in
+        base-manual|llfree-manual)
+            python3 bench.py --mode $mode $ARGS --suffix $mode-cores
+            ;;
+    esac
+done
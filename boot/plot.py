@@ -0,0 +1,89 @@
+import warnings
+
+warnings.filterwarnings("ignore")
+
+import pandas as pd
+import seaborn as sns
+from pathlib import Path
+import json
+import matplotlib
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+from scripts.utils import dref_dataframe
+
+MODES = {
+    "base-manual": "virtio-balloon",
+    "base-auto": "virtio-balloon (FPR)",
+    "huge-manual": "virtio-balloon-huge",
+    "virtio-mem": "virtio-mem",
+    "llfree-manual": "HyperAlloc",
+    "llfree-auto": "HyperAlloc (auto)",
+}
+
+
+def init():
+    sns.set_style("whitegrid")
+    sns.set_context("poster", font_scale=0.75)
+    sns.set_palette("colorblind6")
+    matplotlib.rcParams["pdf.fonttype"] = 42
+    matplotlib.rcParams["ps.fonttype"] = 42
+
+
+def parse_logs(path: Path) -> pd.DataFrame:
+    meta = json.load((path / "meta.json").open())
+    data = pd.read_csv(path / "out.csv")
+    mode = meta["args"]["mode"]
+    data["mode"] = MODES.get(mode, mode)
+    # Host memory relative to the guest memory, 1 if the guest touched everything
+    for col in ["rss_ready", "rss_settled"]:
+        data[f"{col}_rel"] = data[col] / (data["mem"] * 1024**3)
+    return data
+
+
+def visualize(
+    paths: list[Path],
+    save_as: str | None = None,
+    out: Path = Path("out"),
+    height: float = 4,
+    aspect: float = 1.2,
+):
+    data = pd.concat([parse_logs(p) for p in paths])
+    order = [m for m in MODES.values() if m in data["mode"].unique()]
+
+    # Boot phases over the memory size, one column per core count
+    times = data.melt(
+        id_vars=["mode", "mem", "cores", "iter"],
+        value_vars=["kernel", "userspace", "ready"],
+        var_name="phase",
+        value_name="time",
+    )
+    p = sns.relplot(
+        times, kind="line", x="mem", y="time", hue="mode", hue_order=order,
+        style="phase", col="cores", marker="o", height=height, aspect=aspect,
+    )
+    p.set(xlabel="Guest Memory [GiB]", ylabel="Time since start [s]")
+    p.set_titles(col_template="{col_name} cores")
+
+    # Host memory after the boot
+    rss = data.melt(
+        id_vars=["mode", "mem", "cores", "iter"],
+        value_vars=["rss_ready_rel", "rss_settled_rel"],
+        var_name="when",
+        value_name="rss",
+    )
+    rss["when"] = rss["when"].map({"rss_ready_rel": "ready", "rss_settled_rel": "settled"})
+    q = sns.relplot(
+        rss, kind="line", x="mem", y="rss", hue="mode", hue_order=order,
+        style="when", col="cores", marker="o", height=height, aspect=aspect,
+    )
+    q.set(xlabel="Guest Memory [GiB]", ylabel="Host RSS / Guest Memory", ylim=(0, 1.1))
+    q.set_titles(col_template="{col_name} cores")
+
+    if save_as:
+        p.figure.savefig(out / f"{save_as}.pdf", bbox_inches="tight")
+        p.figure.savefig(out / f"{save_as}.svg", bbox_inches="tight")
+        q.figure.savefig(out / f"{save_as}_rss.pdf", bbox_inches="tight")
+        q.figure.savefig(out / f"{save_as}_rss.svg", bbox_inches="tight")
+        dref_dataframe(save_as, out, ["mode", "cores", "mem"], data[["mode", "cores", "mem", "ready"]])
+    return p, q
@@ -14,14 +14,16 @@ from qemu.qmp import QMPClient
 
 sys.path.append(str(Path(__file__).parent.parent))
 
-from scripts.config import BALLOON_CFG, DEFAULT_DISK, ModeAction
+from scripts.adaptive import Adaptive, gib_min
+from scripts.config import BALLOON_CFG, DEFAULT_DISK, IOThreads, ModeAction, VirtioMem
+from scripts.cpuset import check_numa, layout
 from scripts.measure import Measure
-from scripts.qemu import qemu_vm, qemu_wait_startup
+from scripts.qemu import Disk, Pinning, Topology, Transport, iothread_times, qemu_vm, qemu_wait_startup
 from scripts.utils import (
-    SSHExec,
     non_block_read,
     rm_ansi_escape,
     setup,
+    update_meta,
 )
 from scripts.vm_resize import VMResize
 
@@ -56,7 +58,11 @@ async def main(argv: Sequence[str] | None = None):
     parser.add_argument("--qmp", default=5023, type=int)
     parser.add_argument("-m", "--mem", type=int, default=8)
     parser.add_argument("-c", "--cores", type=int, default=8)
+    parser.add_argument("--core-start", type=int, default=0, help="First core the vm is pinned to")
     parser.add_argument("-i", "--iter", type=int, default=1)
+    parser.add_argument("--iter-start", type=int, default=0,
+                        help="Index of the first iteration, continues the results of a previous run")
+    Adaptive.args(parser)
     parser.add_argument("-r", "--repeat", type=int, default=1)
     parser.add_argument("--frag", action="store_true")
     parser.add_argument("--perf", action="store_true")
@@ -68,7 +74,15 @@ async def main(argv: Sequence[str] | None = None):
     parser.add_argument("--vfio", type=int,
                         help="Bound VFIO group for passthrough. This passes through all devices in the group")
     parser.add_argument("--vfio-dev", type=str, help="Device from a bound VFIO group for passthrough")
+    Disk.args(parser)
+    Transport.args(parser)
+    Pinning.args(parser)
+    Topology.args(parser)
+    IOThreads.args(parser)
+    VirtioMem.args(parser)
     parser.add_argument("--vmem-fraction", type=float, default=1 / 16)
+    parser.add_argument("--record-resizes", action="store_true",
+                        help="Save the requested and achieved size of every virtio-mem resize")
     parser.add_argument("--fpr-delay", type=int, help="Delay between reports in ms")
     parser.add_argument("--fpr-capacity", type=int, help="Size of the fpr buffer")
     parser.add_argument("--fpr-order", type=int, help="Report granularity")
@@ -80,10 +94,14 @@ async def main(argv: Sequence[str] | None = None):
     client = None
 
     try:
-        for i in range(args.iter):
+        adaptive = Adaptive.from_args(args)
+        for i in adaptive.iterations(args.iter, args.iter_start):
             print("start qemu...")
             min_mem = round(args.mem / 8)
-            extra_args = BALLOON_CFG[args.mode](args.cores, args.mem, min_mem, min_mem)
+            extra_args = BALLOON_CFG[args.mode](
+                args.cores, args.mem, min_mem, min_mem, args.sockets, args.host_nodes,
+                io=IOThreads.from_args(args), vmem=VirtioMem.from_args(args),
+            )
             if (x := args.fpr_delay) is not None:
                 extra_args += ["-append", f"page_reporting.page_reporting_delay={x}"]
             if (x := args.fpr_capacity) is not None:
@@ -96,20 +114,30 @@ async def main(argv: Sequence[str] | None = None):
                 args.port,
                 args.kernel,
                 args.cores,
+                sockets=args.sockets,
                 hda=args.img,
+                disk=Disk.from_args(args),
+                transport=Transport.from_args(args),
                 qmp_port=args.qmp,
                 extra_args=extra_args,
                 vfio_group=args.vfio,
                 vfio_device=args.vfio_dev,
+                core_start=args.core_start,
+                extra_cores=Pinning.from_args(args).cores(),
             )
             ps_proc = Process(qemu.pid)
 
             print("started")
-            if i == 0:
+            if i == args.iter_start:
                 (root / "cmd.sh").write_text(shlex.join(qemu.args))
+                update_meta(root, "cpuset", layout())
 
             await qemu_wait_startup(qemu, root / f"boot_{i}.txt")
-            ssh = SSHExec(args.user, port=args.port)
+            pinned = await Pinning.from_args(args).pin(args.qmp, qemu.pid)
+            (root / f"pinning_{i}.json").write_text(json.dumps(pinned))
+            ssh = await Transport.from_args(args).connect(
+                args.user, args.port, root / f"transport_{i}.json"
+            )
 
             # Check for the FPR configuration
             fpr_path = "/sys/module/page_reporting/parameters/"
@@ -127,10 +155,12 @@ async def main(argv: Sequence[str] | None = None):
                     (await ssh.output(f"cat {fpr_path}page_reporting_order")).strip()
                 )
 
+            # Used for the iothread cpu times and the virtio-mem resizing
+            client = QMPClient("compile vm")
+            await client.connect(("127.0.0.1", args.qmp))
+
             resize_callback = None
             if args.mode == "virtio-mem":
-                client = QMPClient("compile vm")
-                await client.connect(("127.0.0.1", args.qmp))
                 max_bytes = args.mem * 1024**3
                 min_bytes = min_mem * 1024**3
                 vm_resize = VMResize(
@@ -140,6 +170,9 @@ async def main(argv: Sequence[str] | None = None):
                     min_bytes,
                     min_bytes,
                     args.vmem_fraction,
+                    args.sockets,
+                    VirtioMem.from_args(args).block_bytes(),
+                    args.record_resizes,
                 )
                 resize_callback = vm_resize.auto_resize
 
@@ -177,6 +210,7 @@ async def main(argv: Sequence[str] | None = None):
             )
 
             await measure()
+            io_times = await iothread_times(client, qemu.pid)
 
             build_end = []
             delay_end = []
@@ -197,6 +231,10 @@ async def main(argv: Sequence[str] | None = None):
                 delay_end.append(await measure.wait(sec=args.delay))
 
             t_total, t_user, t_system = measure.times()
+            io_times = {
+                k: v - io_times.get(k, 0)
+                for k, v in (await iothread_times(client, qemu.pid)).items()
+            }
 
             # Signal perf to dump it's trace
             if perf:
@@ -224,10 +262,17 @@ async def main(argv: Sequence[str] | None = None):
                             "total": t_total,
                             "user": t_user,
                             "system": t_system,
+                            "iothreads": io_times,
                         },
                     }
                 )
             )
+            (root / f"numa_{i}.json").write_text(json.dumps(check_numa(qemu.pid)))
+            if resize_callback and args.record_resizes:
+                (root / f"resize_{i}.json").write_text(json.dumps(vm_resize.requests))
+            adaptive.add(
+                build=build_end[0], gib_min=gib_min(root / f"out_{i}.csv", build_end[0])
+            )
 
             if perf:
                 # Make sure perf finished writing the profile
@@ -237,6 +282,16 @@ async def main(argv: Sequence[str] | None = None):
             with (root / f"out_{i}.txt").open("a+") as f:
                 f.write(rm_ansi_escape(non_block_read(qemu.stdout)))
 
+            # The next iteration boots a new vm on the same ports
+            print("terminate...")
+            await client.disconnect()
+            client = None
+            qemu.terminate()
+            qemu.wait(60)
+            qemu = None
+            await sleep(3)
+
+        adaptive.save(root / "convergence.json")
     except Exception as e:
         (root / "exception.txt").write_text(str(e))
         if isinstance(e, CalledProcessError):
@@ -249,12 +304,13 @@ async def main(argv: Sequence[str] | None = None):
             (root / "error.txt").write_text(rm_ansi_escape(non_block_read(qemu.stdout)))
         raise e
     finally:
-        print("terminate...")
+        # Only left over after an error
         if client:
             await client.disconnect()
         if qemu:
+            print("terminate...")
             qemu.terminate()
-        await sleep(3)
+            await sleep(3)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,163 @@
+from argparse import ArgumentParser
+import asyncio
+from collections.abc import Sequence
+import json
+from math import ceil, exp, log
+from pathlib import Path
+import random
+import sys
+import traceback
+
+sys.path.append(str(Path(__file__).parent.parent))
+from compiling.bench import TARGET, main as bench
+from scripts.utils import setup
+
+PARAMS = {
+    # name: (argument, min, max, logarithmic)
+    "order": ("--fpr-order", 0, 10, False),
+    "delay": ("--fpr-delay", 10, 10000, True),
+    "capacity": ("--fpr-capacity", 8, 2048, True),
+}
+"""Free page reporting parameters of the guest and their search ranges"""
+
+
+def name(config: dict[str, int] | None) -> str:
+    if config is None:
+        return "default"
+    return f"o{config['order']}-d{config['delay']}-c{config['capacity']}"
+
+
+def sample(rng: random.Random) -> dict[str, int]:
+    config = {}
+    for param, (_, lo, hi, logarithmic) in PARAMS.items():
+        if logarithmic:
+            config[param] = round(exp(rng.uniform(log(lo), log(hi))))
+        else:
+            config[param] = rng.randint(lo, hi)
+    return config
+
+
+def pareto_fronts(results: dict[str, dict[str, float]]) -> list[list[str]]:
+    """Non-dominated sorting, minimizing both the footprint and the build time"""
+
+    def dominates(a: dict[str, float], b: dict[str, float]) -> bool:
+        return (
+            a["gib_min"] <= b["gib_min"] and a["build"] <= b["build"]
+            and (a["gib_min"] < b["gib_min"] or a["build"] < b["build"])
+        )
+
+    remaining = set(results)
+    fronts = []
+    while remaining:
+        front = [
+            c for c in remaining
+            if not any(dominates(results[o], results[c]) for o in remaining if o != c)
+        ]
+        fronts.append(sorted(front, key=lambda c: results[c]["gib_min"]))
+        remaining -= set(front)
+    return fronts
+
+
+def ranking(results: dict[str, dict[str, float]]) -> list[str]:
+    """Order by pareto front, and within a front by the footprint and time relative to the best"""
+    best_mem = min(r["gib_min"] for r in results.values())
+    best_time = min(r["build"] for r in results.values())
+    order = []
+    for front in pareto_fronts(results):
+        order += sorted(
+            front,
+            key=lambda c: results[c]["gib_min"] / best_mem + results[c]["build"] / best_time,
+        )
+    return order
+
+
+async def evaluate(
+    root: Path, target: str, config: dict[str, int] | None, args: list[str]
+) -> dict[str, float] | None:
+    """Run (or reuse) one configuration, returning the mean build time and GiB·min"""
+    out = root / target / name(config)
+    if not (out / "convergence.json").exists():
+        run_args = args + ["--target", target, "--mode", "base-auto"]
+        run_args += ["--root", str(root / target), "--suffix", name(config), "--no-timestamp"]
+        if config is not None:
+            for param, value in config.items():
+                run_args += [PARAMS[param][0], str(value)]
+        try:
+            await bench(run_args)
+        except Exception:
+            traceback.print_exc()
+            print(f"\033[33mWARNING: {target} {name(config)} failed\033[0m")
+            return None
+
+    metrics = json.loads((out / "convergence.json").read_text())["metrics"]
+    return {"build": metrics["build"]["mean"], "gib_min": metrics["gib_min"]["mean"]}
+
+
+async def main(argv: Sequence[str] | None = None):
+    parser = ArgumentParser(
+        description="Tune the free page reporting of virtio-balloon (base-auto) with successive halving."
+        " Arguments after `--` are passed to compiling/bench.py (e.g., -m16 -c12 --img ...)."
+    )
+    parser.add_argument("--stages", nargs="+", choices=list(TARGET.keys()), default=["write", "clang"],
+                        help="Targets of the halving stages, from cheap to expensive")
+    parser.add_argument("-n", "--configs", type=int, default=16, help="Number of sampled configurations")
+    parser.add_argument("--eta", type=int, default=2, help="Only the best 1/eta configurations advance to the next stage")
+    parser.add_argument("--seed", type=int, default=0)
+    for param, (_, lo, hi, _) in PARAMS.items():
+        parser.add_argument(f"--{param}", type=int, nargs="+",
+                            help=f"Fixed values instead of sampling from [{lo}, {hi}]")
+    argv = list(sys.argv[1:] if argv is None else argv)
+    split = argv.index("--") if "--" in argv else len(argv)
+    bench_args = argv[split + 1:]
+    args, root = setup(parser, argv[:split])
+    # The harness is already isolated by the tuner
+    bench_args += ["--housekeeping", "none"]
+
+    assert args.eta >= 2
+    rng = random.Random(args.seed)
+    configs: list[dict[str, int] | None] = [None]  # default parameters as baseline
+    for _ in range(args.configs * 10):
+        if len(configs) > args.configs:
+            break
+        config = sample(rng)
+        for param in PARAMS:
+            if values := getattr(args, param):
+                config[param] = rng.choice(values)
+        if config not in configs:
+            configs.append(config)
+
+    stages = []
+    for s, target in enumerate(args.stages):
+        print(f"\n\x1b[94mStage {s} ({target}): {len(configs)} configurations\x1b[0m")
+        results: dict[str, dict[str, float]] = {}
+        for config in configs:
+            if (result := await evaluate(root, target, config, bench_args)) is not None:
+                results[name(config)] = result
+        if not results:
+            raise Exception(f"All configurations failed on {target}")
+
+        order = ranking(results)
+        stages.append({
+            "target": target,
+            "results": results,
+            "configs": {name(c): c for c in configs},
+            "pareto": pareto_fronts(results)[0],
+            "ranking": order,
+        })
+        (root / "tune.json").write_text(json.dumps({"seed": args.seed, "stages": stages}))
+        for c in order:
+            print(f"{c:>20}: {results[c]['gib_min']:8.2f} GiB·min, {results[c]['build']:8.1f} s")
+
+        # Keep the best and the baseline for comparison
+        keep = order[: max(1, ceil(len(order) / args.eta))]
+        configs = [c for c in configs if name(c) in keep or c is None]
+
+    last = stages[-1]
+    print(f"\nPareto front ({last['target']}):")
+    for c in last["pareto"]:
+        r = last["results"][c]
+        print(f"{c:>20}: {r['gib_min']:8.2f} GiB·min, {r['build']:8.1f} s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -6,15 +6,22 @@ import shlex
 from subprocess import CalledProcessError
 from asyncio import sleep
 import csv
+import json
 import sys
+import tempfile
+from time import time
 
 from psutil import Process
 from qemu.qmp import QMPClient
 
 sys.path.append(str(Path(__file__).parent.parent))
-from scripts.config import BALLOON_CFG, DEFAULT_DISK, ModeAction
-from scripts.qemu import qemu_vm, qemu_wait_startup
-from scripts.utils import SSHExec, fmt_bytes, non_block_read, rm_ansi_escape, setup
+from scripts.adaptive import Adaptive
+from scripts.config import BALLOON_CFG, DEFAULT_DISK, DEFAULT_WRITE, IOThreads, ModeAction, VirtioMem
+from scripts.initramfs import AgentExec, build_initramfs
+from scripts.load import LOADS, BackgroundLoad
+from scripts.qemu import Disk, Pinning, Topology, Transport, iothread_times, qemu_vm, qemu_wait_startup
+from scripts.cpuset import check_numa, layout
+from scripts.utils import fmt_bytes, non_block_read, rm_ansi_escape, setup, update_meta
 from scripts.vm_resize import VMResize
 
 
@@ -30,9 +37,20 @@ async def main(argv: Sequence[str] | None = None):
     parser.add_argument("--qmp", type=int, default=5023)
     parser.add_argument("-m", "--mem", type=int, default=8)
     parser.add_argument("-c", "--cores", type=int, default=8)
+    parser.add_argument("--core-start", type=int, default=0, help="First core the vm is pinned to")
     parser.add_argument("-i", "--iter", type=int, default=1)
+    parser.add_argument("--iter-start", type=int, default=0,
+                        help="Index of the first iteration, continues the results of a previous run")
+    Adaptive.args(parser)
     parser.add_argument("--shrink-target", type=int, default=2)
     parser.add_argument("--delay", type=int, default=10)
+    parser.add_argument("--resize-timeout", type=int,
+                        help="Seconds until a resize is given up, records the achieved size instead of waiting forever")
+    parser.add_argument("--load", choices=list(LOADS.keys()),
+                        help="Guest load that runs during the shrink and grow")
+    parser.add_argument("--load-mem", type=int, default=1, help="Working set of the write and pagecache load in GiB")
+    parser.add_argument("--load-baseline", type=int, default=10,
+                        help="Seconds the load runs before the shrink, to measure its idle rate")
     parser.add_argument(
         "--mode", choices=list(BALLOON_CFG.keys()), required=True, action=ModeAction
     )
@@ -41,54 +59,110 @@ async def main(argv: Sequence[str] | None = None):
     parser.add_argument("--vfio", type=int,
                         help="Bound VFIO group for passthrough. This passes through all devices in the group")
     parser.add_argument("--vfio-dev", type=str, help="Device from a bound VFIO group for passthrough")
+    Disk.args(parser)
+    Transport.args(parser)
+    Pinning.args(parser)
+    Topology.args(parser)
+    IOThreads.args(parser)
+    VirtioMem.args(parser)
+    parser.add_argument("--initramfs", action="store_true",
+                        help="Boot a minimal initramfs with a virtio-serial agent instead of the disk image")
+    parser.add_argument("--write", default=str(DEFAULT_WRITE),
+                        help="Host binary of the write benchmark for the initramfs")
+    parser.add_argument("--busybox", default="busybox",
+                        help="Host busybox binary for the initramfs")
     args, root = setup(parser, argv)
 
     assert not (not args.nofault and args.module is None), "Need to specify a module"
+    assert not (args.load and args.initramfs), "The load requires ssh"
 
     qemu = None
     qmp = None
+    agent = None
     try:
+        initrd = None
+        socket = Path(tempfile.gettempdir()) / f"hyperalloc-agent-{args.qmp}.sock"
+        if args.initramfs:
+            module = None if args.nofault else args.module
+            initrd = build_initramfs(
+                root / "initramfs.cpio.gz", args.write, module, args.busybox
+            )
+            socket.unlink(missing_ok=True)
+
         print("start qemu...")
         # make it a little smaller to have some headroom
         min_mem = args.shrink_target
-        extra_args = BALLOON_CFG[args.mode](args.cores, args.mem, min_mem, args.mem)
+        extra_args = BALLOON_CFG[args.mode](
+            args.cores, args.mem, min_mem, args.mem, args.sockets, args.host_nodes,
+            io=IOThreads.from_args(args), vmem=VirtioMem.from_args(args),
+        )
         qemu = qemu_vm(
             args.qemu,
             args.port,
             args.kernel,
             args.cores,
+            sockets=args.sockets,
             hda=args.img,
+            disk=Disk.from_args(args),
+            transport=Transport.from_args(args),
             qmp_port=args.qmp,
             extra_args=extra_args,
             vfio_group=args.vfio,
             vfio_device=args.vfio_dev,
+            initrd=initrd,
+            agent=socket,
+            core_start=args.core_start,
+            extra_cores=Pinning.from_args(args).cores(),
         )
         ps_proc = Process(qemu.pid)
 
         (root / "cmd.sh").write_text(shlex.join(qemu.args))
-        await qemu_wait_startup(qemu, root / "boot.txt")
-        ssh = SSHExec(args.user, port=args.port)
+        update_meta(root, "cpuset", layout())
+        if args.initramfs:
+            ssh = agent = AgentExec(socket)
+            ready = await agent.connect()
+            print(f"agent ready after {ready:.2f}s")
+            with (root / "boot.txt").open("a+") as f:
+                f.write(rm_ansi_escape(non_block_read(qemu.stdout)))
+                f.write(f"\nagent ready after {ready:.2f}s\n")
+        else:
+            await qemu_wait_startup(qemu, root / "boot.txt")
+            ssh = await Transport.from_args(args).connect(
+                args.user, args.port, root / "transport.json"
+            )
 
         if not args.nofault and args.module:
             name = Path(args.module).name
-            await ssh.upload(args.module, name)
+            if not args.initramfs:  # the initramfs already contains the module
+                await ssh.upload(args.module, name)
             await ssh.run(f"sudo insmod {name}")
 
         qmp = QMPClient("STREAM machine")
         await qmp.connect(("127.0.0.1", args.qmp))
+        pinned = await Pinning.from_args(args).apply(qmp, qemu.pid)
+        (root / "pinning.json").write_text(json.dumps(pinned))
 
         max_bytes = args.mem * 1024**3
         min_bytes = min_mem * 1024**3
-        resize = VMResize(qmp, args.mode, max_bytes, min_bytes, max_bytes)
+        resize = VMResize(
+            qmp, args.mode, max_bytes, min_bytes, max_bytes,
+            nodes=args.sockets, block_size=VirtioMem.from_args(args).block_bytes(),
+        )
 
-        logfile = (root / "out.txt").open("w+")
+        # Continued runs append their iterations
+        append = args.iter_start > 0 and (root / "out.csv").exists()
+        logfile = (root / "out.txt").open("a+" if append else "w+")
 
-        outfile = (root / "out.csv").open("w+")
-        outfile.write("shrink,grow,touch,touch2\n")
-        outfile.flush()
+        outfile = (root / "out.csv").open("a+" if append else "w+")
+        if not append:
+            outfile.write("shrink,grow,touch,touch2,cpu,iothreads,requested,achieved,load_base,load_resize\n")
+            outfile.flush()
+
+        load = BackgroundLoad(ssh, args.load, args.cores, args.load_mem) if args.load else None
 
         print(f"Exec c={args.cores}")
-        for i in range(args.iter):
+        adaptive = Adaptive.from_args(args)
+        for i in adaptive.iterations(args.iter, args.iter_start):
             if qemu.poll() is not None:
                 raise Exception("Qemu crashed")
 
@@ -96,15 +170,30 @@ async def main(argv: Sequence[str] | None = None):
             if not args.nofault:
                 await ssh.run(f"./write -t{args.cores} -m{args.mem - 1}")
 
+            if load:
+                await load.start()
             await sleep(args.delay)
+            if load:
+                # Rate of the load without resizing
+                base_window = (time(), time() + args.load_baseline)
+                await sleep(args.load_baseline)
 
             target_bytes = args.shrink_target * 1024**3
+            # Host cpu time of qemu and its iothreads while shrinking and growing
+            cpu = ps_proc.cpu_times()
+            io_cpu = sum((await iothread_times(qmp, qemu.pid)).values())
 
             # Shrink / Inflate
+            start = time()
             await resize.set(target_bytes)
             while (size := await resize.query()) > 1.01 * target_bytes:
+                if args.resize_timeout is not None and time() - start > args.resize_timeout:
+                    print(f"\033[33mWARNING: inflate stopped at {fmt_bytes(size)}\033[0m")
+                    break
                 print("inflating", fmt_bytes(size))
                 await sleep(1)
+            achieved = size
+            shrink_window = (start, time())
             await sleep(args.delay)
 
             print(
@@ -115,12 +204,29 @@ async def main(argv: Sequence[str] | None = None):
             )
 
             # Grow / Deflate
+            start = time()
             await resize.set(max_bytes)
             while (size := await resize.query()) < 0.99 * max_bytes:
+                if args.resize_timeout is not None and time() - start > args.resize_timeout:
+                    print(f"\033[33mWARNING: deflate stopped at {fmt_bytes(size)}\033[0m")
+                    break
                 print("deflating", fmt_bytes(size))
                 await sleep(1)
+            grow_window = (start, time())
+
             await sleep(args.delay)
 
+            load_base = load_resize = ""
+            if load:
+                # Stopped after the delay, so that the units overlapping the grow have finished
+                await load.stop()
+                load_base = load.rate([base_window])
+                load_resize = load.rate([shrink_window, grow_window])
+                print(f"load: {load_base:.2f}/s idle, {load_resize:.2f}/s resizing")
+            cpu_end = ps_proc.cpu_times()
+            cpu = cpu_end.user + cpu_end.system - cpu.user - cpu.system
+            io_cpu = sum((await iothread_times(qmp, qemu.pid)).values()) - io_cpu
+
             touch = 0
             touch2 = 0
             if not args.nofault and args.module:
@@ -141,9 +247,12 @@ async def main(argv: Sequence[str] | None = None):
             logfile.flush()
 
             shrink, grow = parse_output(output, args.mode)
-            outfile.write(f"{shrink},{grow},{touch},{touch2}\n")
+            outfile.write(f"{shrink},{grow},{touch},{touch2},{cpu},{io_cpu},{target_bytes},{achieved},{load_base},{load_resize}\n")
             outfile.flush()
+            adaptive.add(shrink=shrink, grow=grow)
 
+        adaptive.save(root / "convergence.json")
+        (root / "numa.json").write_text(json.dumps(check_numa(qemu.pid)))
         logfile.write(rm_ansi_escape(non_block_read(qemu.stdout)))
     except Exception as e:
         print(e)
@@ -158,6 +267,8 @@ async def main(argv: Sequence[str] | None = None):
         raise e
     finally:
         print("terminate...")
+        if agent:
+            await agent.disconnect()
         if qmp:
             await qmp.disconnect()
         if qemu:
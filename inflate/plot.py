@@ -9,6 +9,7 @@ from pathlib import Path
 from matplotlib import patheffects
 import json
 import matplotlib
+import matplotlib.pyplot as plt
 import sys
 
 sys.path.append(str(Path(__file__).parent.parent))
@@ -156,3 +157,88 @@ def visualize(
         p.figure.savefig(out / f"{save_as}.svg", bbox_inches="tight")
         dref_dataframe(save_as, out, ["mode", "op"], pgd[["mode", "op", "time"]])
         (out / f"{save_as}.dref").open("a").write(f"\\drefset{{{save_as}/max_access}}{{{max_access}}}")
+
+
+def visualize_scaling(
+    file: Path,
+    save_as: str | None = None,
+    out: Path = Path("out"),
+    height: float = 3.5,
+    aspect: float = 1.2,
+):
+    """Throughput over the memory size (rows: operations, columns: vcpus) of `inflate/sweep.py`"""
+    data = pd.read_csv(file)
+    # The first iteration is a warmup
+    if data["iter"].max() > 0:
+        data = data[data["iter"] > 0]
+    names = {
+        "base-manual": "virtio-balloon",
+        "huge-manual": "virtio-balloon-huge",
+        "virtio-mem": "virtio-mem",
+        "llfree-manual": "HyperAlloc",
+    }
+    data["mode"] = data["mode"].map(lambda m: names.get(m, m))
+    pgd = data.melt(id_vars=["mode", "mem", "cores", "iter"],
+                    value_vars=["shrink", "grow", "touch", "install"],
+                    var_name="op", value_name="speed")
+    pgd = pgd[pgd["speed"] > 0]
+    ops = {"shrink": "Reclaim", "grow": "Return", "touch": "Install", "install": "Return + Install"}
+    pgd["op"] = pgd["op"].map(ops)
+    order = [m for m in names.values() if m in pgd["mode"].unique()]
+    row_order = [o for o in ops.values() if o in pgd["op"].unique()]
+
+    p = sns.relplot(pgd, kind="line", x="mem", y="speed", hue="mode", hue_order=order,
+                    row="op", row_order=row_order, col="cores", marker="o",
+                    height=height, aspect=aspect, facet_kws={"sharey": "row"})
+    p.set(xscale="log", yscale="log", xlabel="VM Memory [GiB]", ylabel="Speed [GiB/s]")
+    for ax in p.axes.flat:
+        ax.set_xticks(sorted(pgd["mem"].unique()), labels=map(str, sorted(pgd["mem"].unique())))
+    p.set_titles(row_template="{row_name}", col_template="{col_name} vCPUs")
+
+    if save_as:
+        p.figure.savefig(out / f"{save_as}.pdf", bbox_inches="tight")
+        p.figure.savefig(out / f"{save_as}.svg", bbox_inches="tight")
+        dref_dataframe(save_as, out, ["mode", "op", "cores", "mem"], pgd[["mode", "op", "cores", "mem", "speed"]])
+    return p
+
+
+def visualize_load(
+    paths: list[Path],
+    save_as: str | None = None,
+    out: Path = Path("out"),
+    height: float = 3.5,
+    aspect: float = 1.5,
+):
+    """Reclaim speed and the slowdown of the guest load (`--load`) while shrinking and growing"""
+    datas = []
+    for path in paths:
+        data = parse_logs(path)
+        data["load"] = json.load((path / "meta.json").open())["args"].get("load") or "idle"
+        datas.append(data)
+    data = pd.concat(datas, ignore_index=True)
+    if data["iter"].max() > 0:
+        data = data[data["iter"] > 0]
+    data["speed"] = 1 / data["shrink"]
+    if "load_resize" in data.columns:
+        # The load may not have progressed at all while resizing
+        data["slowdown"] = data["load_base"] / data["load_resize"].where(data["load_resize"] > 0)
+    else:
+        data["slowdown"] = math.nan
+    order = [m for m in ["virtio-balloon", "virtio-balloon-huge", "virtio-mem", "HyperAlloc"]
+             if m in data["mode"].unique()]
+    loads = [l for l in ["idle", "write", "pagecache", "spin"] if l in data["load"].unique()]
+
+    fig, axes = plt.subplots(1, 2, figsize=(2 * height * aspect, height))
+    sns.barplot(data, x="mode", y="speed", hue="load", order=order, hue_order=loads, ax=axes[0])
+    axes[0].set(xlabel=None, ylabel="Reclaim [GiB/s]")
+    sns.barplot(data[data["load"] != "idle"], x="mode", y="slowdown", hue="load", order=order,
+                hue_order=[l for l in loads if l != "idle"], ax=axes[1], legend=False)
+    axes[1].axhline(1, color="black", linewidth=1)
+    axes[1].set(xlabel=None, ylabel="Load Slowdown")
+    fig.tight_layout()
+
+    if save_as:
+        fig.savefig(out / f"{save_as}.pdf", bbox_inches="tight")
+        fig.savefig(out / f"{save_as}.svg", bbox_inches="tight")
+        dref_dataframe(save_as, out, ["mode", "load"], data[["mode", "load", "slowdown"]])
+    return fig
@@ -0,0 +1,76 @@
+from argparse import ArgumentParser
+import asyncio
+from collections.abc import Sequence
+import csv
+import json
+from pathlib import Path
+import sys
+
+import psutil
+
+sys.path.append(str(Path(__file__).parent.parent))
+from inflate.bench import main as bench
+from scripts.sweep import collect, grid, split_argv, sweep
+from scripts.utils import setup
+
+
+def throughput(out: Path) -> list[dict[str, float]]:
+    """Shrink, grow, touch, and install throughput in GiB/s of every iteration"""
+    meta = json.loads((out / "meta.json").read_text())
+    mem = meta["args"]["mem"]
+    reclaimed = mem - meta["args"]["shrink_target"]
+    rows = []
+    with (out / "out.csv").open() as f:
+        for row in csv.DictReader(f):
+            # The times are in ns, touch is measured for mem - 1 GiB
+            shrink, grow, touch = (int(row[k]) / 1e9 for k in ["shrink", "grow", "touch"])
+            rows.append({
+                "shrink": reclaimed / shrink if shrink else 0,
+                "grow": reclaimed / grow if grow else 0,
+                "touch": (mem - 1) / touch if touch else 0,
+                "install": (mem - 1) / (touch + grow) if touch else 0,
+            })
+    return rows
+
+
+async def main(argv: Sequence[str] | None = None):
+    parser = ArgumentParser(
+        description="Run the inflate benchmark for a grid of memory sizes and vcpu counts."
+        " Arguments after `--` are passed to inflate/bench.py (e.g., --shrink-target 2 --img ...)."
+    )
+    parser.add_argument("--modes", nargs="+", default=["base-manual", "huge-manual", "virtio-mem", "llfree-manual"])
+    parser.add_argument("-m", "--mem", type=int, nargs="+", default=[8, 16, 32, 64, 128, 256])
+    parser.add_argument("-c", "--cores", type=int, nargs="+", default=[4, 8, 16, 32])
+    parser.add_argument("-i", "--iter", type=int, default=3)
+    parser.add_argument("--plot", action="store_true", help="Plot the scaling curves afterwards")
+    sweep_argv, bench_args = split_argv(argv, sys.argv[1:])
+    args, root = setup(parser, sweep_argv)
+    bench_args += ["-i", f"{args.iter}"]
+
+    # Skip the configurations that do not fit on this host
+    host_mem = psutil.virtual_memory().total // 1024**3
+    # The last physical core is reserved for the housekeeping of the harness
+    host_cores = (psutil.cpu_count(logical=False) or 1) - 1
+    mem = [m for m in args.mem if m < host_mem]
+    cores = [c for c in args.cores if c <= host_cores]
+    if skipped := (set(args.mem) - set(mem)) | (set(args.cores) - set(cores)):
+        print(f"\033[33mWARNING: skipping {sorted(skipped)}, which exceed the host\033[0m")
+
+    points = grid(
+        {"mode": args.modes, "mem": mem, "cores": cores},
+        lambda v: ["--mode", v["mode"], f"-m{v['mem']}", f"-c{v['cores']}"],
+        lambda v: f"{v['mode']}-m{v['mem']}-c{v['cores']}",
+    )
+    results = await sweep(bench, root, points, bench_args)
+    collect(root / "sweep.csv", points, results, ["shrink", "grow", "touch", "install"],
+            lambda _, out: throughput(out))
+
+    if args.plot:
+        from inflate import plot as inflate_plot
+
+        inflate_plot.init()
+        inflate_plot.visualize_scaling(root / "sweep.csv", save_as="sweep", out=root)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,63 @@
+import warnings
+
+warnings.filterwarnings("ignore")
+
+import pandas as pd
+import seaborn as sns
+from pathlib import Path
+import matplotlib
+import matplotlib.pyplot as plt
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+from scripts.utils import dref_dataframe
+
+METRICS = {
+    "inflate": {"shrink": "Reclaim [GiB/s]", "grow": "Return [GiB/s]", "io_cpu": "Iothread CPU [s]"},
+    "compiling": {"gib_min": "Footprint [GiB·min]", "build": "Build Time [s]", "io_cpu": "Iothread CPU [s]"},
+}
+"""Plotted columns of `iothreads/sweep.py` for every workload"""
+
+
+def init():
+    sns.set_style("whitegrid")
+    sns.set_context("poster", font_scale=0.75)
+    sns.set_palette("colorblind6")
+    matplotlib.rcParams["pdf.fonttype"] = 42
+    matplotlib.rcParams["ps.fonttype"] = 42
+
+
+def visualize(
+    file: Path,
+    save_as: str | None = None,
+    out: Path = Path("out"),
+    height: float = 3.5,
+    aspect: float = 1.2,
+):
+    """Reclaim performance and host cpu time over the iothreads (rows: workloads)"""
+    data = pd.read_csv(file)
+    # The first iteration is a warmup
+    if data["iter"].max() > 0:
+        data = data[data["iter"] > 0]
+    data["config"] = data["mapping"] + data["shared"].map({True: " (shared auto)", False: ""})
+    workloads = [w for w in METRICS if w in data["workload"].unique()]
+
+    fig, axes = plt.subplots(
+        len(workloads), 3, figsize=(3 * height * aspect, len(workloads) * height), squeeze=False
+    )
+    for row, workload in zip(axes, workloads):
+        wdata = data[data["workload"] == workload]
+        for ax, (col, label) in zip(row, METRICS[workload].items()):
+            sns.lineplot(wdata, x="iothreads", y=col, hue="config", marker="o", ax=ax,
+                         legend=ax is axes[0][0])
+            ax.set(xscale="log", xlabel="Iothreads", ylabel=label, ylim=(0, None), title=workload)
+            ax.set_xticks(sorted(wdata["iothreads"].unique()),
+                          labels=map(str, sorted(wdata["iothreads"].unique())))
+    fig.tight_layout()
+
+    if save_as:
+        fig.savefig(out / f"{save_as}.pdf", bbox_inches="tight")
+        fig.savefig(out / f"{save_as}.svg", bbox_inches="tight")
+        dref_dataframe(save_as, out, ["workload", "config", "iothreads"],
+                       data[["workload", "config", "iothreads", "io_cpu"]])
+    return fig
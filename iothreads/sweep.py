@@ -0,0 +1,104 @@
+from argparse import ArgumentParser
+import asyncio
+from collections.abc import Sequence
+import csv
+import json
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+from compiling.bench import TARGET, main as compiling
+from inflate.bench import main as inflate
+from inflate.sweep import throughput
+from scripts.adaptive import gib_min
+from scripts.sweep import collect, grid, split_argv, sweep, workloads
+from scripts.utils import setup
+
+WORKLOADS = {
+    "inflate": inflate,
+    "compiling": compiling,
+}
+"""Benchmarks of the sweep, the llfree balloon is used manually by inflate and automatically by compiling"""
+
+
+def results(workload: str, out: Path) -> list[dict[str, float | None]]:
+    """Reclaim performance and host cpu time (s) of qemu and its iothreads of every iteration"""
+    rows = []
+    if workload == "inflate":
+        with (out / "out.csv").open() as f:
+            for speed, row in zip(throughput(out), csv.DictReader(f)):
+                rows.append({
+                    "shrink": speed["shrink"], "grow": speed["grow"], "build": None, "gib_min": None,
+                    "cpu": float(row["cpu"]), "io_cpu": float(row["iothreads"]),
+                })
+    else:
+        i = 0
+        while (file := out / f"times_{i}.json").exists():
+            times = json.loads(file.read_text())
+            build = times["build"][0]
+            rows.append({
+                "shrink": None, "grow": None, "build": build, "gib_min": gib_min(out / f"out_{i}.csv", build),
+                "cpu": times["cpu"]["user"] + times["cpu"]["system"],
+                "io_cpu": sum(times["cpu"]["iothreads"].values()),
+            })
+            i += 1
+    return rows
+
+
+async def main(argv: Sequence[str] | None = None):
+    parser = ArgumentParser(
+        description="Run the inflate (llfree-manual) and compiling (llfree-auto) benchmarks"
+        " with different numbers of llfree balloon iothreads and queue mappings."
+        " Arguments after `--` are passed to both benchmarks (e.g., -m16 --img ...)."
+    )
+    parser.add_argument("--workloads", nargs="+", choices=list(WORKLOADS.keys()), default=list(WORKLOADS.keys()))
+    parser.add_argument("-c", "--cores", type=int, default=8)
+    parser.add_argument("--iothreads", type=int, nargs="+", default=[1, 2, 4, 8],
+                        help="Iothread counts, one per vcpu is always included as baseline")
+    parser.add_argument("--mappings", nargs="+", choices=["round-robin", "block"], default=["round-robin", "block"])
+    parser.add_argument("--target", choices=list(TARGET.keys()), default="linux", help="Target of compiling")
+    parser.add_argument("--module", help="Kernel module of inflate, otherwise inflate runs with --nofault")
+    parser.add_argument("-i", "--iter", type=int, default=3)
+    parser.add_argument("--plot", action="store_true", help="Plot cpu time and reclaim performance afterwards")
+    sweep_argv, bench_args = split_argv(argv, sys.argv[1:])
+    args, root = setup(parser, sweep_argv)
+    bench_args += ["-c", f"{args.cores}", "-i", f"{args.iter}"]
+    workload_args = {
+        "inflate": ["--mode", "llfree-manual", *(["--module", args.module] if args.module else ["--nofault"])],
+        "compiling": ["--mode", "llfree-auto", "--target", args.target],
+    }
+
+    counts = sorted({n for n in args.iothreads if n < args.cores} | {args.cores})
+    if skipped := sorted(set(args.iothreads) - set(counts)):
+        print(f"\033[33mWARNING: skipping {skipped} iothreads, more than the {args.cores} vcpus\033[0m")
+
+    points = []
+    for workload in args.workloads:
+        points += [
+            p for p in grid(
+                # The auto mode iothread is only used by the auto mode
+                {"workload": [workload], "iothreads": counts, "mapping": args.mappings,
+                 "shared": [False, True] if workload == "compiling" else [False]},
+                lambda v: [
+                    v["workload"], *bench_args, *workload_args[v["workload"]],
+                    "--iothreads", f"{v['iothreads']}", "--vq-mapping", v["mapping"],
+                    *(["--shared-auto-iothread"] if v["shared"] else []),
+                ],
+                lambda v: f"{v['workload']}-t{v['iothreads']}-{v['mapping']}" + ("-shared" if v["shared"] else ""),
+            )
+            # With one or one per vcpu, all mappings are the same
+            if p.values["mapping"] == args.mappings[0] or p.values["iothreads"] not in (1, args.cores)
+        ]
+    done = await sweep(workloads(WORKLOADS), root, points, [], group="workload")
+    collect(root / "sweep.csv", points, done, ["shrink", "grow", "build", "gib_min", "cpu", "io_cpu"],
+            lambda point, out: results(point.values["workload"], out))
+
+    if args.plot:
+        from iothreads import plot as iothreads_plot
+
+        iothreads_plot.init()
+        iothreads_plot.visualize(root / "sweep.csv", save_as="sweep", out=root)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -14,8 +14,9 @@ from qemu.qmp import QMPClient
 
 sys.path.append(str(Path(__file__).parent.parent))
 from scripts.config import BALLOON_CFG, DEFAULT_DISK, ModeAction
+from scripts.cpuset import check_numa, layout
 from scripts.measure import Measure
-from scripts.qemu import qemu_vm, qemu_wait_startup
+from scripts.qemu import Disk, Pinning, Topology, Transport, qemu_vm, qemu_wait_startup
 from scripts.vm_resize import VMResize
 from scripts.utils import (
     SSHExec,
@@ -23,6 +24,7 @@ from scripts.utils import (
     rm_ansi_escape,
     setup,
     timestamp,
+    update_meta,
 )
 
 TARGET = {
@@ -85,7 +87,10 @@ async def main(argv: Sequence[str] | None = None):
     parser.add_argument("--qmp", default=5122, type=int)
     parser.add_argument("-m", "--mem", type=int, default=8)
     parser.add_argument("-c", "--cores", type=int, default=8)
+    parser.add_argument("--core-start", type=int, default=0, help="First core the vm is pinned to")
     parser.add_argument("-i", "--iter", type=int, default=1)
+    parser.add_argument("--iter-start", type=int, default=0,
+                        help="Index of the first iteration, continues the results of a previous run")
     parser.add_argument("-r", "--repeat", type=int, default=1)
     parser.add_argument("--frag", action="store_true")
     parser.add_argument("--delay", type=int, default=10)
@@ -95,25 +100,35 @@ async def main(argv: Sequence[str] | None = None):
     )
     parser.add_argument("--target", choices=list(TARGET.keys()), required=True)
     parser.add_argument("--vfio", type=int, help="Bound VFIO group for passthrough")
+    Disk.args(parser)
+    Transport.args(parser)
+    Pinning.args(parser)
+    Topology.args(parser)
     parser.add_argument("--vmem-fraction", type=float, default=1 / 16)
     parser.add_argument("--vms", type=int, default=1)
     parser.add_argument("--high-mem", type=int)
     args, root = setup(parser, argv)
 
+    assert args.transport != "tap" or args.vms == 1, "tap only supports a single vm"
+
     mem = args.mem * args.vms
     #with SystemdSlice(
     #    MemoryMax=f"{mem}G", MemoryHigh=f"{args.high_mem or mem}G"
     #) as slice:
     #print("Running slice", slice)
 
-    for i in range(args.iter):
+    for i in range(args.iter_start, args.iter_start + args.iter):
         vms = []
         for id in range(args.vms):
             dir = root / f"vm_{id}"
-            dir.mkdir()
-            vms.append(asyncio.create_task(boot_vm(args, dir, id, "", i)))
+            dir.mkdir(exist_ok=True)
+            vms.append(asyncio.create_task(
+                boot_vm(args, dir, id, "", i, prepare=TARGET[args.target].get("clean"))
+            ))
 
         vms = await asyncio.gather(*vms)
+        if i == args.iter_start:
+            update_meta(root, "cpuset", layout())
 
         time_start = time()
 
@@ -121,45 +136,67 @@ async def main(argv: Sequence[str] | None = None):
         async with asyncio.TaskGroup() as group:
             for id, vm in enumerate(vms):
                 dir = root / f"vm_{id}"
-                group.create_task(exec_vm(args, dir, id, vm, time_start, i))
+                qemu, ssh = vm
+                group.create_task(exec_vm(args, dir, id, qemu, ssh, time_start, i))
         times.append(time() - time_start)
 
         (root / f"time_{i}.txt").write_text(json.dumps({"total": times}))
 
 
 async def boot_vm(
-    args: Namespace, root: Path, id: int, slice: str, i: int
-) -> Popen[str]:
+    args: Namespace,
+    root: Path,
+    id: int,
+    slice: str,
+    i: int,
+    init_mem: int | None = None,
+    prepare: str | None = None,
+) -> tuple[Popen[str], SSHExec]:
+    """
+    Boot the vm `id` with the ports and cores of its id and connect to it.
+    The vm starts with `init_mem` GiB (by default the minimum) and executes
+    the `prepare` command before it is returned.
+    """
     qemu = None
-    ssh = SSHExec(args.user, port=args.port + id)
 
     try:
         print(f"start vm {id}...")
         min_mem = min_memory(args.mem)
-        extra_args = BALLOON_CFG[args.mode](args.cores, args.mem, min_mem, min_mem)
+        init_mem = min_mem if init_mem is None else init_mem
+        extra_args = BALLOON_CFG[args.mode](args.cores, args.mem, min_mem, init_mem, args.sockets, args.host_nodes)
         qemu = qemu_vm(
             args.qemu,
             args.port + id,
             args.kernel,
             args.cores,
+            sockets=args.sockets,
             hda=args.img,
+            disk=Disk.from_args(args),
+            transport=Transport.from_args(args),
             qmp_port=args.qmp + id,
             extra_args=extra_args,
             vfio_group=args.vfio,
             #slice=slice,
-            core_start=id * args.cores,
+            core_start=args.core_start + id * args.cores,
+            extra_cores=Pinning.from_args(args).cores(),
         )
         print(f"started {id}")
         if i == 0:
             (root / "cmd.sh").write_text(shlex.join(qemu.args))
 
         await qemu_wait_startup(qemu, root / f"boot_{i}.txt")
+        pinned = await Pinning.from_args(args).pin(args.qmp + id, qemu.pid)
+        (root / f"pinning_{i}.json").write_text(json.dumps(pinned))
 
         if qemu.poll() is not None:
             raise Exception("Qemu crashed")
 
-        if "clean" in TARGET[args.target]:
-            await ssh.run(TARGET[args.target]["clean"])
+        ssh = await Transport.from_args(args).connect(
+            args.user, args.port + id, root / f"transport_{i}.json"
+        )
+
+        if prepare:
+            await ssh.run(prepare)
 
     except Exception as e:
         (root / "exception.txt").write_text(str(e))
@@ -174,11 +211,17 @@ async def boot_vm(
                 qemu.terminate()
         raise e
 
-    return qemu
+    return qemu, ssh
 
 
 async def exec_vm(
-    args: Namespace, root: Path, id: int, qemu: Popen[str], time_start: float, i: int
+    args: Namespace,
+    root: Path,
+    id: int,
+    qemu: Popen[str],
+    ssh: SSHExec,
+    time_start: float,
+    i: int,
 ):
     client = None
     try:
@@ -189,7 +232,7 @@ async def exec_vm(
             min_bytes = min_memory(args.mem) * 1024**3
             max_bytes = args.mem * 1024**3
             vm_resize = VMResize(
-                client, args.mode, max_bytes, min_bytes, min_bytes, args.vmem_fraction
+                client, args.mode, max_bytes, min_bytes, min_bytes, args.vmem_fraction, args.sockets
             )
             resize_callback = vm_resize.auto_resize
 
@@ -198,7 +241,6 @@ async def exec_vm(
 
         print(f"Exec vm={id} i={i} c={args.cores}")
 
-        ssh = SSHExec(args.user, port=args.port + id)
         measure = Measure(
             root,
             i,
@@ -273,6 +315,7 @@ async def exec_vm(
                 }
             )
         )
+        (root / f"numa_{i}.json").write_text(json.dumps(check_numa(qemu.pid)))
 
         with (root / f"out_{i}.txt").open("a+") as f:
             f.write(rm_ansi_escape(non_block_read(qemu.stdout)))
@@ -20,14 +20,14 @@ from scipy import integrate
 import sys
 
 sys.path.append(str(Path(__file__).parent.parent))
-from scripts.utils import dump_dref
+from scripts.utils import dref_dataframe, dump_dref
 
-matplotlib.rcParams["pdf.fonttype"] = 42
-matplotlib.rcParams["ps.fonttype"] = 42
-
-sns.set_style("whitegrid")
-sns.set_context("poster", font_scale=0.75)
-sns.set_palette("colorblind6")
+def init():
+    matplotlib.rcParams["pdf.fonttype"] = 42
+    matplotlib.rcParams["ps.fonttype"] = 42
+    sns.set_style("whitegrid")
+    sns.set_context("poster", font_scale=0.75)
+    sns.set_palette("colorblind6")
 
 
 root = Path(".")
@@ -225,3 +225,52 @@ def visualize(
             with (out / f"{save_as}_extra.dref").open("w+") as f:
                 dump_dref(f, save_as, extra_keys)
     return p
+
+
+def parse_storm(path: Path) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Per-vm and aggregate results of `multivm/storm.py`"""
+    meta = json.load((path / "meta.json").open())
+    data = pd.read_csv(path / "out.csv")
+    data["reclaimed"] = (meta["args"]["mem"] * 1024**3 - data["achieved"]) / 1024**3
+    data["speed"] = data["reclaimed"] / data["shrink"]
+    total = data.groupby(["vms", "iter"]).agg(
+        reclaimed=("reclaimed", "sum"), tail=("shrink", "max"), median=("shrink", "median")
+    ).reset_index()
+    total["speed"] = total["reclaimed"] / total["tail"]
+    return data, total
+
+
+def visualize_storm(
+    modes: dict[str, Path],
+    save_as: str | None = None,
+    out: Path = Path("out"),
+    height: float = 3.5,
+    aspect: float = 1.2,
+):
+    """Aggregate and per-vm reclaim throughput and tail completion time over the number of vms"""
+    datas, totals = [], []
+    for mode, path in modes.items():
+        data, total = parse_storm(path)
+        data["mode"] = total["mode"] = mode
+        datas.append(data)
+        totals.append(total)
+    data = pd.concat(datas, ignore_index=True)
+    total = pd.concat(totals, ignore_index=True)
+
+    fig, axes = plt.subplots(1, 3, figsize=(3 * height * aspect, height))
+    sns.lineplot(total, x="vms", y="speed", hue="mode", marker="o", ax=axes[0])
+    axes[0].set(ylabel="Aggregate Reclaim [GiB/s]")
+    sns.lineplot(data, x="vms", y="speed", hue="mode", marker="o", ax=axes[1], legend=False)
+    axes[1].set(ylabel="Reclaim per VM [GiB/s]")
+    sns.lineplot(total, x="vms", y="tail", hue="mode", marker="o", ax=axes[2], legend=False)
+    axes[2].set(ylabel="Last VM Finished [s]")
+    for ax in axes:
+        ax.set(xscale="log", xlabel="VMs", ylim=(0, None))
+        ax.set_xticks(sorted(data["vms"].unique()), labels=map(str, sorted(data["vms"].unique())))
+    fig.tight_layout()
+
+    if save_as:
+        fig.savefig(out / f"{save_as}.pdf", bbox_inches="tight")
+        fig.savefig(out / f"{save_as}.svg", bbox_inches="tight")
+        dref_dataframe(save_as, out, ["mode", "vms"], total[["mode", "vms", "speed"]])
+    return fig
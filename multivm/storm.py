@@ -0,0 +1,178 @@
+from argparse import ArgumentParser
+import asyncio
+from asyncio import sleep
+from collections.abc import Sequence
+import json
+from pathlib import Path
+from subprocess import Popen, TimeoutExpired
+from time import time
+import sys
+
+import psutil
+from qemu.qmp import QMPClient
+
+sys.path.append(str(Path(__file__).parent.parent))
+from inflate.bench import parse_output
+from multivm.bench import boot_vm, min_memory
+from scripts.config import BALLOON_CFG, DEFAULT_DISK, ModeAction
+from scripts.cpuset import layout
+from scripts.qemu import Disk, Pinning, Topology, Transport
+from scripts.utils import SSHExec, fmt_bytes, non_block_read, rm_ansi_escape, setup, update_meta
+from scripts.vm_resize import VMResize
+
+MODES = ["base-manual", "huge-manual", "llfree-manual", "virtio-mem"]
+"""Modes with manual resizing and guest-side timestamps (see `inflate.bench.parse_output`)"""
+
+
+async def resize_vm(
+    resize: VMResize, target: int, shrink: bool, start: float, timeout: float | None, poll: float
+) -> tuple[float, int]:
+    """Wait until the vm reached the target (bytes), returns the completion time since start and the size"""
+    while True:
+        size = await resize.query()
+        if (size <= 1.01 * target) if shrink else (size >= 0.99 * target):
+            return time() - start, size
+        if timeout is not None and time() - start > timeout:
+            print(f"\033[33mWARNING: resize stopped at {fmt_bytes(size)}\033[0m")
+            return time() - start, size
+        await sleep(poll)
+
+
+async def storm(resizes: list[VMResize], target: int, timeout: float | None, poll: float) -> list[tuple[float, int]]:
+    """Resize all vms at once, returns the completion time and size of every vm"""
+    shrink = [target < r.size for r in resizes]
+    start = time()
+    await asyncio.gather(*(r.set(target) for r in resizes))
+    return await asyncio.gather(*(
+        resize_vm(r, target, s, start, timeout, poll) for r, s in zip(resizes, shrink)
+    ))
+
+
+async def main(argv: Sequence[str] | None = None):
+    parser = ArgumentParser(
+        description="Fill multiple vms and shrink and grow all of them at once, measuring the reclaim throughput"
+    )
+    parser.add_argument("--qemu")
+    parser.add_argument("--kernel")
+    parser.add_argument("--user", default="debian")
+    parser.add_argument("--img", default=str(DEFAULT_DISK))
+    parser.add_argument("--port", type=int, default=5222)
+    parser.add_argument("--qmp", default=5122, type=int)
+    parser.add_argument("-m", "--mem", type=int, default=8)
+    parser.add_argument("-c", "--cores", type=int, default=4)
+    parser.add_argument("--core-start", type=int, default=0, help="First core the vms are pinned to")
+    parser.add_argument("-i", "--iter", type=int, default=3, help="Shrink and grow cycles for every number of vms")
+    parser.add_argument("--iter-start", type=int, default=0,
+                        help="Index of the first iteration, continues the results of a previous run")
+    parser.add_argument("--vms", type=int, default=4, help="Maximum number of vms")
+    parser.add_argument("--counts", type=int, nargs="+",
+                        help="Numbers of concurrent vms, by default doubling up to --vms")
+    parser.add_argument("--shrink-target", type=int, default=2)
+    parser.add_argument("--delay", type=int, default=10)
+    parser.add_argument("--poll", type=float, default=0.1, help="Interval of the size queries in s")
+    parser.add_argument("--resize-timeout", type=int, default=600,
+                        help="Seconds until a resize is given up, records the achieved size")
+    parser.add_argument(
+        "--mode", choices=[*BALLOON_CFG.keys()], required=True, action=ModeAction
+    )
+    parser.add_argument("--vfio", type=int, help="Bound VFIO group for passthrough")
+    Disk.args(parser)
+    Transport.args(parser)
+    Pinning.args(parser)
+    Topology.args(parser)
+    args, root = setup(parser, argv)
+
+    assert args.mode in MODES, f"The mode has to be one of {MODES}"
+    assert args.transport != "tap" or args.vms == 1, "tap only supports a single vm"
+
+    counts = args.counts or sorted({2**k for k in range(args.vms.bit_length()) if 2**k <= args.vms} | {args.vms})
+    host_mem = psutil.virtual_memory().total // 1024**3
+    if skipped := [n for n in counts if n * args.mem >= host_mem]:
+        print(f"\033[33mWARNING: skipping {skipped} vms, which exceed the host memory\033[0m")
+        counts = [n for n in counts if n not in skipped]
+
+    max_bytes = args.mem * 1024**3
+    min_bytes = min_memory(args.mem) * 1024**3
+    target_bytes = args.shrink_target * 1024**3
+
+    append = args.iter_start > 0 and (root / "out.csv").exists()
+    outfile = (root / "out.csv").open("a+" if append else "w+")
+    if not append:
+        outfile.write("vms,vm,iter,shrink,grow,shrink_guest,grow_guest,achieved\n")
+    summary = json.loads((root / "summary.json").read_text()) if append and (root / "summary.json").exists() else []
+
+    for n in counts:
+        dir = root / f"n{n}"
+        vms: list[tuple[Popen[str], SSHExec]] = []
+        clients: list[QMPClient] = []
+        try:
+            # Boot fully deflated, all vms in parallel
+            for id in range(n):
+                (dir / f"vm_{id}").mkdir(parents=True, exist_ok=True)
+            booted = await asyncio.gather(*(
+                boot_vm(args, dir / f"vm_{id}", id, "", 0, init_mem=args.mem) for id in range(n)
+            ), return_exceptions=True)
+            # Terminate the other vms if one failed
+            vms = [vm for vm in booted if not isinstance(vm, BaseException)]
+            for e in booted:
+                if isinstance(e, BaseException):
+                    raise e
+            if n == counts[0]:
+                update_meta(root, "cpuset", layout())
+
+            resizes = []
+            for id in range(n):
+                client = QMPClient(f"storm vm {id}")
+                await client.connect(("127.0.0.1", args.qmp + id))
+                clients.append(client)
+                resizes.append(VMResize(client, args.mode, max_bytes, min_bytes, max_bytes, nodes=args.sockets))
+
+            for i in range(args.iter_start, args.iter_start + args.iter):
+                for qemu, _ in vms:
+                    if qemu.poll() is not None:
+                        raise Exception("Qemu crashed")
+                print(f"Storm vms={n} i={i}")
+
+                await asyncio.gather(*(ssh.run(f"./write -t{args.cores} -m{args.mem - 1}") for _, ssh in vms))
+                await sleep(args.delay)
+
+                shrink = await storm(resizes, target_bytes, args.resize_timeout, args.poll)
+                await sleep(args.delay)
+                grow = await storm(resizes, max_bytes, args.resize_timeout, args.poll)
+                await sleep(args.delay)
+
+                reclaimed = 0
+                for id, (qemu, _) in enumerate(vms):
+                    output = rm_ansi_escape(non_block_read(qemu.stdout))
+                    with (dir / f"vm_{id}" / "out.txt").open("a+") as f:
+                        f.write(output)
+                    shrink_guest, grow_guest = parse_output(output, args.mode)
+                    (t_shrink, achieved), (t_grow, _) = shrink[id], grow[id]
+                    reclaimed += max_bytes - achieved
+                    outfile.write(f"{n},{id},{i},{t_shrink},{t_grow},{shrink_guest},{grow_guest},{achieved}\n")
+                outfile.flush()
+
+                # Until the last vm finished, the aggregate throughput in GiB/s
+                tail = max(t for t, _ in shrink)
+                summary.append({"vms": n, "iter": i, "tail": tail, "throughput": reclaimed / 1024**3 / tail})
+                print(f"vms={n} tail={tail:.2f}s throughput={summary[-1]['throughput']:.2f}GiB/s")
+        finally:
+            print("terminate...")
+            for client in clients:
+                await client.disconnect()
+            for qemu, _ in vms:
+                qemu.terminate()
+            for qemu, _ in vms:
+                try:
+                    qemu.wait(60)
+                except TimeoutExpired:
+                    print("qemu did not terminate -> kill!")
+                    qemu.kill()
+            await sleep(3)
+
+    outfile.close()
+    (root / "summary.json").write_text(json.dumps(summary))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -4,19 +4,30 @@ from argparse import ArgumentParser
 import asyncio
 from collections.abc import Callable, Coroutine, Sequence
 from dataclasses import dataclass
+from hashlib import sha256
+import importlib
+import json
+import os
 from pathlib import Path
+import random
+import shlex
 import shutil
 import itertools
+from subprocess import STDOUT
+from time import time
 import traceback
 from typing import Any
 import sys
 
-from compiling import bench as compiling, plot as compiling_plot
-from inflate import bench as inflate, plot as inflate_plot
-from multivm import bench as mutlivm, plot as multivm_plot
 from scripts.config import BALLOON_CFG, DEFAULT_DISK, DEFAULTS, ROOT
+from scripts.eta import DurationModel, Progress
+from scripts.matrix import MATRIX, load_matrix
 from scripts.qemu import qemu_vm, qemu_wait_startup
-from stream import bench as stream, plot as stream_plot
+from scripts.scheduler import Job, Scheduler
+from scripts.utils import run_name
+
+COMPLETE = "complete.json"
+"""Marker of a finished run, with the hash of its arguments"""
 
 
 @dataclass
@@ -28,6 +39,11 @@ class Config:
     ftq_iters: int
     port: int
     qmp_port: int
+    jobs: int = 1
+    mem_budget: int | None = None
+    fresh: bool = False
+    interleave: bool = False
+    seed: int = 0
 
 
 class Benchmark:
@@ -35,16 +51,17 @@ class Benchmark:
     def __init__(
         self,
         name: str,
-        function: Callable[[Sequence[str]], Coroutine],
+        module: str,
         default: dict[str, Any],
         fast: dict[str, Any],
         args: list[str],
         modes: list[tuple[str, list[str]]],
         long_modes: list[tuple[str, list[str]]],
         plot: Callable[["Benchmark", Config], None],
+        all: bool = True,
     ):
         self.name = name
-        self.function = function
+        self.module = module
         self.default = default
         self.fast = fast
 
@@ -53,48 +70,193 @@ class Benchmark:
         self.long_modes = long_modes
 
         self.plot_fn = plot
+        self.all = all
+
+    def function(self) -> Callable[[Sequence[str]], Coroutine]:
+        """Import the benchmark module on demand, its dependencies are only needed here"""
+        return importlib.import_module(self.module).main
+
+    async def run_process(self, args: list[str], log: Path):
+        """Run the benchmark in its own interpreter, so that parallel runs do not block each other"""
+        print(f"\n\x1b[94mStarting {self.module} {' '.join(args)}\n - LOG={log}\x1b[0m")
+        path = os.pathsep.join([str(ROOT), *filter(None, [os.environ.get("PYTHONPATH")])])
+        with log.open("a") as f:
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, "-m", self.module, *args,
+                stdout=f, stderr=STDOUT, env={**os.environ, "PYTHONPATH": path},
+            )
+            ret = await process.wait()
+        assert ret == 0, f"Failed with {ret}, see {log}"
 
-    async def run(self, config: Config):
-        root = Path("artifact-eval") / self.name
-        shutil.rmtree(root, ignore_errors=True)
-
+    def replacements(self, config: Config) -> dict[str, Any]:
         replacements = self.fast if config.fast else self.default
         replacements["vfio"] = config.vfio
         replacements["stream_iters"] = config.stream_iters
         replacements["ftq_iters"] = config.ftq_iters
+        return replacements
 
-        print(f"\n\x1b[94mRunning {self.name} bench\x1b[0m")
+    def runs(self, config: Config) -> list[tuple[str, list[str]]]:
+        """The modes and their formatted arguments, without the vfio modes if vfio is not set"""
+        replacements = self.replacements(config)
         base_args = self.args + [
             "--root",
-            f"{root}",
+            f"{self.root()}",
             "--no-timestamp",
-            "--port",
-            f"{config.port}",
-            "--qmp",
-            f"{config.qmp_port}",
         ]
+        runs = []
+        for mode, extra_args in self.modes + (self.long_modes if config.extra else []):
+            args = base_args + extra_args + ["--mode", mode]
+            if any([("{vfio}" in arg) for arg in args]) and config.vfio is None:
+                continue
+            args = [arg.format(**replacements) for arg in args]
+            # Drop explicit suffixes that match the default directory name
+            if "--suffix" in args:
+                i = args.index("--suffix")
+                rest = args[:i] + args[i + 2 :]
+                if run_dir(Path(), args) == run_dir(Path(), rest):
+                    args = rest
+            runs.append((mode, args))
+        return runs
+
+    def rounds(self, config: Config) -> int:
+        """Only benchmarks with iterations (-i) can be split into rounds"""
+        return int(self.replacements(config).get("iter", 1))
+
+    def prepare(self, config: Config):
+        if config.fresh:
+            shutil.rmtree(self.root(), ignore_errors=True)
+
+    def estimate(
+        self, config: Config, model: DurationModel, progress: Progress
+    ) -> dict[str, float | None]:
+        """Add the predicted durations of the pending runs (or rounds) to `progress`"""
+        rounds = self.rounds(config)
+        predicted = {}
+        for _, args in self.runs(config):
+            out = run_dir(self.root(), args)
+            key = args_hash(args)
+            done = finished(out, key).get("rounds", 0)
+            if done >= rounds:
+                continue
+            duration = model.predict(self.name, self.module, out.name, key)
+            if config.interleave and rounds > 1:
+                for r in range(done, rounds):
+                    label = f"{self.name}/{out.name}#{r}"
+                    predicted[label] = duration / rounds if duration is not None else None
+            else:
+                predicted[f"{self.name}/{out.name}"] = duration
+        for label, duration in predicted.items():
+            progress.add(label, duration)
+        return predicted
+
+    async def run_mode(
+        self,
+        config: Config,
+        scheduler: Scheduler,
+        progress: Progress,
+        mode: str,
+        args: list[str],
+        rounds: int = 1,
+        round: int | None = None,
+    ) -> dict[str, Any]:
+        """Execute a whole run or, if interleaved, only one of its rounds (iterations)"""
+        root = self.root()
+        out = run_dir(root, args)
+        label = f"{self.name}/{out.name}" + (f"#{round}" if round is not None else "")
+        try:
+            # Skip finished runs, partial ones (or with other args) are repeated
+            key = args_hash(args)
+            marker = finished(out, key)
+            done = marker.get("rounds", 0)
+            if done >= (rounds if round is None else round + 1):
+                print(f"\n\x1b[94mSkipping {out.name}, it is already complete\x1b[0m")
+                progress.finish(label)
+                return {"status": "skipped"}
+            if round is None or round == 0:
+                shutil.rmtree(out, ignore_errors=True)
+                marker = {}
+            elif done != round:
+                print(f"\n\x1b[91mSkipping {out.name} round {round}, round {done} is missing\x1b[0m")
+                progress.finish(label)
+                return {"status": "skipped"}
+
+            run_args = args
+            if round is not None:
+                run_args = args + ["-i1", "--iter-start", f"{round}"]
+
+            async with scheduler.slot(Job.from_args(args)) as slot:
+                start = time()
+                slot_args = run_args + slot.args()
+                if config.jobs > 1:
+                    root.mkdir(parents=True, exist_ok=True)
+                    await self.run_process(slot_args, root / f"{out.name}.log")
+                else:
+                    function = self.function()
+                    filename = Path(function.__code__.co_filename).relative_to(ROOT)
+                    print(f"\n\x1b[94mRunning {mode}: {filename} {' '.join(slot_args)}\x1b[0m")
+                    await function(slot_args)
+                end = time()
+
+            (out / COMPLETE).write_text(
+                json.dumps({
+                    "bench": self.name,
+                    "args": args,
+                    "hash": key,
+                    "rounds": rounds if round is None else round + 1,
+                    "total": rounds,
+                    "duration": marker.get("duration", 0) + end - start,
+                })
+            )
+            progress.finish(label)
+            return {"status": "done", "start": start, "end": end}
+        except Exception as e:
+            print(f"\x1b[91mFailed to run {mode}: {e}\x1b[0m")
+            print(f"\x1b[91m{traceback.format_exc()}\x1b[0m")
+            progress.finish(label)
+            return {"status": "failed"}
 
-        async def run_mode(mode: str, extra_args: list[str]):
+    async def run(self, config: Config, scheduler: Scheduler, progress: Progress):
+        root = self.root()
+        print(f"\n\x1b[94mRunning {self.name} bench\x1b[0m")
+        runs = self.runs(config)
+        if skipped := len(self.modes + (self.long_modes if config.extra else [])) - len(runs):
+            print(f"\n\x1b[94mSkipping {skipped} modes because vfio is not set\x1b[0m")
+
+        rounds = self.rounds(config)
+        if not config.interleave:
+            # The scheduler starts the modes in order and runs them concurrently if possible
+            await asyncio.gather(*[
+                self.run_mode(config, scheduler, progress, mode, args, rounds)
+                for mode, args in runs
+            ])
+        else:
+            # Block randomized: every round executes one iteration of all modes in a new order
+            rng = random.Random(config.seed)
+            order = []
+            # Resumed campaigns keep the order of the previous sessions
             try:
-                args = base_args + extra_args + ["--mode", mode]
-                if any([("{vfio}" in arg) for arg in args]) and config.vfio is None:
-                    print(f"\n\x1b[94mSkipping {mode} because vfio is not set\x1b[0m")
-                    return
-
-                args = [arg.format(**replacements) for arg in args]
-                filename = Path(self.function.__code__.co_filename).relative_to(ROOT)
-                print(f"\n\x1b[94mRunning {mode}: {filename} {' '.join(args)}\x1b[0m")
-                await self.function(args)
-            except Exception as e:
-                print(f"\x1b[91mFailed to run {mode}: {e}\x1b[0m")
-                print(f"\x1b[91m{traceback.format_exc()}\x1b[0m")
-
-        for mode, extra_args in self.modes:
-            await run_mode(mode, extra_args)
-
-        if config.extra:
-            for mode, extra_args in self.long_modes:
-                await run_mode(mode, extra_args)
+                sessions = json.loads((root / "order.json").read_text())["sessions"]
+            except (OSError, ValueError, KeyError):
+                sessions = []
+            for r in range(rounds):
+                shuffled = rng.sample(runs, len(runs))
+                results = await asyncio.gather(*[
+                    self.run_mode(
+                        config, scheduler, progress, mode, args, rounds, r if rounds > 1 else None
+                    )
+                    for mode, args in shuffled
+                ])
+                for position, ((mode, args), result) in enumerate(zip(shuffled, results)):
+                    order.append({
+                        "round": r,
+                        "position": position,
+                        "run": run_dir(root, args).name,
+                        "mode": mode,
+                        **result,
+                    })
+                root.mkdir(parents=True, exist_ok=True)
+                session = {"seed": config.seed, "rounds": rounds, "order": order}
+                (root / "order.json").write_text(json.dumps({"sessions": [*sessions, session]}))
 
         print(f"\n\x1b[94mFinished {self.name} bench\x1b[0m")
 
@@ -106,7 +268,36 @@ class Benchmark:
         return Path("artifact-eval") / self.name
 
 
+def run_dir(root: Path, args: list[str]) -> Path:
+    """Output directory of a run, as created by `setup`"""
+    parser = ArgumentParser(add_help=False)
+    parser.add_argument("--suffix", default="unknown")
+    parser.add_argument("--mode")
+    parser.add_argument("--target")
+    parsed, _ = parser.parse_known_args(args)
+    return root / run_name(parsed.suffix, parsed.mode, parsed.target)
+
+
+def args_hash(args: list[str]) -> str:
+    """Hash of the run arguments, without the ports and cores assigned by the scheduler"""
+    return sha256(shlex.join(args).encode()).hexdigest()
+
+
+def finished(out: Path, key: str) -> dict[str, Any]:
+    """The completion marker of a run, if it was executed with the same arguments"""
+    try:
+        marker = json.loads((out / COMPLETE).read_text())
+    except (OSError, ValueError):
+        return {}
+    return marker if marker.get("hash") == key else {}
+
+
+# The plot modules pull in pandas, seaborn and matplotlib, only import them for plotting
+
+
 def inflate_plot_fn(bench: Benchmark, config: Config):
+    from inflate import plot as inflate_plot
+
     root = bench.root()
     vfio = (root / "llfree-manual-vfio").exists()
     inflate_plot.init()
@@ -130,9 +321,17 @@ def inflate_plot_fn(bench: Benchmark, config: Config):
         save_as="inflate",
         out=root,
     )
+    if loaded := sorted(root.glob("*-load-*")):
+        inflate_plot.visualize_load(
+            [root / m for m in ["base-manual", "huge-manual", "virtio-mem", "llfree-manual"]] + loaded,
+            save_as="inflate-load",
+            out=root,
+        )
 
 
 def stream_plot_fn(bench: Benchmark, config: Config):
+    from stream import plot as stream_plot
+
     root = bench.root()
 
     vfio = (root / "llfree-vfio-stream").exists()
@@ -165,6 +364,8 @@ def stream_plot_fn(bench: Benchmark, config: Config):
 
 
 def ftq_plot_fn(bench: Benchmark, config: Config):
+    from stream import plot as stream_plot
+
     root = bench.root()
     vfio = (root / "llfree-vfio-ftq").exists()
     drivers = [
@@ -195,6 +396,8 @@ def ftq_plot_fn(bench: Benchmark, config: Config):
 
 
 def compiling_plot_fn(bench: Benchmark, config: Config):
+    from compiling import plot as compiling_plot
+
     root = bench.root()
     replacements = bench.fast if config.fast else bench.default
     target = replacements["target"]
@@ -259,9 +462,12 @@ def compiling_plot_fn(bench: Benchmark, config: Config):
     )
 
 def blender_plot_fn(bench: Benchmark, config: Config):
+    from compiling import plot as compiling_plot
+
     root = bench.root()
     replacements = bench.fast if config.fast else bench.default
     target = replacements["target"]
+    compiling_plot.init()
     compiling_plot.visualize(
         {
             "Baseline": root / f"{target}-base-auto",
@@ -273,9 +479,12 @@ def blender_plot_fn(bench: Benchmark, config: Config):
 
 
 def multivm_plot_fn(bench: Benchmark, config: Config):
+    from multivm import plot as multivm_plot
+
     root = bench.root()
     replacements = bench.fast if config.fast else bench.default
     target = replacements["target"]
+    multivm_plot.init()
     multivm_plot.visualize(
         {
             "Baseline": root / f"{target}-base-manual",
@@ -296,191 +505,63 @@ def multivm_plot_fn(bench: Benchmark, config: Config):
     )
 
 
-BENCHMARKS = [
-    Benchmark(
-        "inflate",
-        inflate.main,
-        default={"iter": 5},
-        fast={"iter": 2},
-        args=["-m20", "-c12", "--shrink-target", "2", "-i{iter}"],
-        modes=[
-            ("base-manual", []),
-            ("huge-manual", []),
-            ("llfree-manual", []),
-            ("llfree-manual", ["--suffix", "llfree-manual-vfio", "--vfio-dev", "{vfio}"]),
-            ("virtio-mem", []),
-            ("virtio-mem", ["--suffix", "virtio-mem-vfio", "--vfio-dev", "{vfio}"]),
-            # nofault
-            ("base-manual", ["--suffix", "base-manual-nofault", "--nofault"]),
-            ("huge-manual", ["--suffix", "huge-manual-nofault", "--nofault"]),
-            ("llfree-manual", ["--suffix", "llfree-manual-nofault", "--nofault"]),
-            (
-                "llfree-manual",
-                [
-                    "--suffix",
-                    "llfree-manual-vfio-nofault",
-                    "--vfio-dev",
-                    "{vfio}",
-                    "--nofault",
-                ],
-            ),
-            ("virtio-mem", ["--suffix", "virtio-mem-nofault", "--nofault"]),
-            (
-                "virtio-mem",
-                [
-                    "--suffix",
-                    "virtio-mem-vfio-nofault",
-                    "--vfio-dev",
-                    "{vfio}",
-                    "--nofault",
-                ],
-            ),
-        ],
-        long_modes=[],
-        plot=inflate_plot_fn,
-    ),
-    Benchmark(
-        "stream",
-        stream.main,
-        default={},
-        fast={},
-        args=[
-            "-c12",
-            "-m20",
-            "--stream-size",
-            "45000000",
-            "--bench-iters",
-            "{stream_iters}",
-            "--bench-threads",
-            "1",
-            "4",
-            "12",
-            "--max-balloon",
-            "18",
-        ],
-        modes=[
-            ("base-manual", ["--suffix", "baseline-stream", "--baseline"]),
-            ("base-manual", ["--suffix", "virtio-balloon-stream"]),
-            ("huge-manual", ["--suffix", "virtio-balloon-huge-stream"]),
-            ("virtio-mem", ["--suffix", "virtio-mem-stream"]),
-            ("virtio-mem", ["--suffix", "virtio-mem-vfio-stream", "--vfio-dev", "{vfio}"]),
-            ("llfree-manual", ["--suffix", "llfree-stream"]),
-            ("llfree-manual", ["--suffix", "llfree-vfio-stream", "--vfio-dev", "{vfio}"]),
-        ],
-        long_modes=[],
-        plot=stream_plot_fn,
-    ),
-    Benchmark(
-        "ftq",
-        stream.main,
-        default={},
-        fast={},
-        args=[
-            "--ftq",
-            "-c12",
-            "-m20",
-            "--bench-threads",
-            "1",
-            "4",
-            "12",
-            "--bench-iters",
-            "{ftq_iters}",
-            "--max-balloon",
-            "18",
-        ],
-        modes=[
-            ("base-manual", ["--suffix", "baseline-ftq", "--baseline"]),
-            ("base-manual", ["--suffix", "virtio-balloon-ftq"]),
-            ("huge-manual", ["--suffix", "virtio-balloon-huge-ftq"]),
-            ("virtio-mem", ["--suffix", "virtio-mem-ftq"]),
-            ("virtio-mem", ["--suffix", "virtio-mem-vfio-ftq", "--vfio-dev", "{vfio}"]),
-            ("llfree-manual", ["--suffix", "llfree-ftq"]),
-            ("llfree-manual", ["--suffix", "llfree-vfio-ftq", "--vfio-dev", "{vfio}"]),
-        ],
-        long_modes=[],
-        plot=ftq_plot_fn,
-    ),
-    Benchmark(
-        "compiling",
-        compiling.main,
-        default={"target": "clang", "delay": 200, "mem": 16},
-        fast={"target": "write", "delay": 10, "mem": 12},
-        args=["--target", "{target}", "-m{mem}", "-c12", "--delay", "{delay}"],
-        modes=[
-            ("base-manual", []),
-            ("base-auto", []),
-            ("llfree-manual", []),
-            ("llfree-auto", []),
-            (
-                "llfree-auto",
-                ["--suffix", "{target}-llfree-auto-vfio", "--vfio-dev", "{vfio}"],
-            ),
-            ("virtio-mem", []),
-            (
-                "virtio-mem",
-                ["--suffix", "{target}-virtio-mem-vfio", "--vfio-dev", "{vfio}"],
-            ),
-        ],
-        long_modes=[
-            (
-                "base-auto",
-                [
-                    "--suffix",
-                    f"{{target}}-base-auto-o{o}-d{d}-c{c}",
-                    "--fpr-order",
-                    f"{o}",
-                    "--fpr-delay",
-                    f"{d}",
-                    "--fpr-capacity",
-                    f"{c}",
-                ],
-            )
-            for o, d, c in itertools.product([0, 9], [100, 2000], [32, 512])
-        ],
-        plot=compiling_plot_fn,
-    ),
-    Benchmark(
-        "blender",
-        compiling.main,
-        default={"target": "blender", "delay": 360, "mem": 16},
-        fast={"target": "write", "delay": 10, "mem": 12},
-        args=["--target", "{target}", "-m{mem}", "-c12", "--delay", "{delay}", "--repeat", "3"],
-        modes=[
-            ("base-auto", []),
-            ("llfree-auto", []),
-        ],
-        long_modes=[],
-        plot=blender_plot_fn,
-    ),
-    Benchmark(
-        "multivm",
-        mutlivm.main,
-        default={"target": "clang", "delay": 7200, "mem": 16},
-        fast={"target": "write", "delay": 30, "mem": 10},
-        args=[
-            "--target",
-            "{target}",
-            "-m{mem}",
-            "-c8",
-            "--delay",
-            "{delay}",
-            "--repeat",
-            "3",
-            "--vms",
-            "3",
-        ],
-        modes=[
-            ("base-manual", []),
-            ("base-auto", []),
-            ("llfree-auto", []),
-            ("base-manual", ["--suffix", "{target}-base-manual-s", "--simultaneous"]),
-            ("base-auto", ["--suffix", "{target}-base-auto-s", "--simultaneous"]),
-            ("llfree-auto", ["--suffix", "{target}-llfree-auto-s", "--simultaneous"]),
-        ],
-        long_modes=[],
-        plot=multivm_plot_fn,
-    ),
-]
+def boot_plot_fn(bench: Benchmark, config: Config):
+    from boot import plot as boot_plot
+
+    root = bench.root()
+    boot_plot.init()
+    boot_plot.visualize(
+        sorted(p for p in root.iterdir() if (p / "out.csv").exists()),
+        save_as="boot",
+        out=root,
+    )
+
+
+def storm_plot_fn(bench: Benchmark, config: Config):
+    from multivm import plot as multivm_plot
+
+    root = bench.root()
+    multivm_plot.init()
+    multivm_plot.visualize_storm(
+        {
+            "virtio-balloon": root / "base-manual",
+            "virtio-balloon-huge": root / "huge-manual",
+            "virtio-mem": root / "virtio-mem",
+            "HyperAlloc": root / "llfree-manual",
+        },
+        save_as="storm",
+        out=root,
+    )
+
+
+PLOTS: dict[str, Callable[[Benchmark, Config], None]] = {
+    "inflate": inflate_plot_fn,
+    "stream": stream_plot_fn,
+    "ftq": ftq_plot_fn,
+    "compiling": compiling_plot_fn,
+    "blender": blender_plot_fn,
+    "multivm": multivm_plot_fn,
+    "boot": boot_plot_fn,
+    "storm": storm_plot_fn,
+}
+
+
+def load_benchmarks(path: Path = MATRIX) -> list[Benchmark]:
+    """The benchmarks and their runs from the experiment matrix (see `benchmarks.toml`)"""
+    return [
+        Benchmark(
+            bench.name,
+            bench.module,
+            default=bench.default,
+            fast=bench.fast,
+            args=bench.args,
+            modes=[(run.mode, run.args) for run in bench.runs if not run.extra],
+            long_modes=[(run.mode, run.args) for run in bench.runs if run.extra],
+            plot=PLOTS[bench.plot],
+            all=bench.all,
+        )
+        for bench in load_matrix(path)
+    ]
 
 
 async def build():
@@ -539,8 +620,16 @@ async def verify_vfio(config: Config):
 
 
 async def main():
-    parser = ArgumentParser(description="Benchmark Runner")
-    benchmarks = {benchmark.name: benchmark for benchmark in BENCHMARKS}
+    # The matrix defines the choices of --bench
+    matrix = ArgumentParser(add_help=False)
+    matrix.add_argument("--matrix", type=Path, default=MATRIX,
+                        help="Experiment matrix with the benchmarks and their runs")
+    benchmarks = {
+        benchmark.name: benchmark
+        for benchmark in load_benchmarks(matrix.parse_known_args()[0].matrix)
+    }
+
+    parser = ArgumentParser(description="Benchmark Runner", parents=[matrix])
     parser.add_argument("step", choices=["build", "bench", "plot", "bench-plot"],
                         help="The step to run")
     parser.add_argument("-b", "--bench", choices=["all", *benchmarks], default="all",
@@ -554,13 +643,26 @@ async def main():
     parser.add_argument("--qmp-port", type=int, default=5400, help="QMP port of the VMs")
     parser.add_argument("--stream-iters", type=int, default=1900, help="Number of stream iterations")
     parser.add_argument("--ftq-iters", type=int, default=1096, help="Number of stream iterations")
+    parser.add_argument("-j", "--jobs", "--max-parallel", type=int, default=1,
+                        help="Number of benchmark runs executed concurrently on disjoint cores")
+    parser.add_argument("--mem-budget", type=int,
+                        help="Host memory in GiB for the concurrent vms (default: 90%% of the host)")
+    parser.add_argument("--fresh", action="store_true",
+                        help="Remove all previous results instead of skipping completed runs")
+    parser.add_argument("--interleave", action="store_true",
+                        help="Execute the iterations of all modes in randomized rounds to cancel host drift")
+    parser.add_argument("--seed", type=int, help="Seed of the randomized order (default: random)")
     args = parser.parse_args()
 
     config = Config(
         args.vfio_dev, args.fast, args.extra,
         args.stream_iters, args.ftq_iters,
-        args.port, args.qmp_port
+        args.port, args.qmp_port,
+        args.jobs, args.mem_budget, args.fresh,
+        args.interleave, args.seed if args.seed is not None else random.randrange(2**32),
     )
+    if config.interleave:
+        print(f"Interleaving with --seed {config.seed}")
 
     if args.step == "build":
         await build()
@@ -576,16 +678,59 @@ async def main():
             print(f"\x1b[91m{traceback.format_exc()}\x1b[0m")
             return
 
-    for benchmark in BENCHMARKS:
-        if (args.bench == "all" and benchmark.name != "blender") or args.bench == benchmark.name:
-            try:
-                if args.step in ["bench-plot", "bench"]:
-                    await benchmark.run(config)
-                if args.step in ["bench-plot", "plot"]:
-                    benchmark.plot(config)
-            except Exception as e:
-                print(f"\x1b[91mFailed to run {benchmark.name}: {e}\x1b[0m")
-                print(f"\x1b[91m{traceback.format_exc()}\x1b[0m")
+    scheduler = Scheduler(config.jobs, config.port, config.qmp_port, config.mem_budget)
+    selected = [
+        benchmark
+        for benchmark in benchmarks.values()
+        if (args.bench == "all" and benchmark.all) or args.bench == benchmark.name
+    ]
+
+    progress = Progress(config.jobs)
+
+    async def run(benchmark: Benchmark, bench: bool, plot: bool):
+        try:
+            if bench:
+                await benchmark.run(config, scheduler, progress)
+            if plot:
+                benchmark.plot(config)
+        except Exception as e:
+            print(f"\x1b[91mFailed to run {benchmark.name}: {e}\x1b[0m")
+            print(f"\x1b[91m{traceback.format_exc()}\x1b[0m")
+
+    bench = args.step in ["bench-plot", "bench"]
+    plot = args.step in ["bench-plot", "plot"]
+
+    predicted: dict[str, float | None] = {}
+    if bench:
+        # Load the history before --fresh removes it
+        model = DurationModel([Path("artifact-eval"), Path("results")])
+        for benchmark in selected:
+            benchmark.prepare(config)
+            predicted |= benchmark.estimate(config, model, progress)
+        print(f"\n\x1b[94mCampaign ETA: {progress.eta()}\x1b[0m")
+
+    if config.jobs > 1 and bench and not config.interleave:
+        # Share the cores between all benchmarks and start the longest runs first,
+        # runs without history are assumed to be long, finished ones are skipped anyway
+        runs = [(b, mode, args) for b in selected for mode, args in b.runs(config)]
+
+        def duration(run: tuple[Benchmark, str, list[str]]) -> float:
+            b, _, args = run
+            d = predicted.get(f"{b.name}/{run_dir(b.root(), args).name}", 0)
+            return float("inf") if d is None else d
+
+        runs.sort(key=duration, reverse=True)
+        await asyncio.gather(*[
+            b.run_mode(config, scheduler, progress, mode, args, b.rounds(config))
+            for b, mode, args in runs
+        ])
+        bench = False
+    elif config.jobs > 1 and bench:
+        # Share the cores between all benchmarks and plot when everything is done
+        await asyncio.gather(*[run(benchmark, True, False) for benchmark in selected])
+        bench = False
+    for benchmark in selected:
+        await run(benchmark, bench, plot)
 
 
 if __name__ == "__main__":
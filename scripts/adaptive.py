@@ -0,0 +1,134 @@
+from argparse import ArgumentParser, Namespace
+from collections.abc import Iterator
+import csv
+import json
+from math import sqrt
+from pathlib import Path
+from statistics import mean, stdev
+from time import time
+from typing import Any
+
+
+class Adaptive:
+    """
+    Stopping rule for the number of benchmark iterations.
+
+    Without a `target`, exactly `iter` iterations are executed. Otherwise,
+    iterations are added until the confidence interval (Student's t) of every
+    metric is narrower than `target` (relative half-width, e.g., 0.02 for ±2%),
+    or the `max_iter`/`max_time` budget runs out.
+    """
+
+    def __init__(
+        self,
+        target: float | None = None,
+        min_iter: int = 3,
+        max_iter: int = 20,
+        max_time: float | None = None,
+        confidence: float = 0.95,
+    ) -> None:
+        assert target is None or target > 0
+        assert 2 <= min_iter <= max_iter
+        self.target = target
+        self.min_iter = min_iter
+        self.max_iter = max_iter
+        self.max_time = max_time
+        self.confidence = confidence
+        self.samples: dict[str, list[float]] = {}
+        self.reason: str | None = None
+        self._start = time()
+
+    @staticmethod
+    def args(parser: ArgumentParser):
+        parser.add_argument("--ci-target", type=float,
+                            help="Repeat until the relative CI half-width is below this (e.g. 0.02), instead of --iter")
+        parser.add_argument("--min-iter", type=int, default=3, help="Minimum iterations with --ci-target")
+        parser.add_argument("--max-iter", type=int, default=20, help="Maximum iterations with --ci-target")
+        parser.add_argument("--max-time", type=float, help="Time budget in minutes with --ci-target")
+        parser.add_argument("--confidence", type=float, default=0.95, help="Confidence level of the interval")
+
+    @staticmethod
+    def from_args(args: Namespace) -> "Adaptive":
+        max_time = args.max_time * 60 if args.max_time is not None else None
+        return Adaptive(args.ci_target, args.min_iter, args.max_iter, max_time, args.confidence)
+
+    def add(self, **metrics: float):
+        """Record the key metrics of a finished iteration"""
+        for name, value in metrics.items():
+            self.samples.setdefault(name, []).append(float(value))
+
+    def interval(self, name: str) -> dict[str, float]:
+        """Mean and confidence interval half-width of a metric"""
+        values = self.samples[name]
+        if len(values) < 2:
+            return {"n": len(values), "mean": mean(values), "half": float("inf"), "rel": float("inf")}
+        # scipy is slow to import, keep it out of the benchmark startup
+        from scipy.stats import t
+
+        avg = mean(values)
+        half = t.ppf((1 + self.confidence) / 2, len(values) - 1) * stdev(values) / sqrt(len(values))
+        rel = half / abs(avg) if avg else float("inf")
+        return {"n": len(values), "mean": avg, "half": half, "rel": rel}
+
+    def converged(self) -> bool:
+        assert self.target is not None
+        return bool(self.samples) and all(
+            self.interval(name)["rel"] <= self.target for name in self.samples
+        )
+
+    def iterations(self, iter: int, start: int = 0) -> Iterator[int]:
+        """Yields the iteration indices, the metrics have to be added before the next one"""
+        i = 0
+        while True:
+            yield start + i
+            i += 1
+            if self.target is None:
+                if i >= iter:
+                    self.reason = "fixed"
+                    break
+            elif i >= self.min_iter and self.converged():
+                self.reason = "converged"
+                break
+            elif i >= self.max_iter:
+                self.reason = "max-iter"
+                break
+            elif self.max_time is not None and time() - self._start >= self.max_time:
+                self.reason = "max-time"
+                break
+            else:
+                print(f"Not converged after {i} iterations: {self.summary()}")
+        print(f"Stopped after {i} iterations ({self.reason}): {self.summary()}")
+
+    def summary(self) -> str:
+        out = []
+        for name in self.samples:
+            iv = self.interval(name)
+            out.append(f"{name}={iv['mean']:.4g}±{iv['rel']:.1%}")
+        return ", ".join(out)
+
+    def save(self, path: Path):
+        values: dict[str, Any] = {
+            "target": self.target,
+            "confidence": self.confidence,
+            "min_iter": self.min_iter,
+            "max_iter": self.max_iter,
+            "max_time": self.max_time,
+            "reason": self.reason,
+            "time": time() - self._start,
+            "metrics": {
+                name: {**self.interval(name), "values": values}
+                for name, values in self.samples.items()
+            },
+        }
+        path.write_text(json.dumps(values))
+
+
+def gib_min(file: Path, end: float, start: float = 0) -> float:
+    """Memory footprint (rss) of a `Measure` recording over time in GiB·min"""
+    with file.open() as f:
+        rows = [
+            (float(row["time"]) / 60, int(row["rss"]) / 1024**3)
+            for row in csv.DictReader(f)
+            if start <= float(row["time"]) <= end
+        ]
+    return sum((t1 - t0) * (m0 + m1) / 2 for (t0, m0), (t1, m1) in zip(rows, rows[1:]))
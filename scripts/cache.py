@@ -0,0 +1,61 @@
+from hashlib import sha256
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+from scripts.config import ROOT
+from scripts.utils import SSHExec
+
+CACHE_DIR = ROOT / "resources/cache"
+"""Host directory of the cached artifacts, delete it to invalidate the cache"""
+
+
+class ArtifactCache:
+    """
+    Content-addressed cache for benchmark binaries built in the guest.
+
+    Artifacts are keyed by the hash of their guest sources, the guest kernel
+    and compiler versions, and the build command (including all flags). They
+    are built once in the guest and then stored on the host, so that later runs
+    (with a fresh snapshot) only have to check the hash and upload the binary.
+    """
+
+    def __init__(self, ssh: SSHExec, dir: Path = CACHE_DIR) -> None:
+        self.ssh = ssh
+        self.dir = dir
+
+    async def build(self, sources: str, build: str, output: str) -> bool:
+        """
+        Build the guest `output` file with the `build` command, unless it is cached.
+
+        `sources` is a (globbed) list of guest files the output depends on.
+        Returns whether a cached artifact was used.
+        """
+        # Hash the sources and toolchain and read the stamp of a previous build in one go
+        out = await self.ssh.output(
+            f"{{ cat {sources}; uname -r; cc --version 2>/dev/null; }} | sha256sum;"
+            f" cat {output}.key 2>/dev/null || true"
+        )
+        # sha256sum prints the hash and `-` for stdin
+        src_hash, _, *stamp = out.split()
+        key = sha256(f"{src_hash}\n{build}".encode()).hexdigest()
+
+        if stamp == [key]:
+            print(f"Reusing {output} ({key[:12]})")
+            return True
+
+        cached = self.dir / key / Path(output).name
+        if cached.exists():
+            print(f"Uploading cached {output} ({key[:12]})")
+            await self.ssh.upload(cached, output)
+            hit = True
+        else:
+            await self.ssh.run(build)
+            cached.parent.mkdir(parents=True, exist_ok=True)
+            tmp = cached.with_suffix(".tmp")
+            await self.ssh.download(Path(output), tmp)
+            tmp.rename(cached)
+            hit = False
+        await self.ssh.run(f"echo {key} > {output}.key")
+        return hit
+
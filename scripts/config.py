@@ -1,5 +1,6 @@
 from argparse import Action, ArgumentParser, Namespace
 from collections.abc import Callable, Sequence
+from dataclasses import dataclass
 from itertools import chain
 import json
 from pathlib import Path
@@ -9,6 +10,9 @@ ROOT = Path(__file__).parent.parent
 
 DEFAULT_DISK = ROOT / "resources/debian.qcow2"
 
+DEFAULT_WRITE = ROOT.parent / "llfree-rs/target/release/write"
+"""Host build of the write benchmark, used for the initramfs guest"""
+
 DEFAULTS = {
     "base": {
         "qemu": ROOT.parent / "hyperalloc-qemu/build-virt/qemu-system-x86_64",
@@ -70,69 +74,201 @@ class ModeAction(Action):
         setattr(namespace, self.dest, values)
 
 
-BALLOON_CFG: dict[str, Callable[[int, int, int, int], list[str]]] = {
-    "base-manual": lambda cores, mem, _min_mem, _init_mem: qemu_virtio_balloon_args(
-        cores, mem, False
+@dataclass
+class IOThreads:
+    """Iothreads of the llfree balloon, by default one per vcpu and a dedicated one for the auto mode."""
+
+    count: int | None = None
+    """Number of iothreads that serve the per-vcpu queues, defaults to the vcpus"""
+    mapping: str = "round-robin"
+    """Queues to iothreads: `round-robin` (queue q to q mod count) or `block` (contiguous ranges)"""
+    shared_auto: bool = False
+    """Run the auto mode on the first queue iothread instead of a dedicated one"""
+
+    @staticmethod
+    def args(parser: ArgumentParser):
+        parser.add_argument("--iothreads", type=int,
+                            help="Number of llfree balloon iothreads, defaults to one per vcpu")
+        parser.add_argument("--vq-mapping", choices=["round-robin", "block"], default="round-robin",
+                            help="Distribution of the per-vcpu queues onto the iothreads")
+        parser.add_argument("--shared-auto-iothread", action="store_true",
+                            help="Run the auto mode on a queue iothread instead of a dedicated one")
+
+    @staticmethod
+    def from_args(args: Namespace) -> "IOThreads":
+        return IOThreads(args.iothreads, args.vq_mapping, args.shared_auto_iothread)
+
+    def queues(self, cores: int) -> list[list[int]]:
+        """The queues (one per vcpu) of every iothread"""
+        count = cores if self.count is None else self.count
+        assert 0 < count <= cores, "Need between one and one iothread per vcpu"
+        match self.mapping:
+            case "round-robin":
+                return [list(range(t, cores, count)) for t in range(count)]
+            case "block":
+                return [list(range(t * cores // count, (t + 1) * cores // count)) for t in range(count)]
+            case _:
+                assert False, f"Invalid queue mapping: {self.mapping}"
+
+
+@dataclass
+class VirtioMem:
+    """Configuration of the virtio-mem devices, by default with the block size of qemu and movable memory."""
+
+    block_size: int | None = None
+    """Granularity of plugging and unplugging in MiB, qemu defaults to the huge page size"""
+    state: str = "online_movable"
+    """How the guest onlines hotplugged memory (`memhp_default_state`)"""
+
+    @staticmethod
+    def args(parser: ArgumentParser):
+        parser.add_argument("--vmem-block-size", type=int, help="virtio-mem block size in MiB (power of two, >= 2)")
+        parser.add_argument("--memhp-state", choices=["online_movable", "online_kernel", "online"],
+                            default="online_movable", help="Onlining of the virtio-mem memory in the guest")
+
+    @staticmethod
+    def from_args(args: Namespace) -> "VirtioMem":
+        return VirtioMem(args.vmem_block_size, args.memhp_state)
+
+    def block_bytes(self) -> int:
+        """Block size in bytes"""
+        return (self.block_size or 2) * 1024**2
+
+
+BALLOON_CFG: dict[str, Callable[..., list[str]]] = {
+    "base-manual": lambda cores, mem, _min_mem, _init_mem, nodes=1, host_nodes=None, io=None, vmem=None: qemu_virtio_balloon_args(
+        cores, mem, False, nodes, host_nodes
     ),
-    "base-auto": lambda cores, mem, _min_mem, _init_mem: qemu_virtio_balloon_args(
-        cores, mem, True
+    "base-auto": lambda cores, mem, _min_mem, _init_mem, nodes=1, host_nodes=None, io=None, vmem=None: qemu_virtio_balloon_args(
+        cores, mem, True, nodes, host_nodes
     ),
-    "huge-manual": lambda cores, mem, _min_mem, _init_mem: qemu_virtio_balloon_args(
-        cores, mem, False
+    "huge-manual": lambda cores, mem, _min_mem, _init_mem, nodes=1, host_nodes=None, io=None, vmem=None: qemu_virtio_balloon_args(
+        cores, mem, False, nodes, host_nodes
     ),
-    "huge-auto": lambda cores, mem, _min_mem, _init_mem: qemu_virtio_balloon_args(
-        cores, mem, True
+    "huge-auto": lambda cores, mem, _min_mem, _init_mem, nodes=1, host_nodes=None, io=None, vmem=None: qemu_virtio_balloon_args(
+        cores, mem, True, nodes, host_nodes
     ),
-    "llfree-manual": lambda cores, mem, _min_mem, _init_mem: qemu_llfree_balloon_args(
-        cores, mem, False
+    "llfree-manual": lambda cores, mem, _min_mem, _init_mem, nodes=1, host_nodes=None, io=None, vmem=None: qemu_llfree_balloon_args(
+        cores, mem, False, nodes, host_nodes, io
     ),
-    "llfree-auto": lambda cores, mem, _min_mem, _init_mem: qemu_llfree_balloon_args(
-        cores, mem, True
+    "llfree-auto": lambda cores, mem, _min_mem, _init_mem, nodes=1, host_nodes=None, io=None, vmem=None: qemu_llfree_balloon_args(
+        cores, mem, True, nodes, host_nodes, io
     ),
-    "virtio-mem": lambda _cores, mem, min_mem, init_mem: qemu_virtio_mem_args(
-        mem, min_mem, init_mem
+    "virtio-mem": lambda cores, mem, min_mem, init_mem, nodes=1, host_nodes=None, io=None, vmem=None: qemu_virtio_mem_args(
+        mem, min_mem, init_mem, cores, nodes, host_nodes, vmem
     ),
 }
+"""
+Qemu arguments of the modes: (cores, mem, min_mem, init_mem, nodes, host_nodes, io=, vmem=).
+The guest memory is split into `nodes` numa nodes, bound to the `host_nodes`.
+`io` configures the iothreads of the llfree balloon and `vmem` the virtio-mem devices,
+the other modes ignore them.
+"""
+
 
+def node_size(mem: int, nodes: int, align: int = 2) -> str:
+    """Share of a numa node of the memory in GiB, aligned to the blocks of virtio-mem (MiB)"""
+    return f"{mem}G" if nodes == 1 else f"{mem * 1024 // nodes // align * align}M"
 
-def qemu_llfree_balloon_args(cores: int, mem: int, auto: bool) -> list[str]:
-    per_core_iothreads = [f"iothread{c}" for c in range(cores)]
-    auto_mode_iothread = "auto-mode-iothread"
+
+def qemu_memory_args(
+    cores: int, mem: int, nodes: int = 1, host_nodes: list[int] | None = None, maxmem: int | None = None
+) -> list[str]:
+    """
+    Guest memory (GiB), optionally split into `nodes` numa nodes with one
+    memory backend each, which are bound round-robin to the `host_nodes`.
+    """
+    size = f"{mem}G" if maxmem is None else f"{mem}G,maxmem={maxmem}G"
+    if nodes == 1 and not host_nodes:
+        return ["-m", size]
+    assert cores % nodes == 0, "The vcpus have to be evenly distributed"
+    assert (mem * 1024) % nodes == 0, "The memory has to be evenly distributed"
+    per_node = cores // nodes
+    args = ["-m", size]
+    for n in range(nodes):
+        backend = f"memory-backend-ram,id=mem{n},size={node_size(mem, nodes)}"
+        if host_nodes:
+            backend += f",host-nodes={host_nodes[n % len(host_nodes)]},policy=bind"
+        args += [
+            # fmt: off
+            "-object", backend,
+            "-numa", f"node,nodeid={n},cpus={n * per_node}-{(n + 1) * per_node - 1},memdev=mem{n}",
+        ]
+    return args
+
+
+def qemu_llfree_balloon_args(
+    cores: int,
+    mem: int,
+    auto: bool,
+    nodes: int = 1,
+    host_nodes: list[int] | None = None,
+    io: IOThreads | None = None,
+) -> list[str]:
+    io = io or IOThreads()
+    queues = io.queues(cores)
+    iothreads = [f"iothread{t}" for t in range(len(queues))]
+    auto_mode_iothread = iothreads[0] if io.shared_auto else "auto-mode-iothread"
     device = {
         "driver": "virtio-llfree-balloon",
         "auto-mode": auto,
         "auto-mode-iothread": auto_mode_iothread,
-        "iothread-vq-mapping": [{"iothread": t} for t in per_core_iothreads],
+        "iothread-vq-mapping": [{"iothread": t, "vqs": q} for t, q in zip(iothreads, queues)],
     }
+    if len(queues) == cores:
+        # One queue per iothread, the implicit mapping of the device
+        device["iothread-vq-mapping"] = [{"iothread": t} for t in iothreads]
+    if not io.shared_auto:
+        iothreads.insert(0, auto_mode_iothread)
     return [
-        "-m",
-        f"{mem}G",
-        "-object",
-        f"iothread,id={auto_mode_iothread}",
-        *chain(*[["-object", f"iothread,id={t}"] for t in per_core_iothreads]),
+        *qemu_memory_args(cores, mem, nodes, host_nodes),
+        *chain(*[["-object", f"iothread,id={t}"] for t in iothreads]),
         "-device",
         json.dumps(device),
     ]
 
 
-def qemu_virtio_balloon_args(cores: int, mem: int, auto: bool) -> list[str]:
+def qemu_virtio_balloon_args(
+    cores: int, mem: int, auto: bool, nodes: int = 1, host_nodes: list[int] | None = None
+) -> list[str]:
     return [
-        "-m",
-        f"{mem}G",
+        *qemu_memory_args(cores, mem, nodes, host_nodes),
         "-device",
         json.dumps({"driver": "virtio-balloon", "free-page-reporting": auto}),
     ]
 
 
-def qemu_virtio_mem_args(mem: int, min_mem: int, init_mem: int) -> list[str]:
-    default_state = "online_movable"
+def qemu_virtio_mem_args(
+    mem: int,
+    min_mem: int,
+    init_mem: int,
+    cores: int = 1,
+    nodes: int = 1,
+    host_nodes: list[int] | None = None,
+    vmem: VirtioMem | None = None,
+) -> list[str]:
+    """One virtio-mem device (`vm<node>`) per numa node, each with an equal share of the memory"""
+    vmem = vmem or VirtioMem()
+    block = vmem.block_bytes() // 1024**2
+    assert block >= 2 and block & (block - 1) == 0, "The block size has to be a power of two"
     vmem_size = round(mem - min_mem)
     req_size = round(init_mem - min_mem)
-    return [
+    device = "prealloc=off"
+    if vmem.block_size is not None:
+        device += f",block-size={block}M"
+    args = [
         # fmt: off
-        "-m", f"{min_mem}G,maxmem={mem}G",
-        "-append", f"memhp_default_state={default_state}",
+        *qemu_memory_args(cores, min_mem, nodes, host_nodes, maxmem=mem),
+        "-append", f"memhp_default_state={vmem.state}",
         "-machine", "pc",
-        "-object", f"memory-backend-ram,id=vmem0,size={vmem_size}G,prealloc=off,reserve=off",
-        "-device", f"virtio-mem-pci,id=vm0,memdev=vmem0,node=0,requested-size={req_size}G,prealloc=off"
     ]
+    for n in range(nodes):
+        backend = f"memory-backend-ram,id=vmem{n},size={node_size(vmem_size, nodes, block)},prealloc=off,reserve=off"
+        if host_nodes:
+            backend += f",host-nodes={host_nodes[n % len(host_nodes)]},policy=bind"
+        args += [
+            # fmt: off
+            "-object", backend,
+            "-device", f"virtio-mem-pci,id=vm{n},memdev=vmem{n},node={n},requested-size={node_size(req_size, nodes, block)},{device}",
+        ]
+    return args
@@ -0,0 +1,252 @@
+import atexit
+import os
+import re
+from pathlib import Path
+from typing import Any
+
+CGROUP = Path("/sys/fs/cgroup")
+NODES = Path("/sys/devices/system/node")
+
+LAYOUT: dict[str, Any] = {"method": None, "housekeeping": [], "vms": {}, "numa": {}}
+"""CPU partitioning of this process, recorded in the run metadata"""
+
+
+def parse_cpus(cpus: str) -> list[int]:
+    """Parses a cpu list like `0-3,8`"""
+    out = []
+    for part in cpus.strip().split(","):
+        if not part:
+            continue
+        start, _, end = part.partition("-")
+        out += range(int(start), int(end or start) + 1)
+    return out
+
+
+def fmt_cpus(cpus: list[int]) -> str:
+    """Formats a cpu list like `0-3,8`"""
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(f"{a}-{b}" if a != b else f"{a}" for a, b in ranges)
+
+
+def default_housekeeping() -> list[int]:
+    """The last core of this machine, including its SMT siblings"""
+    last = max(os.sched_getaffinity(0))
+    siblings = Path(f"/sys/devices/system/cpu/cpu{last}/topology/thread_siblings_list")
+    return parse_cpus(siblings.read_text()) if siblings.exists() else [last]
+
+
+def _cgroup() -> Path | None:
+    """The cgroup v2 directory with cpuset support this process is in"""
+    line = Path("/proc/self/cgroup").read_text().splitlines()[0]
+    if not line.startswith("0::"):
+        return None  # cgroup v1
+    if "cpuset" not in (CGROUP / "cgroup.controllers").read_text().split():
+        return None
+    path = CGROUP / line[3:].lstrip("/")
+    return path.parent if path.name == "housekeeping" else path
+
+
+def isolate_harness(cpus: list[int]) -> dict[str, Any]:
+    """
+    Move this process and all its future children (ssh, scp, perf, ...) onto the housekeeping cpus.
+
+    This uses a cpuset cgroup if we are allowed to create one (e.g., in a
+    delegated `systemd-run --scope -p Delegate=yes`) and the cpu affinity otherwise.
+    """
+    if LAYOUT["method"] is not None and LAYOUT["housekeeping"] == cpus:
+        return LAYOUT
+
+    method = "affinity"
+    if (base := _cgroup()) is not None:
+        group = base / "housekeeping"
+        try:
+            group.mkdir(exist_ok=True)
+            try:
+                (base / "cgroup.subtree_control").write_text("+cpuset")
+                enabled = True
+            except OSError:
+                enabled = False  # busy as long as this process is still in the base
+            (group / "cgroup.procs").write_text(str(os.getpid()))
+            if not enabled:
+                (base / "cgroup.subtree_control").write_text("+cpuset")
+            (group / "cpuset.cpus").write_text(fmt_cpus(cpus))
+            method = "cgroup"
+        except OSError:
+            # Do not stay in a half set up group
+            try:
+                (base / "cgroup.procs").write_text(str(os.getpid()))
+            except OSError:
+                pass
+            _remove(group)
+    os.sched_setaffinity(0, cpus)
+
+    LAYOUT["method"] = method
+    LAYOUT["housekeeping"] = cpus
+    print(f"Harness on housekeeping cpus {fmt_cpus(cpus)} ({method})")
+    return LAYOUT
+
+
+def _enter_vm(pid: int, cpus: list[int]) -> Path | None:
+    """Move a started vm into an own cpuset, returns its cgroup if this was possible."""
+    group = None
+    if LAYOUT["method"] == "cgroup" and (base := _cgroup()) is not None:
+        try:
+            group = base / f"vm-{pid}"
+            group.mkdir(exist_ok=True)
+            atexit.register(_remove, group)
+            (group / "cpuset.cpus").write_text(fmt_cpus(cpus))
+            (group / "cgroup.procs").write_text(str(pid))
+        except OSError:
+            group = None
+    # The threads started before the move do not inherit the affinity
+    try:
+        threads = [int(t.name) for t in Path(f"/proc/{pid}/task").iterdir()]
+    except OSError:
+        threads = []  # already exited
+    for tid in threads:
+        try:
+            os.sched_setaffinity(tid, cpus)
+        except OSError:
+            pass
+    return group
+
+
+def register_vm(pid: int, cpus: list[int], node: int | None = None):
+    """Pin a started vm to its cpus, record them (and its memory node) and make its cpuset exclusive if possible."""
+    if overlap := set(cpus) & set(LAYOUT["housekeeping"]):
+        print(f"\033[33mWARNING: vm shares cpus {fmt_cpus(list(overlap))} with the harness\033[0m")
+
+    group = _enter_vm(pid, cpus)
+    LAYOUT["vms"] = {p: c for p, c in LAYOUT["vms"].items() if _alive(p)}
+    LAYOUT["numa"] = {p: n for p, n in LAYOUT["numa"].items() if p in LAYOUT["vms"]}
+    LAYOUT["vms"][pid] = cpus
+    if node is not None:
+        LAYOUT["numa"][pid] = node
+    if group is not None:
+        try:
+            (group / "cpuset.cpus.partition").write_text("root")
+        except OSError:
+            pass  # not exclusive, e.g., if the cpus overlap
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+        return True
+    except OSError:
+        return False
+
+
+def _remove(group: Path):
+    try:
+        group.rmdir()
+    except OSError:
+        pass
+
+
+def layout() -> dict[str, Any]:
+    return {
+        "method": LAYOUT["method"],
+        "housekeeping": fmt_cpus(LAYOUT["housekeeping"]),
+        "vms": {str(pid): fmt_cpus(cpus) for pid, cpus in LAYOUT["vms"].items()},
+        "numa": {str(pid): node for pid, node in LAYOUT["numa"].items()},
+    }
+
+
+def pin_threads(
+    pid: int,
+    vcpus: dict[int, int | None],
+    iothreads: list[int],
+    iothread_cpus: list[int] | None = None,
+    emulator_cpus: list[int] | None = None,
+) -> dict[str, Any]:
+    """
+    Pin the threads of a vm within its cpuset.
+
+    `vcpus` maps the vcpu thread ids to their cpu, or None to leave them
+    floating over the cpuset. The `iothreads` are pinned to
+    `iothread_cpus` and all remaining threads (main loop, workers) to `emulator_cpus`,
+    if given. Threads that already exited are skipped.
+    """
+    threads = {int(t.name) for t in Path(f"/proc/{pid}/task").iterdir()}
+    pinned: dict[str, Any] = {"vcpus": {}, "iothreads": {}, "emulator": {}}
+
+    def pin(kind: str, tid: int, cpus: list[int]):
+        try:
+            os.sched_setaffinity(tid, cpus)
+            pinned[kind][str(tid)] = fmt_cpus(cpus)
+        except ProcessLookupError:
+            pass
+
+    for tid, cpu in vcpus.items():
+        if cpu is not None:
+            pin("vcpus", tid, [cpu])
+    if iothread_cpus:
+        for tid in iothreads:
+            pin("iothreads", tid, iothread_cpus)
+    if emulator_cpus:
+        for tid in threads - set(vcpus) - set(iothreads):
+            pin("emulator", tid, emulator_cpus)
+    return pinned
+
+
+def numa_nodes() -> dict[int, list[int]]:
+    """The cpus of every host numa node"""
+    return {
+        int(path.name[4:]): parse_cpus(path.joinpath("cpulist").read_text())
+        for path in NODES.glob("node[0-9]*")
+    }
+
+
+def numa_node(cpus: list[int]) -> int | None:
+    """
+    The numa node that contains all the cpus.
+
+    Returns None on single node hosts and if the cpus span multiple nodes.
+    """
+    nodes = numa_nodes()
+    if len(nodes) <= 1:
+        return None
+    for node, node_cpus in nodes.items():
+        if set(cpus) <= set(node_cpus):
+            return node
+    print(f"\033[33mWARNING: cpus {fmt_cpus(cpus)} span multiple numa nodes\033[0m")
+    return None
+
+
+def numa_placement(pid: int) -> dict[int, int]:
+    """Returns the bytes of the process memory on each numa node (from numa_maps)."""
+    placement: dict[int, int] = {}
+    for line in Path(f"/proc/{pid}/numa_maps").read_text().splitlines():
+        page_kb = re.search(r"kernelpagesize_kB=(\d+)", line)
+        size = int(page_kb[1]) * 1024 if page_kb else 4096
+        for node, pages in re.findall(r"\bN(\d+)=(\d+)", line):
+            placement[int(node)] = placement.get(int(node), 0) + int(pages) * size
+    return placement
+
+
+def check_numa(pid: int, threshold: float = 0.05) -> dict[str, Any]:
+    """
+    Check that the memory of a vm is on the numa node it was bound to.
+
+    Warns if more than `threshold` of the memory is on other nodes.
+    """
+    node = LAYOUT["numa"].get(pid)
+    try:
+        placement = numa_placement(pid)
+    except OSError:
+        placement = {}
+    total = sum(placement.values())
+    remote = total - placement.get(node, 0) if node is not None else 0
+    if total and remote / total > threshold:
+        print(f"\033[33mWARNING: {remote / total:.0%} of the vm memory is not on node {node}\033[0m")
+    return {
+        "node": node,
+        "placement": {str(n): b for n, b in sorted(placement.items())},
+        "remote": remote / total if total else 0.0,
+    }
@@ -0,0 +1,108 @@
+import json
+from pathlib import Path
+import re
+from statistics import mean
+from time import time
+
+TIMESTAMP = re.compile(r"^\d{6}-\d{6}-")
+
+
+class DurationModel:
+    """
+    Predicts the duration of benchmark runs from previous results.
+
+    The completion markers of `run.py` contain the exact durations. For older
+    results, the duration is estimated from the modification times of the
+    result files (e.g., `meta.json` and `times_*.json`). Runs are matched by
+    their argument hash, then by benchmark and run name, then by benchmark.
+    The benchmark is the name recorded in the marker, or otherwise the module
+    recorded in `meta.json` (shared by benchmarks like stream and ftq).
+    """
+
+    def __init__(self, roots: list[Path]) -> None:
+        self.exact: dict[str, list[float]] = {}
+        self.named: dict[tuple[str, str], list[float]] = {}
+        self.bench: dict[str, list[float]] = {}
+        for root in roots:
+            if root.exists():
+                for meta in root.glob("**/meta.json"):
+                    self._load(meta.parent)
+
+    def _load(self, out: Path):
+        key = None
+        bench = None
+        try:
+            meta = json.loads((out / "meta.json").read_text())
+            bench = meta.get("module")
+        except (OSError, ValueError):
+            pass
+        try:
+            marker = json.loads((out / "complete.json").read_text())
+            key = marker["hash"]
+            bench = marker.get("bench", bench)
+            duration = marker["duration"] * marker.get("total", 1) / max(1, marker.get("rounds", 1))
+        except (OSError, ValueError, KeyError):
+            if (out / "error.txt").exists():
+                return  # failed runs are shorter
+            mtimes = [p.stat().st_mtime for p in out.rglob("*") if p.is_file()]
+            if len(mtimes) < 2:
+                return
+            duration = max(mtimes) - min(mtimes)
+
+        if key:
+            self.exact.setdefault(key, []).append(duration)
+        if bench:
+            name = TIMESTAMP.sub("", out.name)
+            self.named.setdefault((bench, name), []).append(duration)
+            self.bench.setdefault(bench, []).append(duration)
+
+    def predict(self, bench: str, module: str, name: str, key: str) -> float | None:
+        """Predicted duration in seconds or None if there are no similar runs"""
+        for durations in [
+            self.exact.get(key),
+            self.named.get((bench, name)),
+            self.named.get((module, name)),
+            self.bench.get(bench),
+            self.bench.get(module),
+        ]:
+            if durations:
+                return mean(durations)
+        return None
+
+
+def fmt_duration(sec: float) -> str:
+    minutes = round(sec / 60)
+    return f"{minutes // 60}h{minutes % 60:02}m"
+
+
+class Progress:
+    """Prints the remaining time of a campaign."""
+
+    def __init__(self, jobs: int = 1) -> None:
+        self.jobs = jobs
+        self.pending: dict[str, float | None] = {}
+        self.start = time()
+
+    def add(self, label: str, duration: float | None):
+        self.pending[label] = duration
+
+    def eta(self) -> str:
+        known = [d for d in self.pending.values() if d is not None]
+        unknown = len(self.pending) - len(known)
+        if not self.pending:
+            return "done"
+        if not known:
+            return f"unknown ({unknown} runs without history)"
+        # Lower bound of the makespan on multiple slots
+        remaining = max(sum(known) / self.jobs, max(known))
+        out = f"{fmt_duration(remaining)} for {len(known)} runs"
+        if unknown:
+            out += f" (+{unknown} runs without history)"
+        return out
+
+    def finish(self, label: str):
+        if label not in self.pending:
+            return
+        self.pending.pop(label)
+        elapsed = fmt_duration(time() - self.start)
+        print(f"\n\x1b[94m{label} done after {elapsed}, ETA: {self.eta()}\x1b[0m")
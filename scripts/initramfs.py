@@ -0,0 +1,208 @@
+import asyncio
+import gzip
+import re
+import shutil
+from pathlib import Path
+from subprocess import CalledProcessError, check_output
+from time import time
+
+AGENT_PORT = "hyperalloc.agent"
+"""Name of the virtio-serial port the guest agent listens on"""
+
+AGENT_MARKER = "--hyperalloc-agent-exit--"
+"""Printed by the agent after every command, followed by the exit code"""
+
+INIT = f"""#!/bin/busybox sh
+/bin/busybox --install -s /bin
+mount -t proc proc /proc
+mount -t sysfs sysfs /sys
+mount -t devtmpfs devtmpfs /dev
+
+PORT=
+while [ -z "$PORT" ]; do
+    for p in /sys/class/virtio-ports/*; do
+        [ "$(cat $p/name 2>/dev/null)" = "{AGENT_PORT}" ] && PORT=/dev/${{p##*/}}
+    done
+done
+
+cd /root
+exec /bin/agent "$PORT"
+"""
+
+AGENT = f"""#!/bin/sh
+# Executes one shell command per line and reports its exit code
+exec 3<>"$1"
+while read -r cmd <&3; do
+    sh -c "$cmd" >&3 2>&1 </dev/null
+    printf '\\n{AGENT_MARKER} %d\\n' $? >&3
+done
+"""
+
+# There is no user management in the initramfs, everything runs as root
+SUDO = """#!/bin/sh
+exec "$@"
+"""
+
+
+class Initramfs:
+    """Minimal cpio (newc) archive writer for the guest initramfs."""
+
+    def __init__(self) -> None:
+        self._data = bytearray()
+        self._ino = 1
+        self._entries: set[str] = set()
+
+    def _entry(self, name: str, mode: int, data: bytes = b""):
+        name = name.strip("/")
+        if name in self._entries:
+            return
+        self._entries.add(name)
+        fields = [
+            # ino, mode, uid, gid, nlink, mtime, filesize
+            self._ino, mode, 0, 0, 1, 0, len(data),
+            # devmajor, devminor, rdevmajor, rdevminor, namesize, check
+            0, 0, 0, 0, len(name) + 1, 0,
+        ]
+        self._ino += 1
+        self._data += b"070701" + "".join(f"{f:08x}" for f in fields).encode()
+        self._data += name.encode() + b"\0"
+        self._pad()
+        self._data += data
+        self._pad()
+
+    def _pad(self):
+        self._data += b"\0" * (-len(self._data) % 4)
+
+    def dir(self, name: str):
+        parts = Path(name.strip("/")).parts
+        for i in range(len(parts)):
+            self._entry("/".join(parts[: i + 1]), 0o040755)
+
+    def file(self, name: str, data: bytes, mode: int = 0o755):
+        self.dir(str(Path(name).parent))
+        self._entry(name, 0o100000 | mode, data)
+
+    def binary(self, name: str, source: Path):
+        """Add an executable together with the shared libraries it needs."""
+        self.file(name, source.read_bytes())
+        for lib in libraries(source):
+            self.file(str(lib), lib.read_bytes())
+
+    def build(self) -> bytes:
+        self._entry("TRAILER!!!", 0)
+        return gzip.compress(bytes(self._data), compresslevel=1)
+
+
+def libraries(binary: Path) -> list[Path]:
+    """Returns the shared libraries of a dynamically linked binary."""
+    try:
+        output = check_output(["ldd", str(binary)], text=True)
+    except (CalledProcessError, FileNotFoundError):
+        return []  # statically linked
+    return [Path(p) for p in re.findall(r"(/\S+) \(0x", output)]
+
+
+def build_initramfs(
+    out: Path,
+    write: str | Path,
+    module: str | Path | None = None,
+    busybox: str | Path = "busybox",
+) -> Path:
+    """
+    Generate an initramfs that starts the guest agent instead of a full distro.
+
+    The archive contains busybox, the `write` benchmark and the optional
+    kernel module (all in `/root`). The guest kernel has to be built with
+    initramfs, devtmpfs and virtio-console support.
+    """
+    busybox = shutil.which(busybox) or busybox
+    assert Path(busybox).exists(), f"busybox not found: {busybox}"
+    assert Path(write).exists(), f"write not found: {write}"
+
+    cpio = Initramfs()
+    for d in ["dev", "proc", "sys", "tmp", "root"]:
+        cpio.dir(d)
+    cpio.binary("bin/busybox", Path(busybox))
+    cpio.file("init", INIT.encode())
+    cpio.file("bin/agent", AGENT.encode())
+    cpio.file("bin/sudo", SUDO.encode())
+    cpio.binary("root/write", Path(write))
+    if module is not None:
+        cpio.file(f"root/{Path(module).name}", Path(module).read_bytes(), 0o644)
+
+    out.write_bytes(cpio.build())
+    return out
+
+
+def agent_args(socket: Path) -> list[str]:
+    """QEMU arguments for the virtio-serial channel of the guest agent."""
+    return [
+        # fmt: off
+        "-chardev", f"socket,id=agent0,path={socket},server=on,wait=off",
+        "-device", "virtio-serial-pci",
+        "-device", f"virtserialport,chardev=agent0,name={AGENT_PORT}",
+    ]
+
+
+class AgentExec:
+    """Executing shell commands over the virtio-serial guest agent.
+
+    Provides the `run`/`output` subset of `SSHExec`, so that it can be used
+    as drop-in replacement by benchmarks that only execute commands.
+    """
+
+    def __init__(self, socket: Path) -> None:
+        self.socket = socket
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self._lock = asyncio.Lock()
+
+    async def connect(self, timeout: float = 60) -> float:
+        """Wait until the agent responds, returns the elapsed time in s"""
+        start = time()
+        async with asyncio.timeout(timeout):
+            while True:
+                try:
+                    self._reader, self._writer = await asyncio.open_unix_connection(
+                        self.socket, limit=2**24
+                    )
+                    break
+                except (FileNotFoundError, ConnectionRefusedError):
+                    await asyncio.sleep(0.01)
+            # Commands are buffered until the agent is running
+            await self.run("true")
+        return time() - start
+
+    async def disconnect(self):
+        if self._writer:
+            self._writer.close()
+            await self._writer.wait_closed()
+            self._writer = None
+            self._reader = None
+
+    async def _exec(self, cmd: str) -> tuple[int, str]:
+        assert self._reader and self._writer, "Not connected"
+        assert "\n" not in cmd, "Only single line commands are supported"
+        async with self._lock:
+            self._writer.write(f"{cmd}\n".encode())
+            await self._writer.drain()
+            marker = f"\n{AGENT_MARKER} ".encode()
+            data = await self._reader.readuntil(marker)
+            ret = int(await self._reader.readline())
+            return ret, data[: -len(marker)].decode(errors="replace")
+
+    async def run(self, cmd: str, timeout: float | None = None):
+        """Run cmd and wait for its termination"""
+        async with asyncio.timeout(timeout):
+            ret, output = await self._exec(cmd)
+        print(output, end="")
+        if ret != 0:
+            raise CalledProcessError(ret, cmd, output)
+
+    async def output(self, cmd: str, timeout: float | None = None) -> str:
+        """Run cmd and capture its output"""
+        async with asyncio.timeout(timeout):
+            ret, output = await self._exec(cmd)
+        if ret != 0:
+            raise CalledProcessError(ret, cmd, output)
+        return output
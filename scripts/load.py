@@ -0,0 +1,90 @@
+import asyncio
+from pathlib import Path
+import shlex
+import sys
+from time import time
+
+sys.path.append(str(Path(__file__).parent.parent))
+from scripts.utils import SSHExec
+
+LOADS = {
+    "write": ("./write -t{cores} -m{mem}", False),
+    "pagecache": ("cat load.bin", False),
+    "spin": ("i=0; while [ $i -lt 100000 ]; do i=$((i+1)); done", True),
+}
+"""Unit of work of the loads and whether it runs on every vcpu"""
+
+SCRIPT = "hyperalloc-load.sh"
+"""Guest script of the load"""
+PIDFILE = "hyperalloc-load.pid"
+"""Process group of the load, used to stop the loops together with their running units"""
+
+
+class BackgroundLoad:
+    """
+    A guest load that repeats its unit of work until it is stopped.
+
+    Every finished unit is timestamped on the host. Together with the end of
+    the previous unit of the same loop, this gives the duration of every unit,
+    so that the rate of the load can be compared between idle and resizing
+    periods, even if they are shorter than a single unit.
+    """
+
+    def __init__(self, ssh: SSHExec, kind: str, cores: int, mem: int) -> None:
+        """`mem` is the working set in GiB of the write and pagecache loads"""
+        self.ssh = ssh
+        self.kind = kind
+        self.cores = cores
+        self.mem = mem
+        self.units: list[tuple[float, float]] = []
+        """(start, end) of every finished unit"""
+        self._process: asyncio.subprocess.Process | None = None
+        self._reader: asyncio.Task | None = None
+
+    async def start(self):
+        unit, per_core = LOADS[self.kind]
+        unit = unit.format(cores=self.cores, mem=self.mem)
+        if self.kind == "pagecache":
+            await self.ssh.run(f"test -f load.bin || dd if=/dev/zero of=load.bin bs=1M count={self.mem * 1024}")
+        # Every loop reports its finished units with its index
+        loops = [f"(while true; do {unit} > /dev/null && echo {n}; done)" for n in range(self.cores if per_core else 1)]
+        script = f"echo $$ > {PIDFILE}; " + " & ".join(loops) + " & wait"
+        await self.ssh.run(f"echo {shlex.quote(script)} > {SCRIPT}")
+        self.units = []
+        # In its own session, the script is the leader of the process group
+        self._process = await self.ssh.process(f"setsid -w sh {SCRIPT}")
+        self._reader = asyncio.create_task(self._read(len(loops)))
+
+    async def _read(self, loops: int):
+        assert self._process and self._process.stdout
+        last = [time()] * loops
+        while line := await self._process.stdout.readline():
+            if (n := line.strip()).isdigit() and int(n) < loops:
+                now = time()
+                self.units.append((last[int(n)], now))
+                last[int(n)] = now
+
+    def rate(self, windows: list[tuple[float, float]]) -> float:
+        """
+        Units per second within the (start, end) windows.
+        Units that overlap a window count with the overlapping fraction of their duration.
+        """
+        duration = sum(end - start for start, end in windows)
+        units = sum(
+            max(0, min(end, u_end) - max(start, u_start)) / (u_end - u_start)
+            for u_start, u_end in self.units
+            if u_end > u_start
+            for start, end in windows
+        )
+        return units / duration if duration > 0 else 0
+
+    async def stop(self):
+        await self.ssh.run(f"test -f {PIDFILE} && kill -- -$(cat {PIDFILE}) 2>/dev/null; rm -f {PIDFILE}")
+        if self._process:
+            if self._process.returncode is None:
+                self._process.terminate()
+            await self._process.wait()
+        if self._reader:
+            await self._reader
+        self._process = None
+        self._reader = None
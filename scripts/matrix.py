@@ -0,0 +1,130 @@
+from dataclasses import dataclass, field
+import itertools
+from pathlib import Path
+import sys
+import tomllib
+from typing import Any
+
+sys.path.append(str(Path(__file__).parent.parent))
+from scripts.config import ROOT
+
+MATRIX = ROOT / "benchmarks.toml"
+"""Default experiment matrix of `run.py`"""
+
+
+@dataclass
+class Run:
+    """A single expanded run of a benchmark."""
+
+    mode: str
+    args: list[str]
+    """Extra arguments (with `{...}` replacements), `--mode` is added by the runner"""
+    extra: bool = False
+    """Only executed with `--extra`"""
+
+
+@dataclass
+class BenchmarkDef:
+    name: str
+    module: str
+    plot: str
+    args: list[str]
+    default: dict[str, Any] = field(default_factory=dict)
+    fast: dict[str, Any] = field(default_factory=dict)
+    all: bool = True
+    """Part of `-b all`"""
+    runs: list[Run] = field(default_factory=list)
+
+
+def axis_value(value: Any) -> dict[str, Any]:
+    """Axis values are either scalars or tables with `name` and optional `mode`/`args`"""
+    if isinstance(value, dict):
+        assert "name" in value, f"Axis value without name: {value}"
+        return {"mode": None, "args": [], **value, "name": str(value["name"])}
+    return {"name": str(value), "mode": None, "args": []}
+
+
+def matches(where: dict[str, Any], names: dict[str, str]) -> bool:
+    return all(names.get(axis) == str(value) for axis, value in where.items())
+
+
+def substitute(arg: str, names: dict[str, str]) -> str:
+    """Replace the `{axis}` placeholders, other placeholders are kept for the runner"""
+    for axis, name in names.items():
+        arg = arg.replace(f"{{{axis}}}", name)
+    return arg
+
+
+def expand(name: str, matrix: dict[str, Any]) -> list[Run]:
+    """
+    Expand one matrix entry into its runs.
+
+    The runs are the product of all axes (in the `order` of the entry or the
+    file), except for the `exclude`d combinations.
+    """
+    axes = {axis: [axis_value(v) for v in values] for axis, values in matrix.get("axes", {}).items()}
+    order = matrix.get("order", list(axes))
+    assert sorted(order) == sorted(axes), f"{name}: the order has to contain all axes"
+
+    runs = []
+    for combination in itertools.product(*[axes[a] for a in order]):
+        values = dict(zip(order, combination))
+        names = {axis: value["name"] for axis, value in values.items()}
+        if any(matches(ex, names) for ex in matrix.get("exclude", [])):
+            continue
+
+        mode = matrix.get("mode")
+        args = []
+        if "suffix" in matrix:
+            args += ["--suffix", substitute(matrix["suffix"], names)]
+        # Axis arguments in the order of the file
+        for axis in axes:
+            value = values[axis]
+            if axis == "mode":
+                mode = value["name"]
+            mode = value["mode"] or mode
+            args += value["args"]
+        args += matrix.get("args", [])
+        for override in matrix.get("override", []):
+            if matches(override.get("where", {}), names):
+                mode = override.get("mode", mode)
+                args += override.get("args", [])
+        assert mode, f"{name}: run without mode {names}"
+
+        runs.append(Run(mode, [substitute(a, names) for a in args], matrix.get("extra", False)))
+    return runs
+
+
+def load_matrix(path: Path = MATRIX) -> list[BenchmarkDef]:
+    """Load the benchmark definitions and expand them into a deduplicated list of runs."""
+    with path.open("rb") as f:
+        data = tomllib.load(f)
+
+    benchmarks = []
+    for name, bench in data.items():
+        definition = BenchmarkDef(
+            name,
+            bench["module"],
+            bench.get("plot", name),
+            bench.get("args", []),
+            bench.get("default", {}),
+            bench.get("fast", {}),
+            bench.get("all", True),
+        )
+        seen = set()
+        for matrix in bench.get("matrix", []):
+            for run in expand(name, matrix):
+                key = (run.mode, tuple(run.args))
+                if key not in seen:
+                    seen.add(key)
+                    definition.runs.append(run)
+        benchmarks.append(definition)
+    return benchmarks
+
+
+if __name__ == "__main__":
+    for bench in load_matrix(Path(sys.argv[1]) if len(sys.argv) > 1 else MATRIX):
+        print(f"{bench.name} ({bench.module}): {' '.join(bench.args)}")
+        for run in bench.runs:
+            extra = " (extra)" if run.extra else ""
+            print(f"  --mode {run.mode} {' '.join(run.args)}{extra}")
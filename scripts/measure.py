@@ -12,7 +12,7 @@ import sys
 sys.path.append(str(Path(__file__).parent.parent))
 from scripts.utils import (
     SSHExec,
-    free_pages,
+    free_pages_nodes,
     non_block_read,
     parse_meminfo,
     parse_zoneinfo,
@@ -38,16 +38,20 @@ class Measure:
         self.callback = callback
         self.ps_proc = ps_proc
 
+        # Guests with multiple sockets have a numa node per socket
+        self.nodes = getattr(args, "sockets", 1)
+
         # A bit of memory is reserved for kernel stuff
         self._reserved_mem = None
         with (self.root / f"out_{self.i}.csv").open("a+") as mem_usage:
-            mem_usage.write("time,rss,small,huge,cached,total\n")
+            per_node = "".join(f",small_{n},huge_{n}" for n in range(self.nodes))
+            mem_usage.write(f"time,rss,small,huge,cached,total{per_node if self.nodes > 1 else ''}\n")
 
         times = self.ps_proc.cpu_times()
         self._times_user = times.user
         self._times_system = times.system
         self._time = time_start or time()
-        self._vm_stats_task: Task[tuple[float, float, float, float]] | None = None
+        self._vm_stats_task: Task[tuple[float, float, float, float, list[tuple[float, float]]]] | None = None
         self._callback_task: Task | None = None
         self._errors = 0
 
@@ -61,17 +65,19 @@ class Measure:
             ) * 2**12
 
         small, huge, cached, total = nan, nan, nan, nan
+        nodes = [(nan, nan)] * self.nodes
         if self._vm_stats_task is None:
             self._vm_stats_task = asyncio.create_task(self.vm_stats())
         done, _ = await asyncio.wait({self._vm_stats_task}, timeout=1)
         if self._vm_stats_task in done:
-            small, huge, cached, total = await self._vm_stats_task
+            small, huge, cached, total, nodes = await self._vm_stats_task
             self._vm_stats_task = None
 
         sec = self.sec()
         rss = self.ps_proc.memory_info().rss
         with (self.root / f"out_{self.i}.csv").open("a+") as mem_usage:
-            mem_usage.write(f"{sec:.2f},{rss},{small},{huge},{cached},{total}\n")
+            per_node = "".join(f",{s},{h}" for s, h in nodes) if self.nodes > 1 else ""
+            mem_usage.write(f"{sec:.2f},{rss},{small},{huge},{cached},{total}{per_node}\n")
 
         if self.args.frag:
             output = await self.ssh.output("cat /proc/llfree_frag")
@@ -92,18 +98,24 @@ class Measure:
         if self.callback is not None:
             await self.callback(small, huge)
 
-    async def vm_stats(self) -> tuple[float, float, float, float]:
+    async def vm_stats(self) -> tuple[float, float, float, float, list[tuple[float, float]]]:
+        """Free small and huge pages (in total and per node), page cache and total memory"""
+        failed = nan, nan, nan, nan, [(nan, nan)] * self.nodes
         try:
-            small, huge = free_pages(
+            free = free_pages_nodes(
                 await self.ssh.output("cat /proc/buddyinfo", timeout=30)
             )
+            small = sum(s for s, _ in free.values())
+            huge = sum(h for _, h in free.values())
+            # Nodes without memory are missing in the buddyinfo
+            nodes = [free.get(n, (0, 0)) for n in range(self.nodes)]
             meminfo = parse_meminfo(
                 await self.ssh.output("cat /proc/meminfo", timeout=30)
             )
             total = meminfo["MemTotal"] + (self._reserved_mem or 0)
             cached = meminfo["Cached"]
             self._errors = 0
-            return small, huge, cached, total
+            return small, huge, cached, total, nodes
         except CalledProcessError as e:
             print("VM Stats Error")
             assert self.ps_proc.is_running()
@@ -111,7 +123,7 @@ class Measure:
             if self._errors > 5:
                 print("Too many errors!")
                 raise e
-            return nan, nan, nan, nan
+            return failed
         except asyncio.TimeoutError as e:
             print("VM Stats Timeout")
             assert self.ps_proc.is_running()
@@ -119,7 +131,7 @@ class Measure:
             if self._errors > 5:
                 print("Too many errors!")
                 raise e
-            return nan, nan, nan, nan
+            return failed
 
     def sec(self) -> float:
         return time() - self._time
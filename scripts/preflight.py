@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+import atexit
+from argparse import ArgumentParser
+import json
+from pathlib import Path
+import signal
+from subprocess import CalledProcessError, check_call
+from typing import Any
+
+CPU = Path("/sys/devices/system/cpu")
+MM = Path("/sys/kernel/mm")
+
+
+def read(path: Path) -> str | None:
+    try:
+        return path.read_text().strip()
+    except OSError:
+        return None
+
+
+def write(path: Path, value: str) -> bool:
+    try:
+        path.write_text(value)
+        return True
+    except OSError as e:
+        print(f"\033[33mWARNING: Failed to set {path}: {e}\033[0m")
+        return False
+
+
+def selected(value: str | None) -> str | None:
+    """Returns the selected option of sysfs choices like `always [madvise] never`"""
+    if value is None or "[" not in value:
+        return value
+    return value[value.index("[") + 1 : value.index("]")]
+
+
+def governors() -> list[Path]:
+    return sorted(CPU.glob("cpu[0-9]*/cpufreq/scaling_governor"))
+
+
+def settings() -> dict[str, Any]:
+    """Reads the host settings that influence the stability of the measurements."""
+    govs = {read(p) for p in governors()}
+    turbo = None
+    if (no_turbo := read(CPU / "intel_pstate/no_turbo")) is not None:
+        turbo = no_turbo == "0"
+    elif (boost := read(CPU / "cpufreq/boost")) is not None:
+        turbo = boost == "1"
+    swaps = (read(Path("/proc/swaps")) or "").splitlines()[1:]
+    iommu = Path("/sys/class/iommu")
+    return {
+        "driver": read(CPU / "cpu0/cpufreq/scaling_driver"),
+        "governor": ",".join(sorted(g for g in govs if g)) or None,
+        "min_perf_pct": read(CPU / "intel_pstate/min_perf_pct"),
+        "turbo": turbo,
+        "smt": read(CPU / "smt/active") == "1",
+        "thp_enabled": selected(read(MM / "transparent_hugepage/enabled")),
+        "thp_defrag": selected(read(MM / "transparent_hugepage/defrag")),
+        "ksm": read(MM / "ksm/run") == "1",
+        "numa_balancing": (read(Path("/proc/sys/kernel/numa_balancing")) or "0") != "0",
+        "swap": [line.split()[0] for line in swaps],
+        "iommu": sorted(p.name for p in iommu.iterdir()) if iommu.exists() else [],
+    }
+
+
+def noise(values: dict[str, Any]) -> list[str]:
+    """Returns the active noise sources."""
+    issues = []
+    if values["governor"] not in [None, "performance"]:
+        issues.append(f"governor {values['governor']}")
+    if values["min_perf_pct"] not in [None, "100"]:
+        issues.append(f"min_perf_pct {values['min_perf_pct']}")
+    if values["turbo"]:
+        issues.append("turbo")
+    if values["smt"]:
+        issues.append("smt")
+    if values["thp_enabled"] not in [None, "madvise"]:
+        issues.append(f"thp enabled {values['thp_enabled']}")
+    if values["thp_defrag"] == "always":
+        issues.append("thp defrag always (compaction stalls)")
+    if values["ksm"]:
+        issues.append("ksm")
+    if values["numa_balancing"]:
+        issues.append("numa balancing")
+    if values["swap"]:
+        issues.append("swap")
+    return issues
+
+
+def tune(values: dict[str, Any]):
+    """Disables the noise sources (requires root), they are restored on exit."""
+    restore: list[tuple[Path, str]] = []
+
+    def change(path: Path, value: str):
+        if (old := read(path)) is not None and old != value:
+            if write(path, value):
+                restore.append((path, selected(old) or old))
+
+    for gov in governors():
+        change(gov, "performance")
+    change(CPU / "intel_pstate/min_perf_pct", "100")
+    if values["turbo"]:
+        change(CPU / "intel_pstate/no_turbo", "1")
+        change(CPU / "cpufreq/boost", "0")
+    if values["smt"]:
+        change(CPU / "smt/control", "off")
+    # qemu requests huge pages for the guest memory with madvise
+    if values["thp_enabled"] not in [None, "madvise"]:
+        change(MM / "transparent_hugepage/enabled", "madvise")
+    if values["thp_defrag"] == "always":
+        change(MM / "transparent_hugepage/defrag", "madvise")
+    change(MM / "ksm/run", "0")
+    change(Path("/proc/sys/kernel/numa_balancing"), "0")
+    if values["swap"]:
+        try:
+            check_call(["swapoff", "-a"])
+            restore_swap = True
+        except (CalledProcessError, FileNotFoundError) as e:
+            print(f"\033[33mWARNING: Failed to disable swap: {e}\033[0m")
+            restore_swap = False
+    else:
+        restore_swap = False
+
+    def cleanup():
+        # Restore in reverse order, e.g., smt before the governors of the siblings,
+        # a failed step does not stop the others
+        for path, value in reversed(restore):
+            try:
+                write(path, value)
+            except Exception as e:
+                print(f"\033[33mWARNING: Failed to restore {path}: {e}\033[0m")
+        if restore_swap:
+            try:
+                check_call(["swapon", "-a"])
+            except (CalledProcessError, OSError) as e:
+                print(f"\033[33mWARNING: Failed to restore swap: {e}\033[0m")
+
+    atexit.register(cleanup)
+
+
+def preflight(apply: bool = False) -> dict[str, Any]:
+    """
+    Check the host configuration before a benchmark and warn about noise sources.
+
+    With `apply`, the noise sources are disabled for the lifetime of this process.
+    Returns the observed settings and whether they are suboptimal.
+    """
+    values = settings()
+    if apply and noise(values):
+        tune(values)
+        values = settings()
+
+    issues = noise(values)
+    if issues:
+        print(f"\033[33mWARNING: Suboptimal host configuration: {', '.join(issues)}\033[0m")
+    return {**values, "noise": issues, "suboptimal": bool(issues)}
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Check the host configuration for benchmarking")
+    parser.add_argument(
+        "--tune",
+        action="store_true",
+        help="Disable host noise sources like turbo, SMT and KSM (requires root) until interrupted",
+    )
+    args = parser.parse_args()
+    print(json.dumps(preflight(args.tune), indent=2))
+    if args.tune:
+        # The settings are restored on exit
+        print("Tuned, press Ctrl-C to restore")
+        try:
+            signal.pause()
+        except KeyboardInterrupt:
+            pass
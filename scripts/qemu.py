@@ -1,13 +1,31 @@
+from argparse import ArgumentParser, Namespace
+import asyncio
 from asyncio import sleep
+import atexit
+from dataclasses import dataclass
 from itertools import chain
 import json
+import os
 from pathlib import Path
-from subprocess import PIPE, STDOUT, Popen
+from subprocess import PIPE, STDOUT, CalledProcessError, Popen, check_call, check_output
+import tempfile
+from threading import Thread
 import psutil
+from qemu.qmp import QMPClient
+import shutil
 import sys
+from typing import Any
 
 sys.path.append(str(Path(__file__).parent.parent))
-from scripts.utils import non_block_read, rm_ansi_escape
+from scripts.cpuset import LAYOUT, numa_node, parse_cpus, pin_threads, register_vm
+from scripts.initramfs import agent_args
+from scripts.utils import (
+    SSHExec,
+    fmt_bytes,
+    non_block_read,
+    rm_ansi_escape,
+    transport_stats,
+)
 
 
 def qemu_vm(
@@ -25,34 +43,54 @@ def qemu_vm(
     vfio_group: int | None = None,
     slice: str | None = None,
     core_start: int = 0,
+    initrd: str | Path | None = None,
+    agent: Path | None = None,
+    disk: "Disk | None" = None,
+    transport: "Transport | None" = None,
+    numa_bind: bool = True,
+    extra_cores: list[int] | None = None,
 ) -> Popen[str]:
-    """Start a vm with the given configuration."""
+    """
+    Start a vm with the given configuration.
+
+    If `initrd` is given, the vm boots into this initramfs instead of the disk
+    image and `agent` is the socket of its virtio-serial agent (see `initramfs.py`).
+    With `numa_bind`, the guest memory is bound to the host numa node of the
+    pinned cores (see `check_numa` for the actual placement).
+    With multiple `sockets`, the numa nodes of the guest are defined by the
+    memory arguments in `extra_args` (see `Topology`).
+    The `extra_cores` are added to the cpuset of the vm, e.g., for the
+    iothreads and emulator threads (see `Pinning`).
+    """
     assert cores > 0 and cores % sockets == 0
 
     logical = psutil.cpu_count(logical=True)
     physical = psutil.cpu_count(logical=False)
     assert logical is not None and physical is not None
     assert cores <= logical
-    assert Path(hda).exists()
-
-    assert sockets == 1, "not supported"
+    assert initrd is not None or Path(hda).exists()
 
     if not extra_args:
         extra_args = []
 
+    disk = disk or Disk()
+    overlay = qemu_overlay(qemu, hda) if disk.overlay and not initrd else None
+
     base_args = [
         # fmt: off
         str(qemu),
         #"-m", f"{mem}G",
-        "-smp", f"{cores}",
-        "-hda", str(hda),
-        "-snapshot",
+        "-smp", f"{cores}" if sockets == 1 else f"{cores},sockets={sockets}",
+        *(
+            initrd_args(initrd, agent)
+            if initrd
+            else [*disk_args(hda, disk, overlay), *net_args(port, transport)]
+        ),
         "-serial", "mon:stdio",
         "-nographic",
         "-kernel", str(kernel),
-        "-append", "root=/dev/sda3 console=ttyS0 nokaslr",
+        "-append", "console=ttyS0 nokaslr",
         "-qmp", f"tcp:localhost:{qmp_port},server=on,wait=off",
-        "-nic", f"user,hostfwd=tcp:127.0.0.1:{port}-:22",
         "-no-reboot",
         "--cpu", "host",
         *extra_args,
@@ -60,6 +98,32 @@ def qemu_vm(
         *vfio_args(vfio_group),
     ]
 
+    # Pin qemu to a cpuset on one numa node with one core per vcpu
+    step = 1
+    if logical > physical:
+        print("\033[33mWARNING: SMT detected, results might be less stable!\033[0m")
+        if (core_start + cores) <= physical:
+            step = 2
+            print("  \033[33mPinning on physical cores.\033[0m")
+        else:
+            print("  \033[33mPinning on logical cores.\033[0m")
+    assert (core_start + cores * step) <= logical, "Not enough cores"
+
+    cpu_set = [x * step for x in range(core_start, core_start + cores)]
+    cpu_set += [c for c in extra_cores or [] if c not in cpu_set]
+
+    # Allocate the guest memory on the node of the vcpus,
+    # unless the memory backends are already bound (see `qemu_memory_args`)
+    if any("host-nodes=" in arg for arg in extra_args):
+        numa_bind = False
+    node = numa_node(cpu_set) if numa_bind else None
+    if node is not None:
+        if shutil.which("numactl"):
+            base_args = ["numactl", f"--membind={node}", "--", *base_args]
+        else:
+            print("\033[33mWARNING: numactl not found, guest memory is not bound\033[0m")
+            node = None
+
     if slice:
         base_args = ["systemd-run", "--user", "--slice", slice, "--scope", *base_args]
 
@@ -78,25 +142,288 @@ def qemu_vm(
     if kvm:
         args.append("-enable-kvm")
 
-    process = Popen(args, stdout=PIPE, stderr=STDOUT, text=True, env=env)
+    # Pinned right after the start, later qemu threads inherit the cpuset
+    process = Popen(
+        args,
+        stdout=PIPE,
+        stderr=STDOUT,
+        text=True,
+        env=env,
+    )
+    register_vm(process.pid, cpu_set, node)
+    if overlay:
+        Thread(target=remove_overlay, args=(process, overlay), daemon=True).start()
 
-    # Pin qemu to a cpuset on one numa node with one core per vcpu
-    step = 1
-    if logical > physical:
-        print("\033[33mWARNING: SMT detected, results might be less stable!\033[0m")
-        if (core_start + cores) <= physical:
-            step = 2
-            print("  \033[33mPinning on physical cores.\033[0m")
-        else:
-            print("  \033[33mPinning on logical cores.\033[0m")
-    assert (core_start + cores * step) <= logical, "Not enough cores"
+    return process
 
-    cpu_set = [x * step for x in range(core_start, core_start + cores)]
 
-    q = psutil.Process(process.pid)
-    q.cpu_affinity(cpu_set)
+@dataclass
+class Disk:
+    """Configuration of the guest disk."""
 
-    return process
+    interface: str = "ide"
+    """Emulated controller: ide, virtio-blk or virtio-scsi"""
+    aio: str = "threads"
+    """Host I/O backend: threads, native or io_uring"""
+    cache: str = "writeback"
+    """Host cache mode, "none" bypasses the host page cache"""
+    overlay: bool = False
+    """Use an explicit temporary qcow2 overlay instead of `-snapshot`"""
+
+    @staticmethod
+    def args(parser: ArgumentParser):
+        parser.add_argument("--disk", choices=["ide", "virtio-blk", "virtio-scsi"],
+                            default="ide", help="Disk controller of the VM")
+        parser.add_argument("--disk-aio", choices=["threads", "native", "io_uring"],
+                            default="threads", help="Host AIO backend for the disk")
+        parser.add_argument("--disk-cache", choices=["writeback", "writethrough", "none", "directsync", "unsafe"],
+                            default="writeback", help="Host cache mode for the disk")
+        parser.add_argument("--disk-overlay", action="store_true",
+                            help="Write to a temporary qcow2 overlay instead of using -snapshot")
+
+    @staticmethod
+    def from_args(args: Namespace) -> "Disk":
+        return Disk(args.disk, args.disk_aio, args.disk_cache, args.disk_overlay)
+
+
+@dataclass
+class Topology:
+    """Numa topology of the guest, one node per socket."""
+
+    sockets: int = 1
+    host_nodes: list[int] | None = None
+    """Host numa nodes the guest nodes are bound to (round-robin)"""
+
+    @staticmethod
+    def args(parser: ArgumentParser):
+        parser.add_argument("--sockets", type=int, default=1,
+                            help="Sockets of the guest, each with its own numa node and memory backend")
+        parser.add_argument("--host-nodes", type=parse_cpus,
+                            help="Host numa nodes for the guest nodes, like `0-1`")
+
+    @staticmethod
+    def from_args(args: Namespace) -> "Topology":
+        return Topology(args.sockets, args.host_nodes)
+
+
+@dataclass
+class Pinning:
+    """Placement of the qemu threads, by default all threads float over the cpuset of the vm."""
+
+    vcpus: bool = False
+    """Pin every vcpu thread to its own core"""
+    iothreads: list[int] | None = None
+    """Host cpus of the iothreads (e.g., of the llfree balloon)"""
+    emulator: list[int] | None = None
+    """Host cpus of the main loop and all other threads"""
+
+    @staticmethod
+    def args(parser: ArgumentParser):
+        parser.add_argument("--pin-vcpus", action="store_true",
+                            help="Pin every vcpu thread 1:1 to the cores of the vm")
+        parser.add_argument("--iothread-cores", type=parse_cpus,
+                            help="Host cpus for the iothreads, like `20-21`, added to the cpuset of the vm")
+        parser.add_argument("--emulator-cores", type=parse_cpus,
+                            help="Host cpus for the main loop and the other qemu threads")
+
+    @staticmethod
+    def from_args(args: Namespace) -> "Pinning":
+        return Pinning(args.pin_vcpus, args.iothread_cores, args.emulator_cores)
+
+    def cores(self) -> list[int]:
+        """Additional cores of the vm cpuset (`extra_cores` of `qemu_vm`)"""
+        return sorted(set(self.iothreads or []) | set(self.emulator or []))
+
+    async def apply(self, qmp: QMPClient, pid: int) -> dict[str, Any]:
+        """Pin the threads of a booted vm, using the thread ids from QMP"""
+        if not (self.vcpus or self.iothreads or self.emulator):
+            return {}
+        # The vcpus are never pinned to the emulator cores
+        cpus = await qmp.execute("query-cpus-fast")
+        vcpus: dict[int, int | None] = {cpu["thread-id"]: None for cpu in cpus}
+        if self.vcpus:
+            # The vcpu cores are at the start of the cpuset, followed by the extra cores
+            cores = LAYOUT["vms"][pid][: len(cpus)]
+            for cpu in cpus:
+                vcpus[cpu["thread-id"]] = cores[cpu["cpu-index"] % len(cores)]
+        iothreads = [t["thread-id"] for t in await qmp.execute("query-iothreads")]
+        pinned = pin_threads(pid, vcpus, iothreads, self.iothreads, self.emulator)
+        print(
+            f"pinned {len(pinned['vcpus'])} vcpus, {len(pinned['iothreads'])} iothreads,",
+            f"{len(pinned['emulator'])} emulator threads",
+        )
+        return pinned
+
+    async def pin(self, qmp_port: int, pid: int) -> dict[str, Any]:
+        """Like `apply`, but with a temporary QMP connection"""
+        if not (self.vcpus or self.iothreads or self.emulator):
+            return {}
+        qmp = QMPClient("pinning")
+        await qmp.connect(("127.0.0.1", qmp_port))
+        try:
+            return await self.apply(qmp, pid)
+        finally:
+            await qmp.disconnect()
+
+
+async def iothread_times(qmp: QMPClient, pid: int) -> dict[str, float]:
+    """CPU time (user + system in s) of every iothread, by its id"""
+    ids = {t["thread-id"]: t["id"] for t in await qmp.execute("query-iothreads")}
+    return {
+        ids[t.id]: t.user_time + t.system_time
+        for t in psutil.Process(pid).threads()
+        if t.id in ids
+    }
+
+
+def disk_args(hda: str | Path, disk: Disk, overlay: Path | None = None) -> list[str]:
+    # O_DIRECT is required for linux native AIO
+    assert disk.aio != "native" or disk.cache in ["none", "directsync"], \
+        "native aio requires cache=none or cache=directsync"
+
+    drive = f"cache={disk.cache},aio={disk.aio}"
+    if overlay:
+        drive = f"file={overlay},format=qcow2,{drive}"
+    else:
+        drive = f"file={hda},snapshot=on,{drive}"
+
+    match disk.interface:
+        case "ide":
+            return [
+                # fmt: off
+                "-drive", f"{drive},if=ide,index=0,media=disk",
+                "-append", "root=/dev/sda3",
+            ]
+        case "virtio-blk":
+            return [
+                # fmt: off
+                "-drive", f"{drive},if=none,id=disk0",
+                "-device", "virtio-blk-pci,drive=disk0",
+                "-append", "root=/dev/vda3",
+            ]
+        case "virtio-scsi":
+            return [
+                # fmt: off
+                "-drive", f"{drive},if=none,id=disk0",
+                "-device", "virtio-scsi-pci,id=scsi0",
+                "-device", "scsi-hd,drive=disk0,bus=scsi0.0",
+                "-append", "root=/dev/sda3",
+            ]
+        case _:
+            assert False, f"Invalid disk interface: {disk.interface}"
+
+
+def qemu_overlay(qemu: str | Path, hda: str | Path) -> Path:
+    """Create a temporary qcow2 overlay of hda that is removed on exit."""
+    qemu_img = Path(qemu).parent / "qemu-img"
+    qemu_img = str(qemu_img) if qemu_img.exists() else "qemu-img"
+
+    hda = Path(hda).resolve()
+    info = json.loads(check_output([qemu_img, "info", "--output=json", str(hda)]))
+
+    # Like -snapshot, prefer /var/tmp, which (unlike tmpfs) supports O_DIRECT
+    fd, overlay = tempfile.mkstemp(
+        ".qcow2", "hyperalloc-", os.environ.get("TMPDIR", "/var/tmp")
+    )
+    os.close(fd)
+    atexit.register(Path(overlay).unlink, missing_ok=True)
+    check_call(
+        # fmt: off
+        [qemu_img, "create", "-q", "-f", "qcow2",
+         "-b", str(hda), "-F", info["format"], overlay]
+    )
+    return Path(overlay)
+
+
+def remove_overlay(qemu: Popen[str], overlay: Path):
+    qemu.wait()
+    overlay.unlink(missing_ok=True)
+
+
+@dataclass
+class Transport:
+    """Host-guest channel used for ssh and file transfers."""
+
+    kind: str = "user"
+    """user (slirp port forwarding), vsock (ssh over vhost-vsock) or tap (vhost-net)"""
+    tap: str | None = None
+    """Existing host tap interface (only tap)"""
+    guest_ip: str | None = None
+    """Address of the guest on the tap interface (only tap)"""
+    throughput: bool = False
+    """Also measure the throughput of the channel, which transfers 64 MiB each way"""
+
+    @staticmethod
+    def args(parser: ArgumentParser):
+        parser.add_argument("--transport", choices=["user", "vsock", "tap"], default="user",
+                            help="Host-guest channel for ssh, slirp is used as fallback")
+        parser.add_argument("--tap", help="Host tap interface for --transport tap")
+        parser.add_argument("--tap-ip", help="Guest address for --transport tap")
+        parser.add_argument("--transport-throughput", action="store_true",
+                            help="Measure the up/download throughput of the transport on every boot")
+
+    @staticmethod
+    def from_args(args: Namespace) -> "Transport":
+        return Transport(args.transport, args.tap, args.tap_ip, args.transport_throughput)
+
+    async def connect(self, user: str, port: int, log: Path | None = None) -> SSHExec:
+        """
+        Connect to the booted guest with the ssh `port` of the slirp fallback.
+
+        The vsock CID is the ssh port, which is already unique for every VM.
+        The latency (and optionally the throughput) of the chosen channel are reported and saved to `log`.
+        """
+        ssh = SSHExec(user, port=port)
+        fast = None
+        match self.kind:
+            case "vsock":
+                proxy = f"socat - VSOCK-CONNECT:{port}:22"
+                fast = SSHExec(user, f"vsock-{port}", proxy=proxy)
+            case "tap":
+                assert self.guest_ip, "tap requires the guest address"
+                fast = SSHExec(user, self.guest_ip)
+
+        kind = "user"
+        if fast:
+            try:
+                await fast.run("true", timeout=10)
+                ssh, kind = fast, self.kind
+            except (CalledProcessError, asyncio.TimeoutError):
+                print(f"\033[33mWARNING: {self.kind} unreachable, falling back to slirp\033[0m")
+
+        stats = await transport_stats(ssh, 2**26 if self.throughput else 0)
+        print(
+            f"transport {kind}: latency={stats['latency'] * 1000:.1f}ms",
+            *([f"down={fmt_bytes(stats['download'])}/s up={fmt_bytes(stats['upload'])}/s"] if self.throughput else []),
+        )
+        if log:
+            log.write_text(json.dumps({"transport": kind, **stats}))
+        return ssh
+
+
+def net_args(port: int, transport: Transport | None = None) -> list[str]:
+    # slirp is always available as fallback
+    args = ["-nic", f"user,hostfwd=tcp:127.0.0.1:{port}-:22"]
+    match transport.kind if transport else "user":
+        case "vsock":
+            args += ["-device", f"vhost-vsock-pci,guest-cid={port}"]
+        case "tap":
+            assert transport and transport.tap, "tap requires a host interface"
+            args += [
+                # fmt: off
+                "-netdev", f"tap,id=net0,ifname={transport.tap},script=no,downscript=no,vhost=on",
+                "-device", "virtio-net-pci,netdev=net0",
+            ]
+    return args
+
+
+def initrd_args(initrd: str | Path, agent: Path | None) -> list[str]:
+    return [
+        # fmt: off
+        "-initrd", str(initrd),
+        "-append", "rdinit=/init",
+        *(agent_args(agent) if agent else []),
+    ]
 
 
 def vfio_dev_arg(dev: str | None) -> list[str]:
@@ -0,0 +1,153 @@
+from argparse import ArgumentParser
+import asyncio
+from collections.abc import AsyncIterator, Sequence
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from pathlib import Path
+import sys
+
+import psutil
+
+sys.path.append(str(Path(__file__).parent.parent))
+from scripts.cpuset import default_housekeeping, numa_nodes
+
+PORT_STRIDE = 16
+"""Ports reserved per slot, multivm uses `port + id` for every vm"""
+
+
+@dataclass
+class Job:
+    """Host resources of a single benchmark run."""
+
+    cores: int
+    mem: int
+    """Guest memory in GiB"""
+    vms: int = 1
+    vfio: bool = False
+    """The passthrough device can only be used by one vm at a time"""
+
+    @staticmethod
+    def from_args(args: Sequence[str]) -> "Job":
+        parser = ArgumentParser(add_help=False)
+        parser.add_argument("-c", "--cores", type=int, default=8)
+        parser.add_argument("-m", "--mem", type=int, default=8)
+        parser.add_argument("--vms", type=int, default=1)
+        parser.add_argument("--vfio-dev")
+        parsed, _ = parser.parse_known_args(args)
+        return Job(parsed.cores, parsed.mem, parsed.vms, parsed.vfio_dev is not None)
+
+
+@dataclass
+class Slot:
+    """Resources assigned to a running job."""
+
+    index: int
+    core_start: int
+    port: int
+    qmp: int
+
+    def args(self) -> list[str]:
+        return [
+            # fmt: off
+            "--port", f"{self.port}",
+            "--qmp", f"{self.qmp}",
+            "--core-start", f"{self.core_start}",
+        ]
+
+
+class Scheduler:
+    """
+    Runs independent benchmark jobs concurrently on disjoint cores.
+
+    Cores are allocated in the units of `core_start` (see `qemu_vm`), which are
+    physical cores on SMT hosts. A job never spans multiple numa nodes, the
+    housekeeping core of the harness is excluded, and the guest memory of all
+    running jobs stays below `mem_budget` GiB.
+    """
+
+    def __init__(
+        self, jobs: int, port: int, qmp_port: int, mem_budget: int | None = None
+    ) -> None:
+        assert jobs > 0
+        self.jobs = jobs
+        self.port = port
+        self.qmp_port = qmp_port
+        if mem_budget is None:
+            mem_budget = int(psutil.virtual_memory().total * 0.9) // 1024**3
+        self.mem_budget = mem_budget
+
+        logical = psutil.cpu_count(logical=True)
+        physical = psutil.cpu_count(logical=False)
+        assert logical is not None and physical is not None
+        self.step = 2 if logical > physical else 1
+        units = physical if logical > physical else logical
+
+        housekeeping = set(default_housekeeping())
+        node_of = {cpu: node for node, cpus in numa_nodes().items() for cpu in cpus}
+        # numa node of every usable unit
+        self.units = {
+            u: node_of.get(u * self.step, 0)
+            for u in range(units)
+            if u * self.step not in housekeeping
+        }
+
+        self.used: set[int] = set()
+        self.slots: set[int] = set()
+        self.mem = 0
+        self.vfio = False
+        self.cond = asyncio.Condition()
+
+    def _cores(self, cores: int) -> int | None:
+        """First fitting contiguous range of free units on a single node"""
+        for start in self.units:
+            range_ = range(start, start + cores)
+            if all(
+                u in self.units and u not in self.used
+                and self.units[u] == self.units[start]
+                for u in range_
+            ):
+                return start
+        return None
+
+    def _fits(self, job: Job) -> bool:
+        return (
+            len(self.slots) < self.jobs
+            and self.mem + job.mem * job.vms <= self.mem_budget
+            and not (job.vfio and self.vfio)
+            and self._cores(job.cores * job.vms) is not None
+        )
+
+    @asynccontextmanager
+    async def slot(self, job: Job) -> AsyncIterator[Slot]:
+        """Wait until the resources for the job are free and reserve them"""
+        assert job.vms <= PORT_STRIDE, "Too many vms for one slot"
+        cores = job.cores * job.vms
+        async with self.cond:
+            # A job that never fits runs alone, like without the scheduler
+            await self.cond.wait_for(lambda: self._fits(job) or not self.slots)
+            start = self._cores(cores)
+            if start is None:
+                print(f"\033[33mWARNING: {cores} cores do not fit, running alone\033[0m")
+                start = 0
+            index = min(set(range(self.jobs)) - self.slots)
+            units = set(range(start, start + cores))
+            self.slots.add(index)
+            self.used |= units
+            self.mem += job.mem * job.vms
+            self.vfio |= job.vfio
+
+        try:
+            yield Slot(
+                index,
+                start,
+                self.port + index * PORT_STRIDE,
+                self.qmp_port + index * PORT_STRIDE,
+            )
+        finally:
+            async with self.cond:
+                self.slots.discard(index)
+                self.used -= units
+                self.mem -= job.mem * job.vms
+                if job.vfio:
+                    self.vfio = False
+                self.cond.notify_all()
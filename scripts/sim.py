@@ -0,0 +1,427 @@
+from argparse import ArgumentParser
+import asyncio
+from collections.abc import Sequence
+import json
+import os
+from pathlib import Path
+from statistics import mean, median
+from subprocess import Popen, PIPE, STDOUT, TimeoutExpired
+import sys
+from time import time
+
+from psutil import Process
+from qemu.qmp import QMPClient, QMPError
+
+sys.path.append(str(Path(__file__).parent.parent))
+from scripts.config import ROOT
+from scripts.initramfs import AGENT_MARKER, AgentExec
+from scripts.measure import Measure
+from scripts.utils import free_pages, parse_meminfo, parse_zoneinfo, setup
+from scripts.vm_resize import VMResize
+
+PAGE = 2**12
+ORDERS = 11
+MODES = ["base-manual", "huge-manual", "llfree-manual", "virtio-mem"]
+
+
+class Guest:
+    """
+    Synthetic memory state of a simulated vm.
+
+    The used memory follows a scripted `curve` of (seconds, GiB) points. The
+    vm size follows the resize requests over QMP with `rate` GiB/s, the rest
+    is reported as free in the buddyinfo, where `frag` is the fraction of
+    free memory that is not in huge pages.
+    """
+
+    def __init__(
+        self,
+        mode: str,
+        mem: int,
+        min_mem: int,
+        curve: list[tuple[float, float]],
+        rate: float = 1,
+        frag: float = 0.1,
+        cache: float = 0.3,
+        rss_scale: float = 1 / 1024,
+    ) -> None:
+        assert curve, "Empty memory curve"
+        self.mode = mode
+        self.total = mem * 2**30
+        # virtio-mem starts with the unplugged memory, the balloon drivers deflated
+        self.min = min_mem * 2**30 if mode == "virtio-mem" else 0
+        self.curve = sorted(curve)
+        self.rate = rate * 2**30
+        self.frag = frag
+        self.cache = cache
+        self.rss_scale = rss_scale
+        self.start = time()
+        self._size = float(self.total)
+        self._target = self.total
+        self._update = self.start
+        self._touched = 0
+        self._rss = bytearray()
+
+    def used(self) -> int:
+        """Interpolated memory usage of the curve"""
+        t = time() - self.start
+        (t0, m0) = self.curve[0]
+        if t <= t0:
+            return int(m0 * 2**30)
+        for t1, m1 in self.curve[1:]:
+            if t <= t1:
+                return int((m0 + (m1 - m0) * (t - t0) / (t1 - t0)) * 2**30)
+            t0, m0 = t1, m1
+        return int(m0 * 2**30)
+
+    def size(self) -> int:
+        """Current vm size, moving towards the requested size"""
+        now = time()
+        step = self.rate * (now - self._update)
+        self._update = now
+        if self._size < self._target:
+            self._size = min(self._target, self._size + step)
+        else:
+            self._size = max(self._target, self._size - step)
+        return int(self._size) // PAGE * PAGE
+
+    def resize(self, target: int):
+        self._target = max(self.min, min(self.total, target))
+
+    def tick(self):
+        """The host memory (rss) follows the touched memory, scaled down by `rss_scale`"""
+        size = self.size()
+        self._touched = min(size, max(self._touched, self.used()))
+        rss = int(self._touched * self.rss_scale)
+        if rss > len(self._rss):
+            self._rss.extend(bytes(rss - len(self._rss)))
+        else:
+            del self._rss[rss:]
+
+    def buddyinfo(self) -> str:
+        size = self.size()
+        free = max(0, size - self.used()) // PAGE
+        small = int(free * self.frag)
+        huge = (free - small) >> 9
+        small += (free - small) & 0x1ff
+        counts = [0] * ORDERS
+        # small pages are spread over the lower orders
+        for order in reversed(range(9)):
+            counts[order] = small >> order
+            small -= counts[order] << order
+        counts[10] = huge >> 1
+        counts[9] = huge & 1
+        return f"Node 0, zone   Normal {' '.join(f'{c:6}' for c in counts)}\n"
+
+    def meminfo(self) -> str:
+        size = self.size()
+        used = min(size, self.used())
+        values = {
+            "MemTotal": size,
+            "MemFree": size - used,
+            "MemAvailable": size - int(used * (1 - self.cache)),
+            "Cached": int(used * self.cache),
+        }
+        return "".join(f"{k}: {v // 1024:>8} kB\n" for k, v in values.items())
+
+    def zoneinfo(self) -> str:
+        present = self.total // PAGE
+        managed = int(present * 0.99)
+        return f"Node 0, zone   Normal\n  pages free     0\n        present  {present}\n        managed  {managed}\n"
+
+    def exec(self, cmd: str) -> tuple[int, str]:
+        match cmd.strip():
+            case "true":
+                return 0, ""
+            case "cat /proc/buddyinfo":
+                return 0, self.buddyinfo()
+            case "cat /proc/meminfo":
+                return 0, self.meminfo()
+            case "cat /proc/zoneinfo":
+                return 0, self.zoneinfo()
+            case "echo 1 | sudo tee /proc/sys/vm/drop_caches":
+                self.cache = 0
+                return 0, "1\n"
+            case _:
+                return 127, f"sh: {cmd}: not found\n"
+
+    def qmp(self, cmd: str, args: dict) -> dict:
+        match cmd:
+            case "qmp_capabilities" | "quit":
+                return {}
+            case "query-status":
+                return {"status": "running", "running": True}
+            case "balloon" | "llfree-balloon":
+                self.resize(args["value"])
+                return {}
+            case "query-balloon" | "query-llfree-balloon":
+                return {"actual": self.size()}
+            case "query-iothreads":
+                # The simulation runs in a single thread
+                return []
+            case "qom-set" if args.get("property") == "requested-size":
+                self.resize(self.min + args["value"])
+                return {}
+            case "qom-get" if args.get("property") == "size":
+                return self.size() - self.min
+            case "qom-get" if args.get("property") == "requested-size":
+                return self._target - self.min
+        raise KeyError(cmd)
+
+
+async def serve(argv: Sequence[str] | None = None):
+    """Stand-in for the qemu process, serving QMP on a port and the guest agent on a socket"""
+    parser = ArgumentParser(description="Simulated vm")
+    parser.add_argument("--qmp", type=int, required=True)
+    parser.add_argument("--agent", type=Path, required=True)
+    parser.add_argument("--mode", choices=MODES, required=True)
+    parser.add_argument("-m", "--mem", type=int, required=True)
+    parser.add_argument("--min-mem", type=int, required=True)
+    parser.add_argument("--curve", type=json.loads, required=True)
+    parser.add_argument("--rate", type=float, default=1)
+    parser.add_argument("--frag", type=float, default=0.1)
+    parser.add_argument("--latency", type=float, default=0, help="Delay of every guest command in s")
+    parser.add_argument("--rss-scale", type=float, default=1 / 1024)
+    args = parser.parse_args(argv)
+
+    guest = Guest(
+        args.mode, args.mem, args.min_mem, [tuple(p) for p in args.curve],
+        args.rate, args.frag, rss_scale=args.rss_scale,
+    )
+    done = asyncio.Event()
+
+    async def qmp(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        writer.write(json.dumps({
+            "QMP": {
+                "version": {"qemu": {"micro": 0, "minor": 0, "major": 0}, "package": "sim"},
+                "capabilities": [],
+            }
+        }).encode() + b"\n")
+        decoder = json.JSONDecoder()
+        buffer = ""
+        while data := await reader.read(4096):
+            buffer += data.decode()
+            while buffer := buffer.lstrip():
+                try:
+                    msg, end = decoder.raw_decode(buffer)
+                except ValueError:
+                    break  # incomplete message
+                buffer = buffer[end:]
+                cmd = msg.get("execute", "")
+                try:
+                    reply = {"return": guest.qmp(cmd, msg.get("arguments", {}))}
+                except KeyError:
+                    reply = {"error": {"class": "CommandNotFound", "desc": f"Unsupported {cmd}"}}
+                if "id" in msg:
+                    reply["id"] = msg["id"]
+                writer.write(json.dumps(reply).encode() + b"\n")
+                await writer.drain()
+                if cmd == "quit":
+                    done.set()
+        writer.close()
+
+    async def agent(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        while line := await reader.readline():
+            await asyncio.sleep(args.latency)
+            ret, output = guest.exec(line.decode())
+            writer.write(f"{output}\n{AGENT_MARKER} {ret}\n".encode())
+            await writer.drain()
+        writer.close()
+
+    qmp_server = await asyncio.start_server(qmp, "127.0.0.1", args.qmp)
+    agent_server = await asyncio.start_unix_server(agent, args.agent)
+    print("Simulated vm running", flush=True)
+    try:
+        while not done.is_set():
+            guest.tick()
+            try:
+                await asyncio.wait_for(done.wait(), 0.1)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        qmp_server.close()
+        agent_server.close()
+        args.agent.unlink(missing_ok=True)
+
+
+def sim_vm(
+    qmp_port: int,
+    agent: Path,
+    mode: str,
+    mem: int,
+    min_mem: int,
+    curve: list[tuple[float, float]],
+    extra_args: list[str] | None = None,
+) -> Popen[str]:
+    """Start a simulated vm, the counterpart of `qemu_vm` for `AgentExec` and `QMPClient`"""
+    args = [
+        # fmt: off
+        sys.executable, "-m", "scripts.sim", "serve",
+        "--qmp", f"{qmp_port}",
+        "--agent", f"{agent}",
+        "--mode", mode,
+        "-m", f"{mem}",
+        "--min-mem", f"{min_mem}",
+        "--curve", json.dumps(curve),
+        *(extra_args or []),
+    ]
+    # scripts/qemu.py would shadow the qemu package if started as script
+    path = os.pathsep.join([str(ROOT), *filter(None, [os.environ.get("PYTHONPATH")])])
+    return Popen(args, stdout=PIPE, stderr=STDOUT, text=True, env={**os.environ, "PYTHONPATH": path})
+
+
+def parse_curve(value: str) -> list[tuple[float, float]]:
+    """Memory curve like `0:1,10:6,20:2` (seconds:GiB)"""
+    return [tuple(map(float, p.split(":"))) for p in value.split(",")]  # type: ignore
+
+
+def throughput(fn, text: str, n: int) -> dict[str, float]:
+    start = time()
+    for _ in range(n):
+        fn(text)
+    elapsed = time() - start
+    return {"calls": n / elapsed, "bytes": n * len(text) / elapsed}
+
+
+def stats(values: list[float]) -> dict[str, float]:
+    values = sorted(values)
+    return {
+        "mean": mean(values),
+        "median": median(values),
+        "p99": values[min(len(values) - 1, int(len(values) * 0.99))],
+        "max": values[-1],
+    }
+
+
+async def main(argv: Sequence[str] | None = None):
+    parser = ArgumentParser(
+        description="Benchmark the overhead of the harness (Measure, VMResize, parsers) on a simulated vm"
+    )
+    parser.add_argument("--mode", choices=MODES, default="virtio-mem")
+    parser.add_argument("-m", "--mem", type=int, default=16)
+    parser.add_argument("--qmp", type=int, default=5023)
+    parser.add_argument("--curve", type=parse_curve, default=parse_curve("0:1,10:12,20:12,30:2"),
+                        help="Guest memory usage over time, like `0:1,10:6` (seconds:GiB)")
+    parser.add_argument("--latency", type=float, default=0, help="Delay of every guest command in s")
+    parser.add_argument("--duration", type=int, default=30, help="Duration of the measurement loop in s")
+    parser.add_argument("--samples", type=int, default=200, help="Back to back samples for the sampling cost")
+    parser.add_argument("--parse-iters", type=int, default=10000)
+    parser.add_argument("--vmem-fraction", type=float, default=1 / 16)
+    parser.add_argument("--frag", action="store_true")
+    parser.add_argument("--compare", help="Previous overhead.json, fails on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative regression")
+    args, root = setup(parser, argv)
+
+    min_mem = round(args.mem / 8)
+    agent = root / "agent.sock"
+    vm = sim_vm(args.qmp, agent, args.mode, args.mem, min_mem, args.curve,
+                ["--latency", f"{args.latency}"])
+    client = None
+    guest_exec = AgentExec(agent)
+    try:
+        assert vm.stdout
+        vm.stdout.readline()  # wait until it is listening
+        await guest_exec.connect()
+        client = QMPClient("sim vm")
+        await client.connect(("127.0.0.1", args.qmp))
+
+        start = time()
+        for _ in range(args.samples):
+            await client.execute("query-status")
+        qmp_latency = (time() - start) / args.samples
+        start = time()
+        for _ in range(args.samples):
+            await guest_exec.run("true")
+        exec_latency = (time() - start) / args.samples
+
+        vm_resize = VMResize(
+            client, args.mode, args.mem * 2**30, min_mem * 2**30, args.mem * 2**30, args.vmem_fraction
+        )
+        measure = Measure(root, 0, guest_exec, Process(vm.pid), args, callback=vm_resize.auto_resize)  # type: ignore
+        # Back to back samples, the cost of a single sample
+        costs = []
+        for _ in range(args.samples):
+            start = time()
+            await measure()
+            costs.append(time() - start)
+
+        # Sampling loop of the benchmarks, the interval should be 1s
+        measure = Measure(root, 1, guest_exec, Process(vm.pid), args, callback=vm_resize.auto_resize)  # type: ignore
+        await measure.wait(sec=args.duration)
+        with (root / "out_1.csv").open() as f:
+            times = [float(line.split(",")[0]) for line in f.readlines()[1:]]
+        drift = [t1 - t0 - 1 for t0, t1 in zip(times, times[1:])]
+
+        guest = Guest(args.mode, args.mem, min_mem, args.curve)
+        results = {
+            "qmp_latency": qmp_latency,
+            "exec_latency": exec_latency,
+            "sample": stats(costs),
+            "drift": stats(drift),
+            "parse": {
+                "buddyinfo": throughput(free_pages, guest.buddyinfo(), args.parse_iters),
+                "meminfo": throughput(parse_meminfo, guest.meminfo(), args.parse_iters),
+                "zoneinfo": throughput(
+                    lambda z: parse_zoneinfo(z, "present "), guest.zoneinfo(), args.parse_iters
+                ),
+            },
+            "final_size": await vm_resize.query(),
+        }
+        (root / "overhead.json").write_text(json.dumps(results))
+        print(json.dumps(results, indent=2))
+    finally:
+        await guest_exec.disconnect()
+        if client:
+            try:
+                await client.execute("quit")
+            except QMPError:
+                pass  # not connected, the simulator is terminated below
+            await client.disconnect()
+        try:
+            vm.wait(10)
+        except TimeoutExpired:
+            print("simulator did not quit -> terminate!")
+            vm.terminate()
+            try:
+                vm.wait(10)
+            except TimeoutExpired:
+                vm.kill()
+                vm.wait()
+
+    if args.compare:
+        regressions = compare(json.loads(Path(args.compare).read_text()), results, args.tolerance)
+        for name, old, new in regressions:
+            print(f"\033[33mWARNING: {name} regressed from {old:.4g} to {new:.4g}\033[0m")
+        if regressions:
+            sys.exit(1)
+
+
+def compare(old: dict, new: dict, tolerance: float) -> list[tuple[str, float, float]]:
+    """Lower is better for times and drift, higher for the parser throughput"""
+    out = []
+    checks = [
+        # name, higher is better, absolute noise floor
+        ("sample.median", False, 1e-3), ("sample.p99", False, 1e-3),
+        # the timestamps of the csv have a resolution of 10ms
+        ("drift.median", False, 0.01),
+        ("parse.buddyinfo.calls", True, 0), ("parse.meminfo.calls", True, 0),
+        ("parse.zoneinfo.calls", True, 0),
+    ]
+    for name, higher, floor in checks:
+        a, b = old, new
+        for key in name.split("."):
+            a, b = a[key], b[key]
+        if higher:
+            regressed = b < a * (1 - tolerance)
+        else:
+            regressed = b > a * (1 + tolerance) and b - a > floor
+        if regressed:
+            out.append((name, a, b))
+    return out
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["serve"]:
+        asyncio.run(serve(sys.argv[2:]))
+    else:
+        asyncio.run(main())
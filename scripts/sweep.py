@@ -0,0 +1,121 @@
+from collections.abc import Callable, Coroutine, Sequence
+import csv
+from dataclasses import dataclass
+import itertools
+import json
+from pathlib import Path
+import traceback
+from typing import Any
+
+
+@dataclass
+class Point:
+    """A single configuration of a parameter sweep."""
+
+    name: str
+    """Output directory of this configuration"""
+    values: dict[str, Any]
+    args: list[str]
+    """Benchmark arguments of this configuration"""
+
+
+def grid(
+    axes: dict[str, Sequence[Any]],
+    args: Callable[[dict[str, Any]], list[str]],
+    name: Callable[[dict[str, Any]], str] | None = None,
+) -> list[Point]:
+    """The cartesian product of the axes, the last axis changes fastest"""
+    if name is None:
+        name = lambda values: "-".join(f"{k}{v}" for k, v in values.items())
+    return [
+        Point(name(values), values, args(values))
+        for values in (dict(zip(axes, c)) for c in itertools.product(*axes.values()))
+    ]
+
+
+def split_argv(argv: Sequence[str] | None, default: Sequence[str]) -> tuple[list[str], list[str]]:
+    """Split the arguments at `--` into the sweep and the benchmark arguments"""
+    argv = list(default if argv is None else argv)
+    split = argv.index("--") if "--" in argv else len(argv)
+    return argv[:split], argv[split + 1:]
+
+
+def workloads(
+    benches: dict[str, Callable[[Sequence[str]], Coroutine]]
+) -> Callable[[Sequence[str]], Coroutine]:
+    """A benchmark that runs the one of `benches` given by the first argument"""
+
+    async def bench(argv: Sequence[str]):
+        await benches[argv[0]](argv[1:])
+
+    return bench
+
+
+async def sweep(
+    bench: Callable[[Sequence[str]], Coroutine],
+    root: Path,
+    points: list[Point],
+    args: list[str],
+    done: str = "convergence.json",
+    group: str | None = None,
+) -> dict[str, Path]:
+    """
+    Run the benchmark for every point of the sweep, each into its own directory of `root`.
+
+    Points whose `done` file exists are skipped, so that an interrupted sweep
+    can be continued. Failed points (including invalid arguments) are reported,
+    per value of the `group` axis if given, and skipped. The points and their
+    results are listed in `sweep.json`. Returns the results of the successful points.
+    """
+    results: dict[str, Path] = {}
+    failed: list[str] = []
+    for n, point in enumerate(points):
+        out = root / point.name
+        if not (out / done).exists():
+            print(f"\n\x1b[94mSweep {n + 1}/{len(points)}: {point.name}\x1b[0m")
+            # The harness is isolated once by the sweep
+            run_args = args + point.args + ["--housekeeping", "none"]
+            run_args += ["--root", str(root), "--suffix", point.name, "--no-timestamp"]
+            try:
+                await bench(run_args)
+            except (Exception, SystemExit):
+                traceback.print_exc()
+                print(f"\033[33mWARNING: {point.name} failed\033[0m")
+                failed.append(point.name)
+                continue
+        results[point.name] = out
+
+    for value in dict.fromkeys(p.values[group] for p in points) if group else [None]:
+        if names := [p.name for p in points if p.name in failed and (group is None or p.values[group] == value)]:
+            kind = f"{value} " if group else ""
+            print(f"\033[33mWARNING: {len(names)} {kind}points failed: {names}\033[0m")
+
+    (root / "sweep.json").write_text(json.dumps({
+        "points": [{"name": p.name, "values": p.values, "args": p.args} for p in points],
+        "failed": failed,
+    }))
+    return results
+
+
+def collect(
+    path: Path,
+    points: list[Point],
+    results: dict[str, Path],
+    columns: list[str],
+    rows: Callable[[Point, Path], list[dict[str, Any]]],
+):
+    """
+    Write the `rows` of every successful point into a csv.
+
+    Every row is prefixed by the values of its point and its index (`iter`),
+    missing values (None) are left empty.
+    """
+    with path.open("w+") as f:
+        writer = csv.writer(f)
+        writer.writerow([*(points[0].values if points else []), "iter", *columns])
+        for point in points:
+            if point.name not in results:
+                continue
+            for i, row in enumerate(rows(point, results[point.name])):
+                values = [*point.values.values(), i, *(row[c] for c in columns)]
+                writer.writerow(["" if v is None else v for v in values])
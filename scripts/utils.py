@@ -4,13 +4,22 @@ import fcntl
 import json
 import os
 import re
+import shlex
 from argparse import ArgumentParser, Namespace
 from datetime import datetime
 from pathlib import Path
 from subprocess import CalledProcessError, Popen, PIPE, STDOUT, check_output
-from typing import IO, Any
+from time import time
+from typing import IO, TYPE_CHECKING, Any
+import sys
 
-import pandas as pd
+sys.path.append(str(Path(__file__).parent.parent))
+from scripts.cpuset import default_housekeeping, isolate_harness, layout, parse_cpus
+from scripts.preflight import preflight
+
+if TYPE_CHECKING:
+    # Only needed by the plots, keep it out of the benchmark startup
+    import pandas as pd
 
 ANSI_ESCAPE = re.compile(r"\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])")
 
@@ -37,22 +46,43 @@ def setup(
     parser.add_argument(
         "--root", default="results", help="Root directory for the results"
     )
+    parser.add_argument(
+        "--housekeeping",
+        default="none",
+        help="Cpus for the harness and its subprocesses, like `30-31`, 'auto' for the last core, or 'none' (default)",
+    )
+    parser.add_argument(
+        "--tune",
+        action="store_true",
+        help="Disable host noise sources like turbo, SMT and KSM (requires root)",
+    )
     args = parser.parse_args(argv)
 
     prefix = "" if args.no_timestamp else f"{timestamp()}-"
-    suffix = args.suffix
-    if suffix == "unknown":
-        if "mode" in args and args.mode:
-            suffix = args.mode
-        if "target" in args and args.target:
-            suffix = f"{args.target}-{suffix}"
+    suffix = run_name(args.suffix, getattr(args, "mode", None), getattr(args, "target", None))
 
     root = Path(args.root) / (prefix + suffix)
     root.mkdir(parents=True, exist_ok=True)
+
+    # Before the isolation, tuning may take the smt siblings offline
+    host = preflight(args.tune)
+    if args.housekeeping != "none":
+        cpus = (
+            default_housekeeping()
+            if args.housekeeping == "auto"
+            else parse_cpus(args.housekeeping)
+        )
+        isolate_harness(cpus)
+    # The benchmark that called setup, also if it runs as `__main__`
+    caller = sys._getframe(1).f_globals
+    module = spec.name if (spec := caller.get("__spec__")) else caller.get("__name__")
     with (root / "meta.json").open("w+") as f:
         values = {
+            "module": module,
             "args": vars(args),
             "sys": sys_info(),
+            "preflight": host,
+            "cpuset": layout(),
             "git": git_info(vars(args)),
         }
         if custom:
@@ -61,6 +91,23 @@ def setup(
     return args, root
 
 
+def run_name(suffix: str = "unknown", mode: str | None = None, target: str | None = None) -> str:
+    """Name of the output directory of a run (without the timestamp)"""
+    if suffix == "unknown":
+        if mode:
+            suffix = mode
+        if target:
+            suffix = f"{target}-{suffix}"
+    return suffix
+
+
+def update_meta(root: Path, key: str, value: Any):
+    """Add or replace an entry of the run metadata"""
+    meta = json.loads((root / "meta.json").read_text())
+    meta[key] = value
+    (root / "meta.json").write_text(json.dumps(meta))
+
+
 def timestamp() -> str:
     return datetime.now().strftime("%y%m%d-%H%M%S")
 
@@ -98,15 +145,36 @@ def fmt_bytes(bytes: int) -> str:
 class SSHExec:
     """Executing shell commands over ssh."""
 
-    def __init__(self, user: str, host: str = "localhost", port: int = 22) -> None:
+    def __init__(
+        self,
+        user: str,
+        host: str = "localhost",
+        port: int = 22,
+        proxy: str | None = None,
+    ) -> None:
+        """`proxy` is an optional ssh ProxyCommand, e.g., for connecting over vsock"""
         self.user = user
         self.host = host
         self.port = port
+        self.proxy = proxy
+
+    def _opts(self) -> list[str]:
+        if self.host == "localhost" and not self.proxy:
+            return ["-o NoHostAuthenticationForLocalhost=yes"]
+        # The guests are recreated for every run, do not remember their keys
+        opts = [
+            "-o StrictHostKeyChecking=no",
+            "-o UserKnownHostsFile=/dev/null",
+            "-o LogLevel=ERROR",
+        ]
+        if self.proxy:
+            opts.append(f"-o ProxyCommand={self.proxy}")
+        return opts
 
     def _ssh(self) -> list[str]:
         return [
             "ssh",
-            "-o NoHostAuthenticationForLocalhost=yes",
+            *self._opts(),
             f"{self.user}@{self.host}",
             f"-p {self.port}",
         ]
@@ -165,7 +233,7 @@ class SSHExec:
         async with asyncio.timeout(30):
             ssh_args = [
                 # fmt: off
-                "scp", "-o NoHostAuthenticationForLocalhost=yes", f"-P{self.port}",
+                "scp", *self._opts(), f"-P{self.port}",
                 source, f"{self.user}@{self.host}:{dest}",
             ]
             process = await asyncio.create_subprocess_exec(*ssh_args)
@@ -177,26 +245,139 @@ class SSHExec:
         async with asyncio.timeout(30):
             ssh_args = [
                 # fmt: off
-                "scp", "-o NoHostAuthenticationForLocalhost=yes", f"-P{self.port}",
+                "scp", *self._opts(), f"-P{self.port}",
                 f"{self.user}@{self.host}:{source}", dest,
             ]
             process = await asyncio.create_subprocess_exec(*ssh_args)
             if (ret := await process.wait()) != 0:
                 raise CalledProcessError(ret, ssh_args)
 
+    async def download_archive(
+        self, source: str | Path, dest: Path, patterns: list[str], throughput: float = 2**23
+    ) -> dict[str, int]:
+        """
+        Download all files matching the glob patterns from the source directory.
+
+        Over a single ssh connection, the guest sends a manifest of the files
+        and their sizes, followed by a compressed tar archive that is unpacked
+        while the data arrives. The timeout scales with the total size, assuming
+        at least `throughput` bytes/s. Returns the downloaded files and their sizes.
+        """
+        names = " -o ".join(f"-name {shlex.quote(p)}" for p in patterns)
+        # The manifest lines are `<size> <name>`, terminated by an empty line
+        ssh_args = [
+            *self._ssh(),
+            f"cd {shlex.quote(str(source))}"
+            f" && list=$(find . -maxdepth 1 -type f \\( {names} \\) -printf '%s %P\\n')"
+            " && printf '%s\\n\\n' \"$list\""
+            " && if [ -n \"$list\" ]; then printf '%s\\n' \"$list\" | sed 's|^[0-9]* |./|' | tar -czf - -T -; fi",
+        ]
+        ssh = await asyncio.create_subprocess_exec(*ssh_args, stdout=PIPE)
+        tar = None
+        assert ssh.stdout
+        try:
+            files: dict[str, int] = {}
+            async with asyncio.timeout(30):
+                while line := (await ssh.stdout.readline()).decode().rstrip("\n"):
+                    size, name = line.split(" ", 1)
+                    files[name] = int(size)
+            if not files:
+                await ssh.communicate()
+                if ssh.returncode != 0:
+                    raise CalledProcessError(ssh.returncode, ssh_args)
+                print(f"\033[33mWARNING: no files matching {patterns} in {source}\033[0m")
+                return files
+
+            dest.mkdir(parents=True, exist_ok=True)
+            tar = await asyncio.create_subprocess_exec(
+                "tar", "-xzf", "-", "-C", str(dest), stdin=PIPE
+            )
+            assert tar.stdin
+            async with asyncio.timeout(30 + sum(files.values()) / throughput):
+                while chunk := await ssh.stdout.read(2**20):
+                    tar.stdin.write(chunk)
+                    await tar.stdin.drain()
+                tar.stdin.close()
+                if (ret := await ssh.wait()) != 0:
+                    raise CalledProcessError(ret, ssh_args)
+                if (ret := await tar.wait()) != 0:
+                    raise CalledProcessError(ret, "tar -xzf")
+        finally:
+            for process in [ssh, tar]:
+                if process and process.returncode is None:
+                    process.kill()
+
+        for name, size in files.items():
+            actual = (dest / name).stat().st_size
+            assert actual == size, f"{name}: expected {size} bytes, got {actual}"
+        return files
+
+
+async def transport_stats(ssh: SSHExec, size: int = 0, n: int = 5) -> dict[str, float]:
+    """
+    Measures the command latency (s) and, if a `size` is given,
+    the up/download throughput (bytes/s) of ssh.
+    """
+    latency = []
+    for _ in range(n):
+        start = time()
+        await ssh.run("true", timeout=30)
+        latency.append(time() - start)
+    if not size:
+        return {"latency": sorted(latency)[n // 2]}
+
+    start = time()
+    process = await asyncio.create_subprocess_exec(
+        *ssh._ssh(), f"head -c {size} /dev/zero", stdout=PIPE
+    )
+    received = 0
+    assert process.stdout
+    while chunk := await process.stdout.read(2**20):
+        received += len(chunk)
+    await process.wait()
+    assert received == size, "Incomplete download"
+    download = size / (time() - start)
+
+    start = time()
+    process = await asyncio.create_subprocess_exec(
+        *ssh._ssh(), "cat > /dev/null", stdin=PIPE
+    )
+    assert process.stdin
+    chunk = bytes(2**20)
+    for _ in range(size // len(chunk)):
+        process.stdin.write(chunk)
+        await process.stdin.drain()
+    process.stdin.close()
+    await process.wait()
+    upload = size / (time() - start)
+
+    return {
+        "latency": sorted(latency)[n // 2],
+        "download": download,
+        "upload": upload,
+    }
+
 
 def free_pages(buddyinfo: str) -> tuple[int, int]:
     """Calculates the number of free small and huge pages from the buddy allocator state."""
+    nodes = free_pages_nodes(buddyinfo).values()
+    return sum(small for small, _ in nodes), sum(huge for _, huge in nodes)
+
+
+def free_pages_nodes(buddyinfo: str) -> dict[int, tuple[int, int]]:
+    """The number of free small and huge pages of every numa node."""
     try:
-        small = 0
-        huge = 0
+        nodes: dict[int, tuple[int, int]] = {}
         for line in buddyinfo.splitlines():
+            node = int(line.split()[1].rstrip(","))
+            small, huge = nodes.get(node, (0, 0))
             orders = line.split()[4:]
             for order, free in enumerate(orders):
                 small += int(free) << order
                 if order >= 9:
                     huge += int(free) << (order - 9)
-        return small, huge
+            nodes[node] = (small, huge)
+        return nodes
     except Exception as e:
         print(f"Invalid buddyinfo: '{buddyinfo}'")
         raise e
@@ -282,7 +463,7 @@ def dump_dref(file: IO, prefix: str, data: dict[str | int | float, Any]):
             file.write(f"\\drefset{{{prefix}/{key}}}{{{value}}}\n")
 
 
-def dref_dataframe(name: str, dir: Path, groupby: list[str], data: pd.DataFrame):
+def dref_dataframe(name: str, dir: Path, groupby: list[str], data: "pd.DataFrame"):
     out = {}
     data = data.dropna(axis=0).groupby(groupby).mean(numeric_only=True)
     for index, row in data.iterrows():
@@ -295,7 +476,7 @@ def dref_dataframe(name: str, dir: Path, groupby: list[str], data: pd.DataFrame)
 
 
 def dref_dataframe_multi(
-    name: str, dir: Path, groupby: list[str], vars: list[str], data: pd.DataFrame
+    name: str, dir: Path, groupby: list[str], vars: list[str], data: "pd.DataFrame"
 ):
     out = {}
     for var in vars:
@@ -11,25 +11,36 @@ HUGEPAGE_SIZE = 2**21
 """Size of a huge page in bytes"""
 
 class VMResize:
-    def __init__(self, qmp: QMPClient, mode: str, max: int, min: int, init: int, auto_fraction: int | None = None) -> None:
-        """min and max are the VM memory limits in bytes"""
+    def __init__(self, qmp: QMPClient, mode: str, max: int, min: int, init: int, auto_fraction: int | None = None, nodes: int = 1, block_size: int = HUGEPAGE_SIZE, record: bool = False) -> None:
+        """
+        min and max are the VM memory limits in bytes, virtio-mem has a device per numa node.
+        The sizes of virtio-mem are aligned to its block size (bytes).
+        With `record`, the achieved size of every request is queried when it is replaced.
+        """
         self.qmp = qmp
         self.mode = mode
         self.min = round(min)
         self.max = round(max)
         self.size = init if init is not None else min
         self.auto_fraction = auto_fraction
+        self.nodes = nodes
+        self.align = block_size if mode == "virtio-mem" and block_size > HUGEPAGE_SIZE else HUGEPAGE_SIZE
+        self.record = record
+        self.requests: list[tuple[int, int]] = []
+        """(requested, achieved) size in bytes of every request when it was replaced by the next one (only with `record`)"""
 
     async def set(self, target_size: int | float):
         """Resize the VM to the target_size (bytes)"""
         new_size = round(target_size)
 
-        # align up to hugepage size
-        new_size = ((new_size + HUGEPAGE_SIZE - 1) // HUGEPAGE_SIZE) * HUGEPAGE_SIZE
+        # align up to hugepage (or virtio-mem block) size
+        new_size = ((new_size + self.align - 1) // self.align) * self.align
         new_size = max(self.min, min(self.max, new_size))
 
         if new_size == self.size: return
 
+        if self.record:
+            self.requests.append((self.size, await self.query()))
         self.size = new_size
         print("resize", fmt_bytes(self.size))
 
@@ -39,11 +50,14 @@ class VMResize:
             case "llfree-manual" | "llfree-manual-map":
                 await self.qmp.execute("llfree-balloon", {"value" : self.size})
             case "virtio-mem":
-                await self.qmp.execute("qom-set", {
-                    "path": "vm0",
-                    "property": "requested-size",
-                    "value" : self.size - self.min
-                })
+                # Evenly distributed over the nodes
+                per_node = (self.size - self.min) // self.nodes // self.align * self.align
+                for node in range(self.nodes):
+                    await self.qmp.execute("qom-set", {
+                        "path": f"vm{node}",
+                        "property": "requested-size",
+                        "value" : per_node
+                    })
             case _: assert False, "Invalid Mode"
 
     async def query(self) -> int:
@@ -55,7 +69,9 @@ class VMResize:
                 res = await self.qmp.execute("query-llfree-balloon")
                 return res["actual"]
             case "virtio-mem":
-                res = await self.qmp.execute("qom-get", {"path": "vm0", "property": "size"})
+                res = 0
+                for node in range(self.nodes):
+                    res += await self.qmp.execute("qom-get", {"path": f"vm{node}", "property": "size"})
                 return self.min + res
             case _: assert False, "Invalid Mode"
 
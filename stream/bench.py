@@ -6,15 +6,18 @@ from subprocess import CalledProcessError, Popen
 from asyncio import sleep
 from abc import ABC, abstractmethod
 import asyncio
+import json
 from time import time
 import sys
 
 from qemu.qmp import QMPClient
 
 sys.path.append(str(Path(__file__).parent.parent))
+from scripts.cache import ArtifactCache
 from scripts.config import BALLOON_CFG, DEFAULT_DISK, ModeAction
-from scripts.qemu import qemu_vm, qemu_wait_startup
-from scripts.utils import SSHExec, non_block_read, rm_ansi_escape, setup
+from scripts.qemu import Disk, Pinning, Topology, Transport, qemu_vm, qemu_wait_startup
+from scripts.cpuset import check_numa, layout
+from scripts.utils import SSHExec, non_block_read, rm_ansi_escape, setup, update_meta
 from scripts.vm_resize import VMResize
 
 # Selected Spec benches an their respective memory consumption in MiB (1 copy)
@@ -89,8 +92,10 @@ class Stream(Bench):
         if self._threads < 2:
             openmp = ""
 
-        await self._ssh.run(
-            f"gcc -O2 {openmp} -DSTREAM_ARRAY_SIZE={self._size} -DNTIMES={self._iters} {self._bench} {self._HOME}stream.c -o {self._HOME}stream.elf"
+        await ArtifactCache(self._ssh).build(
+            f"{self._HOME}stream.c",
+            f"gcc -O2 {openmp} -DSTREAM_ARRAY_SIZE={self._size} -DNTIMES={self._iters} {self._bench} {self._HOME}stream.c -o {self._HOME}stream.elf",
+            f"{self._HOME}stream.elf",
         )
 
         # Clear remaining artifacts of previous runs
@@ -109,7 +114,7 @@ class Stream(Bench):
 
     async def results(self):
         # Collect results
-        await self._ssh.download(Path(self._HOME) / "*.csv", self._results)
+        await self._ssh.download_archive(self._HOME, self._results, ["*.csv"])
 
 
 class FTQ(Bench):
@@ -141,10 +146,12 @@ class FTQ(Bench):
         # Build the matching version of FTQ
         # Threaded FTQ does not accept `-t 1` -.-
         print("Building FTQ")
-        if self._threads < 2:
-            await self._ssh.run(f"cd {self._HOME}; make ftq")
-        else:
-            await self._ssh.run(f"cd {self._HOME}; make t_ftq")
+        target = "ftq" if self._threads < 2 else "t_ftq"
+        await ArtifactCache(self._ssh).build(
+            f"{self._HOME}*.c {self._HOME}*.h {self._HOME}Makefile",
+            f"cd {self._HOME}; make {target}",
+            f"{self._HOME}{target}",
+        )
 
         # Clear remaining artifacts of previous runs
         await self._ssh.run(f"rm -rf {self._HOME}*.dat")
@@ -161,7 +168,7 @@ class FTQ(Bench):
             )
 
     async def results(self):
-        await self._ssh.download(Path(self._HOME) / "*.dat", self._results)
+        await self._ssh.download_archive(self._HOME, self._results, ["*.dat"])
         if self._threads == 1:
             (self._results / "ftq_0_counts.dat").rename(self._results / "counts.dat")
             (self._results / "ftq_0_times.dat").rename(self._results / "times.dat")
@@ -216,6 +223,7 @@ async def main(argv: Sequence[str] | None = None):
     parser.add_argument("--qmp", type=int, default=5023)
     parser.add_argument("-m", "--mem", type=int, default=20)
     parser.add_argument("-c", "--cores", type=int, default=12)
+    parser.add_argument("--core-start", type=int, default=0, help="First core the vm is pinned to")
     parser.add_argument(
         "--mode", choices=[*BALLOON_CFG.keys()], required=True, action=ModeAction
     )
@@ -232,6 +240,10 @@ async def main(argv: Sequence[str] | None = None):
     parser.add_argument("--vfio", type=int,
                         help="Bound VFIO group for passthrough. This passes through all devices in the group")
     parser.add_argument("--vfio-dev", type=str, help="Device from a bound VFIO group for passthrough")
+    Disk.args(parser)
+    Transport.args(parser)
+    Pinning.args(parser)
+    Topology.args(parser)
     Stream.args(parser)
     FTQ.args(parser)
     args, root = setup(parser, argv)
@@ -245,30 +257,40 @@ async def main(argv: Sequence[str] | None = None):
         try:
             min_mem = args.mem - args.max_balloon
             print(f"Starting qemu: mem={min_mem}..{args.mem}")
-            extra_args = BALLOON_CFG[args.mode](args.cores, args.mem, min_mem, args.mem)
+            extra_args = BALLOON_CFG[args.mode](args.cores, args.mem, min_mem, args.mem, args.sockets, args.host_nodes)
             qemu = qemu_vm(
                 args.qemu,
                 args.port,
                 args.kernel,
                 args.cores,
+                sockets=args.sockets,
                 hda=args.img,
+                disk=Disk.from_args(args),
+                transport=Transport.from_args(args),
                 qmp_port=args.qmp,
                 extra_args=extra_args,
                 vfio_group=args.vfio,
                 vfio_device=args.vfio_dev,
+                core_start=args.core_start,
+                extra_cores=Pinning.from_args(args).cores(),
             )
             await qemu_wait_startup(qemu, root / "boot.txt")
 
             qmp = QMPClient("STREAM machine")
             await qmp.connect(("127.0.0.1", args.qmp))
+            pinned = await Pinning.from_args(args).apply(qmp, qemu.pid)
+            (res_dir / "pinning.json").write_text(json.dumps(pinned))
 
             min_bytes = min_mem * 1024**3
             max_bytes = args.mem * 1024**3
-            vm_resize = VMResize(qmp, args.mode, max_bytes, min_bytes, max_bytes)
+            vm_resize = VMResize(qmp, args.mode, max_bytes, min_bytes, max_bytes, nodes=args.sockets)
 
             print("Started")
             (res_dir / "cmd.sh").write_text(shlex.join(qemu.args))
-            ssh = SSHExec(args.user, port=args.port)
+            update_meta(root, "cpuset", layout())
+            ssh = await Transport.from_args(args).connect(
+                args.user, args.port, res_dir / "transport.json"
+            )
             if args.spec:
                 await gen_spec(ssh, root, args.workload_mem, args.workload_time)
 
@@ -314,6 +336,7 @@ async def main(argv: Sequence[str] | None = None):
 
             # Collect results
             await bench.results()
+            (res_dir / "numa.json").write_text(json.dumps(check_numa(qemu.pid)))
 
             # Cleanup
             print("Terminating...")
@@ -0,0 +1,65 @@
+import warnings
+
+warnings.filterwarnings("ignore")
+
+import pandas as pd
+import seaborn as sns
+from pathlib import Path
+import matplotlib
+import matplotlib.pyplot as plt
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+from scripts.utils import dref_dataframe
+
+METRICS = {
+    "inflate": {"shrink": "Reclaim [GiB/s]", "grow": "Return [GiB/s]", "failure": "Failed Unplugs"},
+    "compiling": {"gib_min": "Footprint [GiB·min]", "build": "Build Time [s]", "failure": "Failed Unplugs"},
+}
+"""Plotted columns of `vmem/sweep.py` for every workload"""
+
+
+def init():
+    sns.set_style("whitegrid")
+    sns.set_context("poster", font_scale=0.75)
+    sns.set_palette("colorblind6")
+    matplotlib.rcParams["pdf.fonttype"] = 42
+    matplotlib.rcParams["ps.fonttype"] = 42
+
+
+def visualize(
+    file: Path,
+    save_as: str | None = None,
+    out: Path = Path("out"),
+    height: float = 3.5,
+    aspect: float = 1.2,
+):
+    """Throughput, unplug failure rate, and footprint over the block size (rows: workloads)"""
+    data = pd.read_csv(file)
+    # The first iteration is a warmup
+    if data["iter"].max() > 0:
+        data = data[data["iter"] > 0]
+    data["failure"] = (data["failed"] / data["unplugs"]).fillna(0)
+    data["step"] = data["fraction"].map(lambda f: "manual" if pd.isna(f) else f"1/{round(1 / f)}")
+    workloads = [w for w in METRICS if w in data["workload"].unique()]
+
+    fig, axes = plt.subplots(
+        len(workloads), 3, figsize=(3 * height * aspect, len(workloads) * height), squeeze=False
+    )
+    for row, workload in zip(axes, workloads):
+        wdata = data[data["workload"] == workload]
+        style = "step" if wdata["step"].nunique() > 1 else None
+        for ax, (col, label) in zip(row, METRICS[workload].items()):
+            sns.lineplot(wdata, x="block_size", y=col, hue="state", style=style, marker="o", ax=ax,
+                         legend=ax is row[0])
+            ax.set(xscale="log", xlabel="Block Size [MiB]", ylabel=label, ylim=(0, None), title=workload)
+            ax.set_xticks(sorted(wdata["block_size"].unique()),
+                          labels=map(str, sorted(wdata["block_size"].unique())))
+    fig.tight_layout()
+
+    if save_as:
+        fig.savefig(out / f"{save_as}.pdf", bbox_inches="tight")
+        fig.savefig(out / f"{save_as}.svg", bbox_inches="tight")
+        dref_dataframe(save_as, out, ["workload", "state", "step", "block_size"],
+                       data[["workload", "state", "step", "block_size", "failure"]])
+    return fig
@@ -0,0 +1,116 @@
+from argparse import ArgumentParser
+import asyncio
+from collections.abc import Sequence
+import csv
+import json
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+from compiling.bench import TARGET, main as compiling
+from inflate.bench import main as inflate
+from scripts.adaptive import gib_min
+from scripts.sweep import collect, grid, split_argv, sweep, workloads
+from scripts.utils import setup
+
+WORKLOADS = {
+    "inflate": inflate,
+    "compiling": compiling,
+}
+"""Benchmarks of the sweep, virtio-mem is resized manually by inflate and automatically by compiling"""
+
+
+def unplug_failures(requests: list[tuple[int, int]], block: int) -> tuple[int, int]:
+    """Number of unplug requests and of those that were not achieved until the next request"""
+    unplugs = failed = 0
+    for (prev, _), (req, achieved) in zip(requests, requests[1:]):
+        if req < prev:
+            unplugs += 1
+            failed += achieved > req + block
+    return unplugs, failed
+
+
+def results(workload: str, out: Path) -> list[dict[str, float | None]]:
+    """Resize throughput (GiB/s), unplug failures, and footprint of every iteration"""
+    meta = json.loads((out / "meta.json").read_text())
+    rows = []
+    if workload == "inflate":
+        mem = meta["args"]["mem"]
+        with (out / "out.csv").open() as f:
+            for row in csv.DictReader(f):
+                # Only the achieved size is reclaimed
+                shrink, grow = (int(row[k]) / 1e9 for k in ["shrink", "grow"])
+                reclaimed = mem - int(row["achieved"]) / 1024**3
+                rows.append({
+                    "shrink": reclaimed / shrink if shrink else 0, "grow": reclaimed / grow if grow else 0,
+                    "unplugs": 1, "failed": int(int(row["achieved"]) > 1.01 * int(row["requested"])),
+                    "build": None, "gib_min": None,
+                })
+    else:
+        block = (meta["args"]["vmem_block_size"] or 2) * 1024**2
+        i = 0
+        while (file := out / f"times_{i}.json").exists():
+            build = json.loads(file.read_text())["build"][0]
+            unplugs, failed = unplug_failures(json.loads((out / f"resize_{i}.json").read_text()), block)
+            rows.append({
+                "shrink": None, "grow": None, "unplugs": unplugs, "failed": failed,
+                "build": build, "gib_min": gib_min(out / f"out_{i}.csv", build),
+            })
+            i += 1
+    return rows
+
+
+async def main(argv: Sequence[str] | None = None):
+    parser = ArgumentParser(
+        description="Run the inflate and compiling benchmarks with virtio-mem for different block sizes,"
+        " onlining policies, and resize steps."
+        " Arguments after `--` are passed to both benchmarks (e.g., -m16 -c8 --img ...)."
+    )
+    parser.add_argument("--workloads", nargs="+", choices=list(WORKLOADS.keys()), default=list(WORKLOADS.keys()))
+    parser.add_argument("--block-sizes", type=int, nargs="+", default=[2, 8, 32, 128], help="Block sizes in MiB")
+    parser.add_argument("--states", nargs="+", choices=["online_movable", "online_kernel", "online"],
+                        default=["online_movable", "online_kernel", "online"])
+    parser.add_argument("--fractions", type=float, nargs="+", default=[1 / 32, 1 / 16, 1 / 8],
+                        help="Resize steps of compiling, relative to the vm memory")
+    parser.add_argument("--target", choices=list(TARGET.keys()), default="linux", help="Target of compiling")
+    parser.add_argument("--module", help="Kernel module of inflate, otherwise inflate runs with --nofault")
+    parser.add_argument("--resize-timeout", type=int, default=120,
+                        help="Seconds until inflate gives up on a resize and records the achieved size")
+    parser.add_argument("-i", "--iter", type=int, default=3)
+    parser.add_argument("--plot", action="store_true", help="Plot throughput, failures, and footprint afterwards")
+    sweep_argv, bench_args = split_argv(argv, sys.argv[1:])
+    args, root = setup(parser, sweep_argv)
+    bench_args += ["--mode", "virtio-mem", "-i", f"{args.iter}"]
+    workload_args = {
+        "inflate": [*(["--module", args.module] if args.module else ["--nofault"]),
+                    "--resize-timeout", f"{args.resize_timeout}"],
+        "compiling": ["--target", args.target, "--record-resizes"],
+    }
+
+    points = []
+    for workload in args.workloads:
+        points += grid(
+            # Inflate resizes manually, without steps
+            {"workload": [workload], "block_size": args.block_sizes, "state": args.states,
+             "fraction": args.fractions if workload == "compiling" else [None]},
+            lambda v: [
+                v["workload"], *bench_args, *workload_args[v["workload"]],
+                "--vmem-block-size", f"{v['block_size']}", "--memhp-state", v["state"],
+                *(["--vmem-fraction", f"{v['fraction']}"] if v["fraction"] else []),
+            ],
+            lambda v: f"{v['workload']}-b{v['block_size']}-{v['state']}"
+            + (f"-f{v['fraction']:g}" if v["fraction"] else ""),
+        )
+    done = await sweep(workloads(WORKLOADS), root, points, [], group="workload")
+    collect(root / "sweep.csv", points, done, ["shrink", "grow", "unplugs", "failed", "build", "gib_min"],
+            lambda point, out: results(point.values["workload"], out))
+
+    if args.plot:
+        from vmem import plot as vmem_plot
+
+        vmem_plot.init()
+        vmem_plot.visualize(root / "sweep.csv", save_as="sweep", out=root)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())